@@ -1 +1,7 @@
 #! /usr/bin/env python3
+
+import os
+import sys
+
+# the modules import each other by name, as when main.py runs from this directory, also when installed as a package
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
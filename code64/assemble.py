@@ -1,24 +1,29 @@
 #! /usr/bin/env python3
 
+import math
+import ast
+import functools
+import mmap
 import os
-import unittest
+import re
+import time
+import types
 import glob
 
-#--
-import pathlib, sys
-sys.path.append(str(pathlib.Path(__file__).parent.absolute()))
-#--
-
+import checkpoint
 import cpu
 import eval
-import image
 import lexer
-import music
+import output
+import program
 import text
 from context import Context
+from memory import MemoryImage
 
 def lo(x): return x&0xff
 def hi(x): return (x>>8)&0xff
+eval.pureFunctions.update({lo, hi})
+eval.readOnlyFunctions.update({text.chr, text.ord}, (f for f in math.__dict__.values() if callable(f)))
 
 
 def _store(value: int, context: Context):
@@ -26,103 +31,157 @@ def _store(value: int, context: Context):
     
     if currentLocation >= 0 and currentLocation <= 0xffff:
             
-        if currentLocation in context.memory:
-            oldValue = context.memory[currentLocation]
-            context.reportWarning(f'${currentLocation:04x} is overwritten (${oldValue:02x} to ${value:02x})')
-            
         # store value in memory, and advance to next memory location
         context.memory[currentLocation] = value
         context.symbols['_'] += 1
+
+        # most stores continue the last interval, see IntervalIndex.add
+        current = context.intervals.current
+        if current is not None and current.end == currentLocation:
+            current.end += 1
+        else:
+            context.intervals.add(currentLocation, 1, context.readPointer(), context.lastLabel)
         
     else:
         context.reportError(f'Destination memory address out of range: ${currentLocation:x}')
     
 
-def _asmInstruction(chunk: list, context: Context):
-    mnemonic = chunk[0].string
-    operand = ''.join(map(lambda t: t.string, chunk[1:]))
-        
-    instruction = cpu.instructionWithMnemonic(mnemonic)
-    opcodes = instruction.opcodes
-        
-    bytes = []
-    
-    if cpu.AddressMode.accumulator in opcodes and not operand:
-        bytes = [opcodes[cpu.AddressMode.accumulator]]
-        
-    elif cpu.AddressMode.implied in opcodes and not operand:
-        bytes = [opcodes[cpu.AddressMode.implied]]
-        
-    elif cpu.AddressMode.immediate in opcodes and operand.startswith('#'):
-        v = eval.byteExpression(operand[1:], context)
-        bytes = [opcodes[cpu.AddressMode.immediate], v]
-        
-    elif cpu.AddressMode.indirectX in opcodes and operand.startswith('(') and operand.endswith(',x)'):
-        v = eval.byteExpression(operand[1:-3], context)
-        bytes = [opcodes[cpu.AddressMode.indirectX], v]
+def _storeBlock(data: bytes, context: Context):
+    """ store a block of bytes from the current memory location """
+    currentLocation = context.symbols['_']
+    end = currentLocation + len(data)
+
+    if currentLocation >= 0 and end <= 0x10000:
+        context.memory.write(currentLocation, data)
+        context.intervals.add(currentLocation, len(data), context.readPointer(), context.lastLabel)
+        context.symbols['_'] = end
+
+    else: # partly out of range, store byte by byte for the same errors
+        for value in data:
+            _store(value, context)
+
+
+def _binaryFile(path: str):
+    """ memory mapped contents of a binary file, None if it can't be read; cached while its size and time stay the same """
+    try:
+        status = os.stat(path)
+    except OSError:
+        return None
+    stamp = (status.st_size, status.st_mtime_ns)
+
+    cached = _asmDirective.binaryFiles.get(path)
+    if cached is None or cached[0] != stamp:
+        print(f'Loading: {path}')
+        try:
+            with open(path, 'rb') as f:
+                if status.st_size > 0:
+                    data = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+                else:
+                    data = memoryview(b'') # empty files can't be mapped
+        except (OSError, ValueError):
+            return None
+        cached = (stamp, data)
+        _asmDirective.binaryFiles[path] = cached
+    return cached[1]
+
+
+def _operandKey(instruction: program.Instruction, context: Context) -> tuple:
+    """ identifies one occurrence of an instruction, also in imported files and repeats """
+    iterators = tuple(context.symbols.get(iterator) for iterator, count, readPointer in context.repeatStack)
+    return instruction, tuple(context.readPointerStack[:-1]), iterators
+
+
+def _isWideOperand(instruction: program.Instruction, value: int, context: Context) -> bool:
+    """ True for absolute addressing: an operand is zero page, also while it is unresolved, until its value
+        is $100 or more, then it stays absolute, so each operand changes size at most once """
+    wideOperands = context.wideOperands
+    if len(wideOperands) > 0 and _operandKey(instruction, context) in wideOperands:
+        return True
+    elif hi(value) != 0:
+        wideOperands.add(_operandKey(instruction, context))
+        context.wideOperandsChanged = True
+        return True
+    return False
+
+
+def _asmInstruction(instruction: program.Instruction, context: Context):
+    mnemonic = instruction.mnemonic
+    mode = instruction.mode
+    zeroPageMode = instruction.zeroPageMode
+
+    code = None
 
-    elif cpu.AddressMode.indirectY in opcodes and operand.startswith('(') and operand.endswith('),y'):
-        v = eval.byteExpression(operand[1:-3], context)
-        bytes = [opcodes[cpu.AddressMode.indirectY], v]
+    if mode is cpu.AddressMode.accumulator or mode is cpu.AddressMode.implied:
+        code = cpu.encode(mnemonic, mode)
 
-    elif cpu.AddressMode.indirect in opcodes and operand.startswith('(') and operand.endswith(')'):
-        v = eval.wordExpression(operand[1:-1], context)
+    elif mode is cpu.AddressMode.immediate or mode is cpu.AddressMode.indirectX or mode is cpu.AddressMode.indirectY:
+        v = eval.byteExpression(instruction.expression, context)
+        code = cpu.encode(mnemonic, mode, v)
+
+    elif mode is cpu.AddressMode.indirect:
+        v = eval.wordExpression(instruction.expression, context)
         if lo(v) == 0xff:
             context.reportWarning(f'Indirect address located on page boundary: ${v:04x}')
-        bytes = [opcodes[cpu.AddressMode.indirect], lo(v), hi(v)]
+        code = cpu.encode(mnemonic, mode, v)
 
-    elif cpu.AddressMode.relative in opcodes: # TODO: give warning about branching across page boundary
-        v = eval.wordExpression(operand, context)
+    elif mode is cpu.AddressMode.relative: # TODO: give warning about branching across page boundary
+        v = eval.wordExpression(instruction.expression, context)
         dist = v - context.symbols['_'] - 2
         if dist < -128 or dist > 127: # branch is out of range (signed byte)
             context.reportError(f'Branch destination out of range [-128..127]: {dist}')
             dist = 0
-        bytes = [opcodes[cpu.AddressMode.relative], dist&0xff]
-
-    elif (cpu.AddressMode.zeroPageX in opcodes or cpu.AddressMode.absoluteX in opcodes) and operand.endswith(',x'):
-        v = eval.wordExpression(operand[:-2], context)
-        if cpu.AddressMode.zeroPageX in opcodes and hi(v) == 0:
-            bytes = [opcodes[cpu.AddressMode.zeroPageX], lo(v)]
-        elif cpu.AddressMode.absoluteX in opcodes:
-            bytes = [opcodes[cpu.AddressMode.absoluteX], lo(v), hi(v)]
-
-    elif (cpu.AddressMode.zeroPageY in opcodes or cpu.AddressMode.absoluteY in opcodes) and operand.endswith(',y'):
-        v = eval.wordExpression(operand[:-2], context)
-        if cpu.AddressMode.zeroPageY in opcodes and hi(v) == 0:
-            bytes = [opcodes[cpu.AddressMode.zeroPageY], lo(v)]
-        elif cpu.AddressMode.absoluteY in opcodes:
-            bytes = [opcodes[cpu.AddressMode.absoluteY], lo(v), hi(v)]
-
-    elif (cpu.AddressMode.zeroPage in opcodes or cpu.AddressMode.absolute in opcodes) and operand:
-        v = eval.wordExpression(operand, context)
-        if cpu.AddressMode.zeroPage in opcodes and hi(v) == 0:
-            bytes = [opcodes[cpu.AddressMode.zeroPage], lo(v)]
-        elif cpu.AddressMode.absolute in opcodes:
-            bytes = [opcodes[cpu.AddressMode.absolute], lo(v), hi(v)]
-
-    if len(bytes) <= 0:
-        context.reportError(f'Unknown instruction or address mode: {mnemonic} {operand}')
-        
-    # store the bytes
-    for b in bytes:
-        _store(b, context)
+        code = cpu.encode(mnemonic, mode, dist)
+
+    elif mode is not None and zeroPageMode is not None: # absolute or zero page
+        v = eval.wordExpression(instruction.expression, context)
+        code = cpu.encode(mnemonic, mode if _isWideOperand(instruction, v, context) else zeroPageMode, v)
+
+    elif mode is not None: # absolute
+        v = eval.wordExpression(instruction.expression, context)
+        code = cpu.encode(mnemonic, mode, v)
+
+    elif zeroPageMode is not None: # zero page
+        v = eval.wordExpression(instruction.expression, context)
+        if hi(v) == 0:
+            code = cpu.encode(mnemonic, zeroPageMode, v)
+        elif instruction.size == 'zp':
+            context.reportError(f'Zero page address out of range: ${v:04x}')
+            return
+
+    if code is None:
+        context.reportError(f'Unknown instruction or address mode: {mnemonic} {instruction.operand}')
+        return
+
+    _storeBlock(code, context)
 
     
-def _asmAssignment(chunk: list, context: Context):
-    symbol = chunk[0].string
-    expression = ''.join(map(lambda t: t.string, chunk[2:]))
-    value = eval.expression(expression, context)
+def _asmAssignment(assignment: program.Assignment, context: Context):
+    value = eval.expression(assignment.expression, context)
     if value is not None:
-        context.symbols[symbol] = value
+        context.symbols[assignment.symbol] = value
+        context.writes.add(assignment.symbol)
+
+
+def _asmLabel(node: program.Label, context: Context):
+    label = node.name
+    if label in context.labels:
+        context.reportError(f'Label was already defined: "{label}"')
+    context.symbols[label] = context.symbols['_']
+    context.labels.add(label)
+    context.writes.add(label)
+    if not label.startswith('_'):
+        context.lastLabel = label
+
+
+def _asmInvalidSyntax(node: program.InvalidSyntax, context: Context):
+    context.reportError(f'Invalid syntax')
     
     
-def _asmDirective(chunk: list, context: Context):
-    c = chunk[1]
-
-    advance = True # advance read pointer after this chunk
+def _asmDirective(node: program.Directive, context: Context):
+    advance = True # advance read pointer after this line
 
-    directive = chunk[1].string
-    expression = ''.join(map(lambda t: t.string, chunk[2:]))
+    directive = node.name
+    expression = node.expression
 
     # eval list of arguments
     if len(expression.strip()) > 0:
@@ -141,13 +200,13 @@ def _asmDirective(chunk: list, context: Context):
     # data directive: declare a list of byte values
     if directive == 'byte':
         for arg in arguments:
-            value = eval.byteExpression(str(arg), context)
+            value = eval.byteExpression(arg, context)
             _store(value, context)
 
     # data directive: declare a list of word values
     elif directive == 'word':
         for arg in arguments:
-            value = eval.wordExpression(str(arg), context)
+            value = eval.wordExpression(arg, context)
             _store(lo(value), context)
             _store(hi(value), context)
         
@@ -165,6 +224,7 @@ def _asmDirective(chunk: list, context: Context):
 
     elif directive == 'encoding' and argTypes == [int]:
         text.encoding = arguments[0]
+        context.opaque = True # changes state outside the symbols
 
     # data directive: declare bits
     elif directive == 'bits':
@@ -181,38 +241,24 @@ def _asmDirective(chunk: list, context: Context):
     elif directive == 'org' and argTypes == [int]:
         arg = arguments[0]
         context.symbols['_'] = arg
+        context.lastLabel = None
 
     # fill memory with n bytes, optional lambda argument
-    elif directive == 'bytefill' and (argTypes == [int] or argTypes == [int, str]):
-        n = arguments[0]
+    elif directive in ['bytefill', 'wordfill'] and (argTypes == [int] or argTypes == [int, str]):
+        n = max(0, arguments[0])
+        size = {'bytefill': 1, 'wordfill': 2}[directive]
         if len(arguments) == 2:
             f = eval.lambdaExpression(arguments[1], context)
+            values = eval.fillValues(f, n, size, context)
         else:
-            f = lambda x: 0
-        for x in range(0, n):
-            try:
-                value = f(x)
-            except Exception as exception:
-                context.reportError(f'{str(exception).capitalize()}')
-                value = 0
-            value = eval.byteExpression(f'{value}', context)
-            _store(value, context)
-
-    elif directive == 'wordfill' and (argTypes == [int] or argTypes == [int, str]):
-        n = arguments[0]
-        if len(arguments) == 2:
-            f = eval.lambdaExpression(arguments[1], context)
+            values = [0] * n
+        if size == 1:
+            _storeBlock(bytes(values), context)
         else:
-            f = lambda x: 0
-        for x in range(0, n):
-            try:
-                value = f(x)
-            except Exception as exception:
-                context.reportError(f'{str(exception).capitalize()}')
-                value = 0
-            value = eval.wordExpression(f'{value}', context)
-            _store(lo(value), context)
-            _store(hi(value), context)
+            data = bytearray(2*n)
+            data[0::2] = bytes([lo(v) for v in values])
+            data[1::2] = bytes([hi(v) for v in values])
+            _storeBlock(data, context)
 
     # align the current memory location to n
     elif directive == 'align' and argTypes == [int]:
@@ -244,8 +290,12 @@ def _asmDirective(chunk: list, context: Context):
         readPointer = context.readPointer()
         context.repeatStack.append( (iterator, count, readPointer) )
         context.symbols[iterator] = 0
+        context.writes.add(iterator)
+        repeat = _repeatBody(*readPointer)
+        if repeat is not None:
+            _runRepeat(repeat, context)
 
-    # end repeat
+    # end repeat, of a body that isn't compiled
     elif directive == 'endr' and argTypes == []:
         if len(context.repeatStack) > 0:
             iterator, count, readPointer = context.repeatStack[-1] # last repeat
@@ -262,6 +312,7 @@ def _asmDirective(chunk: list, context: Context):
     elif directive == 'py' and argTypes == [str]:
         expression = arguments[0]
         try:
+            context.opaque = True
             exec(expression, context.symbols)
         except:
             context.reportError(f'Failed to execute python code: "{expression}"')
@@ -272,9 +323,13 @@ def _asmDirective(chunk: list, context: Context):
         extension = os.path.splitext(fileName)[1]
         if extension == ".py":
             try:
-                print(f'Loading: {fileName}')
-                py = open(fileName).read() # TODO: use _asmDirective.pythonFiles
-                exec(py, context.symbols)
+                if not fileName in _asmDirective.pythonFiles:
+                    print(f'Loading: {fileName}')
+                    with open(fileName) as f:
+                        _asmDirective.pythonFiles[fileName] = compile(f.read(), fileName, 'exec')
+                context.opaque = True
+                context.files.add(fileName)
+                exec(_asmDirective.pythonFiles[fileName], context.symbols)
             except:
                 context.reportError(f'Failed to execute python code: "{expression}"')
         else:
@@ -282,23 +337,21 @@ def _asmDirective(chunk: list, context: Context):
             context.pushReadPointer( (fileName, 0) )
             advance = False
     
-    # import binary file
-    elif directive == 'binary' and argTypes == [str]:
+    # import binary file, or length bytes of it from offset
+    elif directive == 'binary' and argTypes in [[str], [str, int], [str, int, int]]:
         fileName = arguments[0]
-        
-        if not fileName in _asmDirective.binaryFiles:
-            try:
-                print(f'Loading: {fileName}')
-                with open(os.path.join(context.path, fileName), 'rb') as f:
-                    bytesRead = f.read()
-                    _asmDirective.binaryFiles[fileName] = bytesRead
-            except FileNotFoundError:
-                context.reportError(f'File not found: "{fileName}"')
-                
-        if fileName in _asmDirective.binaryFiles:
-            bytesRead = _asmDirective.binaryFiles[fileName]
-            for b in bytesRead:
-                _store(b, context)
+        path = os.path.join(context.path, fileName)
+
+        data = _binaryFile(path)
+        if data is None:
+            context.reportError(f'File not found: "{fileName}"')
+        else:
+            offset = arguments[1] if len(arguments) > 1 else 0
+            length = arguments[2] if len(arguments) > 2 else len(data) - offset
+            if offset < 0 or length < 0 or offset + length > len(data):
+                context.reportError(f'Binary range out of file: "{fileName}", {offset}, {length} ({len(data)} bytes)')
+            else:
+                _storeBlock(data[offset:offset+length], context)
 
     # import music file
     elif directive == 'music' and argTypes == [str, str]:
@@ -306,6 +359,7 @@ def _asmDirective(chunk: list, context: Context):
         prefix = arguments[1]
         
         if not fileName in _asmDirective.musicFiles:
+            import music # only loaded by sources that use music
             mu = music.load(fileName, context)
             if type(mu) is music.Music:
                 print(f'Loading: {fileName}')
@@ -317,8 +371,8 @@ def _asmDirective(chunk: list, context: Context):
             context.symbols[prefix+'_LOAD'] = mu.loadAddress
             context.symbols[prefix+'_INIT'] = mu.initAddress
             context.symbols[prefix+'_PLAY'] = mu.playAddress
-            for b in mu.data:
-                _store(b, context)
+            context.writes.update([prefix+'_LOAD', prefix+'_INIT', prefix+'_PLAY'])
+            _storeBlock(mu.data, context)
 
     # import bitmap or sprite    
     elif directive in ['bitmap', 'sprite'] and argTypes == [str, int]:
@@ -326,6 +380,7 @@ def _asmDirective(chunk: list, context: Context):
         bitsPerPixel = arguments[1]
 
         if not fileName in _asmDirective.imageFiles:
+            import image # only loaded by sources that use images
             im = image.load(fileName, context)
             if type(im) is image.Image:
                 print(f'Loading: {fileName}')
@@ -334,8 +389,7 @@ def _asmDirective(chunk: list, context: Context):
                 context.reportError(f'Image not loaded: "{fileName}"')
 
         if (im := _asmDirective.imageFiles.get(fileName)) is not None:
-            for b in im.data:
-                _store(b, context)
+            _storeBlock(im.data, context)
 
     elif directive in ['zpbyte', 'zpword'] and len(arguments) > 0:
         size = {'zpbyte': 1, 'zpword': 2}[directive]
@@ -344,6 +398,7 @@ def _asmDirective(chunk: list, context: Context):
                 if arg not in context.labels:
                     context.symbols[arg] = context.zpAddress
                     context.labels.add(arg)
+                    context.writes.add(arg)
                     context.zpAddress += size
                 else:
                     context.reportError(f'Label was already defined: "{arg}"')
@@ -354,76 +409,493 @@ def _asmDirective(chunk: list, context: Context):
         context.reportError(f'Invalid directive: .{directive} {expression}')
         
     return advance
-_asmDirective.binaryFiles = {} # function static variable
+_asmDirective.binaryFiles = {} # function static variable, path -> ((size, modification time), memory mapped contents)
 _asmDirective.musicFiles = {}
 _asmDirective.imageFiles = {}
 _asmDirective.pythonFiles = {}
 
 
-def _asmGenerator(chunk: list, context: Context):
-    generator = ''.join(map(lambda t: t.string, chunk[1:]))
+@functools.lru_cache(maxsize=1024)
+def _expandGenerator(source: str) -> tuple:
+    """ compact chunks and parsed lines of the text returned by a generator, cached by text """
+    store = lexer.TokenStore()
+    compact = lexer.compactText(source)
+    store.add('', *compact)
+    return compact, program.parseChunks(store[''])
+
+
+def _asmGenerator(node: program.Generator, context: Context):
+    start = time.perf_counter()
+    generator = node.expression
     value = eval.expression(generator, context)
+    source = value if type(value) is str else '' # other values generate no lines
 
     context.advanceReadPointer()
 
     (fileName, lineIndex) = context.readPointer()
     generatorId = f"{fileName}:{lineIndex} @{generator}"
-    multiPass.chunks[generatorId] = list(lexer.chunkSplit(lexer.tokenize(value)))
+    if _asmGenerator.sources.get(generatorId) != source or generatorId not in multiPass.lines:
+        compact, lines = _expandGenerator(source)
+        multiPass.chunks.add(generatorId, *compact)
+        multiPass.lines[generatorId] = lines
+        _asmGenerator.sources[generatorId] = source
+        _asmGenerator.generated.setdefault(fileName, set()).add(generatorId)
+        context.generatorExpansions += 1
 
     context.pushReadPointer( (generatorId, 0) )
 
+    context.generatorCalls += 1
+    context.generatorSeconds += time.perf_counter() - start
     return False # don't advance
+_asmGenerator.generated = {} # function static variable, file name -> generator ids
+_asmGenerator.sources = {} # generator id -> the text it generated last
+
+
+# handlers of the nodes that can be in a compiled .repeat body
+_repeatHandlers = {
+    program.Label: _asmLabel,
+    program.Instruction: _asmInstruction,
+    program.Assignment: _asmAssignment,
+    program.Directive: _asmDirective,
+    program.InvalidSyntax: _asmInvalidSyntax}
+
+
+def _compileRepeat(fileName: str, lines: list, index: int, end: int, ends: dict) -> tuple:
+    """ (steps, read pointer of the .endr) of the .repeat at lines[index], a step is (read pointer, handler, node),
+        None if the body has lines that move the read pointer """
+    steps = []
+    lineIndex = index + 1
+    while lineIndex <= end:
+        readPointer = (fileName, lineIndex)
+        nextIndex = lineIndex + 1
+        for node in lines[lineIndex]:
+            nodeType = type(node)
+            if nodeType is program.Directive:
+                if node.name == 'endr' and lineIndex == end:
+                    break
+                elif node.name == 'import':
+                    return None
+                elif node.name == 'repeat': # nested, runs its own body and continues after its .endr
+                    if _repeatBody(fileName, lineIndex) is None:
+                        return None
+                    nextIndex = ends[lineIndex] + 1
+            elif not nodeType in _repeatHandlers:
+                return None
+            steps.append((readPointer, _repeatHandlers[nodeType], node))
+        lineIndex = nextIndex
+    return tuple(steps), (fileName, end)
+
+
+def _repeatBody(fileName: str, index: int) -> tuple:
+    """ the compiled body of the .repeat at line index of a file, compiled once for each version of the file """
+    lines = multiPass.lines.get(fileName)
+    repeats = multiPass.repeats.get(fileName)
+    if repeats is None or repeats[0] is not lines:
+        repeats = (lines, program.repeatEnds(lines or []), {})
+        multiPass.repeats[fileName] = repeats
+    _, ends, bodies = repeats
+
+    if not index in bodies:
+        end = ends.get(index)
+        bodies[index] = _compileRepeat(fileName, lines, index, end, ends) if end is not None else None
+    return bodies[index]
+
+
+def _runRepeat(repeat: tuple, context: Context):
+    """ run the iterations of the compiled .repeat on top of the repeat stack, and continue at its .endr """
+    steps, endReadPointer = repeat
+    iterator, count, _ = context.repeatStack[-1]
+    symbols = context.symbols
+    readPointerStack = context.readPointerStack
+    while True:
+        for readPointer, handler, node in steps:
+            readPointerStack[-1] = readPointer # for diagnostics and nested repeats
+            handler(node, context)
+        symbols[iterator] += 1
+        if not symbols[iterator] < count:
+            break
+    context.repeatStack.pop()
+    readPointerStack[-1] = endReadPointer
 
 
-def _saveMemoryToPrg(start: int, memory: dict, fileName: str):        
-    f = open(fileName, 'wb')
-
-    ints = [lo(start), hi(start)]
-
-    if len(memory) > 0:
-        first = min(memory.keys())
-        last = max(memory.keys())
-        for i in range(first, last+1):
-            ints.append(memory[i] if i in memory else 0)
-
-    f.write(bytes(ints))
-    f.close()
-
+def _changedSymbols(old: dict, new: dict) -> set:
+    """ symbols with a different value in new than in old """
+    changed = set()
+    for name, value in new.items():
+        if name in old:
+            oldValue = old[name]
+            try:
+                if oldValue is value or (type(oldValue) is type(value) and oldValue == value):
+                    continue
+            except Exception:
+                pass
+        changed.add(name)
+    return changed
+
+
+importsDirectory = os.path.join(os.path.abspath(os.path.dirname(__file__)), 'imports')
+
+
+def _definedNames(tree: ast.Module) -> frozenset:
+    """ names that a module defines at its top level, None if they can't be known without running it """
+    names = set()
+    nodes = [tree]
+    while len(nodes) > 0:
+        node = nodes.pop()
+        if type(node) in [ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef]:
+            names.add(node.name)
+            continue # local names
+        elif type(node) in [ast.Lambda, ast.ListComp, ast.SetComp, ast.DictComp, ast.GeneratorExp]:
+            continue
+        elif type(node) in [ast.Import, ast.ImportFrom]:
+            for alias in node.names:
+                if alias.name == '*':
+                    return None
+                names.add((alias.asname or alias.name).split('.')[0])
+        elif type(node) is ast.Name:
+            if node.id in ['globals', 'exec', 'eval']:
+                return None
+            if type(node.ctx) is ast.Store:
+                names.add(node.id)
+        nodes.extend(ast.iter_child_nodes(node))
+    return frozenset(names)
+
+
+def loadImports() -> list:
+    """ (file name, code, defined names) of the python files in imports/, read and compiled only once """
+    if loadImports.compiled is None:
+        loadImports.compiled = []
+        for fileName in sorted(glob.glob(os.path.join(importsDirectory, '*.py'))):
+            try:
+                with open(fileName) as f:
+                    tree = ast.parse(f.read(), fileName)
+                code = compile(tree, fileName, 'exec')
+                names = _definedNames(tree)
+            except Exception:
+                code, names = None, None # reported when executed
+            loadImports.compiled.append((fileName, code, names))
+    return loadImports.compiled
+loadImports.compiled = None # function static variable
+
+
+def _readsGlobals(code: types.CodeType) -> bool:
+    """ True if python code may read global or builtin names """
+    return len(code.co_names) > 0 or any(_readsGlobals(constant) for constant in code.co_consts if type(constant) is types.CodeType)
+
+
+def importSnapshot() -> dict:
+    """ symbols defined by the python files in imports/, executed only once, see cloneSymbols """
+    imports = loadImports()
+    if importSnapshot.symbols is None or importSnapshot.imports is not imports:
+        symbols = {'lo': lo, 'hi': hi,
+            'chr': text.chr, 'ord': text.ord,
+            'ENCODING_SCREEN_UPPER': text.ENCODING_SCREEN_UPPER,
+            'ENCODING_SCREEN_MIXED': text.ENCODING_SCREEN_MIXED,
+            'ENCODING_PETSCII_UPPER': text.ENCODING_PETSCII_UPPER,
+            'ENCODING_PETSCII_MIXED': text.ENCODING_PETSCII_MIXED}
+        importSnapshot.baseNames = frozenset(symbols) | math.__dict__.keys()
+        importSnapshot.failed = set()
+        for fileName, code, _ in imports:
+            try:
+                exec(code, symbols)
+            except:
+                importSnapshot.failed.add(fileName)
+        symbols.update(math.__dict__)
+        importSnapshot.symbols = symbols
+        importSnapshot.imports = imports
+        importSnapshot.copied = frozenset(name for name, value in symbols.items() if name != '__builtins__' and (
+            (type(value) is types.FunctionType and value.__globals__ is symbols and _readsGlobals(value.__code__))
+            or type(value) in [list, dict, set]))
+    return importSnapshot.symbols
+importSnapshot.symbols = None # function static variable
+importSnapshot.imports = None
+importSnapshot.copied = frozenset() # names of the functions and containers that each clone gets its own copy of
+importSnapshot.baseNames = frozenset()
+importSnapshot.failed = set()
+
+
+def cloneSymbols(names, symbols: dict):
+    """ copy names from the import snapshot to symbols, with the imported functions using symbols as their globals """
+    snapshot = importSnapshot.symbols
+    if names is snapshot:
+        symbols.update(snapshot)
+        copied = importSnapshot.copied
+    else:
+        symbols.update((name, snapshot[name]) for name in names)
+        copied = importSnapshot.copied.intersection(names)
+
+    for name in copied:
+        value = snapshot[name]
+        if type(value) is types.FunctionType:
+            function = types.FunctionType(value.__code__, symbols, value.__name__, value.__defaults__, value.__closure__)
+            function.__kwdefaults__ = value.__kwdefaults__
+            function.__dict__.update(value.__dict__)
+            value = function
+        else:
+            value = value.copy()
+        symbols[name] = value
+
+
+_identifierPattern = re.compile(r'[A-Za-z_][A-Za-z0-9_]*')
+
+
+def _codeNames(code: types.CodeType) -> set:
+    """ names and identifiers in string constants used by python code """
+    names = set(code.co_names)
+    for constant in code.co_consts:
+        if type(constant) is types.CodeType:
+            names.update(_codeNames(constant))
+        elif type(constant) is str:
+            names.update(_identifierPattern.findall(constant))
+    return names
+
+
+def _referencedNames(fileNames: set, scanned: set) -> set:
+    """ identifiers used by the loaded files in fileNames that are not in scanned, the files are added to scanned """
+    names = set()
+    store = multiPass.chunks
+    for fileName in fileNames - scanned:
+        if fileName in store:
+            scanned.add(fileName)
+            first, count = store.files[fileName]
+            for string in store.strings[store.offsets[first]:store.offsets[first+count]]:
+                names.update(_identifierPattern.findall(string))
+        elif fileName in _asmDirective.pythonFiles:
+            scanned.add(fileName)
+            names.update(_codeNames(_asmDirective.pythonFiles[fileName]))
+    return names
+
+
+def loadedFiles() -> set:
+    """ names of the files with cached contents: sources, imports and assets """
+    fileNames = set(multiPass.lines).difference(*_asmGenerator.generated.values())
+    for cache in [_asmDirective.binaryFiles, _asmDirective.musicFiles, _asmDirective.imageFiles, _asmDirective.pythonFiles]:
+        fileNames.update(cache)
+    if loadImports.compiled is not None:
+        fileNames.add(importsDirectory) # files added or removed
+        fileNames.update(fileName for fileName, _, _ in loadImports.compiled)
+    return fileNames
+
+
+def invalidate(fileNames: set):
+    """ drop the cached contents of changed files, they are loaded again when used """
+    fileNames = list(fileNames)
+    while len(fileNames) > 0:
+        fileName = fileNames.pop()
+        fileNames.extend(_asmGenerator.generated.pop(fileName, ())) # the lines generated by the file
+        multiPass.lines.pop(fileName, None)
+        multiPass.repeats.pop(fileName, None)
+        _asmGenerator.sources.pop(fileName, None)
+        multiPass.chunks.remove(fileName)
+        for cache in [_asmDirective.binaryFiles, _asmDirective.musicFiles, _asmDirective.imageFiles, _asmDirective.pythonFiles]:
+            cache.pop(fileName, None)
+        if os.path.dirname(fileName) == importsDirectory or fileName == importsDirectory:
+            loadImports.compiled = None
+
+    if multiPass.chunks.garbage > len(multiPass.chunks.strings) // 2:
+        multiPass.chunks.compact()
+
+
+def _nodeName(node) -> str:
+    """ name of a node in a profile """
+    nodeType = type(node)
+    if nodeType is program.Directive:
+        return f'.{node.name}'
+    elif nodeType is program.Generator:
+        return '@generator'
+    elif nodeType is program.InvalidSyntax:
+        return 'invalid syntax'
+    return nodeType.__name__.lower()
+
+
+def _isCall(node) -> bool:
+    """ True for the nodes that run python code from the source: generators, .py and .import of a python file """
+    if type(node) is program.Generator:
+        return True
+    return type(node) is program.Directive and (node.name == 'py' or
+        (node.name == 'import' and os.path.splitext(node.expression.strip().strip('"\''))[1] == '.py'))
+
+
+_nodeHandlers = {
+    program.Label: _asmLabel,
+    program.Instruction: _asmInstruction,
+    program.Assignment: _asmAssignment,
+    program.Directive: _asmDirective,
+    program.Generator: _asmGenerator}
+
+
+def _runProfiled(nodes: tuple, context: Context, fileName: str, lineIndex: int, profiler) -> bool:
+    """ the nodes of a line, like the loop in _build, timing each one, returns False if the read pointer moved """
+    advance = True
+    for node in nodes:
+        start = time.perf_counter()
+        result = _nodeHandlers.get(type(node), _asmInvalidSyntax)(node, context)
+        seconds = time.perf_counter() - start
+        if type(node) in [program.Directive, program.Generator]:
+            advance = result
+        profiler.add('node', _nodeName(node), seconds)
+        if _isCall(node):
+            code = f'@{node.expression}' if type(node) is program.Generator else f'.{node.name} {node.expression}'
+            profiler.add('call', f'{fileName}:{lineIndex+1} {code}', seconds)
+    return advance
 
-def multiPass(inFile, outFile) -> bool:
 
+def _isCheckpoint(nodes: tuple) -> bool:
+    """ lines starting with a label or .org are where passes can resume """
+    if len(nodes) == 0:
+        return False
+    node = nodes[0]
+    return type(node) is program.Label or (type(node) is program.Directive and node.name == 'org')
+
+
+def parseDefine(define: str) -> tuple:
+    """ name and value of a NAME=value define, the value is a python literal with $ or % prefixes, or a string """
+    name, _, value = define.partition('=')
+    if not name.isidentifier():
+        raise ValueError(f'Invalid define: "{define}"')
+    if value == '':
+        return name, 1
+    value = value.strip()
+    if value[:1] in ['$', '%']:
+        value = lexer._fixPrefix(value)
+    try:
+        return name, ast.literal_eval(value)
+    except (ValueError, SyntaxError):
+        return name, value
+
+
+def _loadFile(fileName: str, profiler=None):
+    if not fileName in multiPass.lines:
+        start = time.perf_counter()
+        if not fileName in multiPass.chunks:
+            print(f'Loading: {fileName}')
+            multiPass.chunks.addFile(fileName)
+        multiPass.lines[fileName] = program.parseChunks(multiPass.chunks[fileName])
+        if profiler is not None:
+            profiler.add('lex', fileName, time.perf_counter() - start)
+
+
+def preload(inFile: str, profiler=None) -> set:
+    """ lex and parse a source file, and the source files it imports with a constant file name, returns their names """
     path = os.path.dirname(inFile)
+    fileNames = [inFile]
+    loaded = set()
+    while len(fileNames) > 0:
+        fileName = fileNames.pop()
+        if fileName in loaded or not (fileName in multiPass.lines or os.path.exists(fileName)):
+            continue
+        _loadFile(fileName, profiler)
+        loaded.add(fileName)
+        for nodes in multiPass.lines[fileName]:
+            for node in nodes:
+                if type(node) is program.Directive and node.name == 'import':
+                    try:
+                        importName = ast.literal_eval(node.expression)
+                    except (ValueError, SyntaxError):
+                        continue
+                    if type(importName) is str and os.path.splitext(importName)[1] != '.py':
+                        fileNames.append(os.path.join(path, importName))
+    return loaded
+
+
+defaultOrigin = 0x1000 # the memory location before the first .org
+
+
+def _printStats(passStats: list, lexedGenerators: int):
+    """ cache hits, generator calls and the evaluations of each pass """
+    if lexer.cacheDirectory is not None:
+        print(f"Lexer cache: {lexer.cacheStats['hits']} hits, {lexer.cacheStats['misses']} misses")
+    hits, misses = eval.compileStats()
+    print(f'Expression cache: {hits} hits, {misses} misses')
+    calls, expansions, seconds = (sum(stats[i] for stats in passStats) for i in range(4, 7))
+    if calls > 0:
+        lexedGenerators = _expandGenerator.cache_info().misses - lexedGenerators
+        print(f'Generators: {calls} calls, {expansions} expanded, {lexedGenerators} lexed, {seconds*1000:.1f}ms')
+    for index, (evaluations, skipped, changed, wide, _, _, _) in enumerate(passStats):
+        print(f'Pass {index+1}: {evaluations} evaluations, {skipped} skipped, {changed} symbols changed, {wide} absolute operands')
+
+
+def _build(inFile, verbose: bool, defines: dict, profiler) -> Context:
+    """ assemble a source file in passes, and print the report, returns the context of the last pass,
+        profiler is a profiler.Profiler or None """
 
-    symbols = {'lo': lo, 'hi': hi,
-        'chr': text.chr, 'ord': text.ord,
-        'ENCODING_SCREEN_UPPER': text.ENCODING_SCREEN_UPPER,
-        'ENCODING_SCREEN_MIXED': text.ENCODING_SCREEN_MIXED,
-        'ENCODING_PETSCII_UPPER': text.ENCODING_PETSCII_UPPER,
-        'ENCODING_PETSCII_MIXED': text.ENCODING_PETSCII_MIXED}
+    path = os.path.dirname(inFile)
+    text.encoding = text.ENCODING_SCREEN_UPPER
+    if profiler is not None:
+        profiler.clear(inFile)
+
+    snapshot = importSnapshot()
+    imports = importSnapshot.imports
+    imported = set() # file names of the imports in symbols
+    scanned = set() # file names of the sources searched for names of lazy imports
+    buildFiles = set() # file names of the sources used by this build
+    symbols = {}
+
+    if multiPass.lazyImports:
+        buildFiles = preload(inFile, profiler)
+        cloneSymbols(importSnapshot.baseNames | {'__builtins__'}, symbols)
+    else:
+        cloneSymbols(snapshot, symbols)
+        imported.update(fileName for fileName, _, _ in imports)
+        importNames = ', '.join(map(lambda x: os.path.basename(x[0]), imports))
+        print(f'Importing: {importNames}')
 
-    root = os.path.abspath(os.path.dirname(__file__))
-    imports = sorted(glob.glob(os.path.join(root, 'imports/*.py')))
+    for fileName in sorted(imported & importSnapshot.failed):
+        print(f"failed to import: {fileName}")
 
-    importNames = ', '.join(map(lambda x: os.path.basename(x), imports))
-    print(f'Importing: {importNames}')
+    if defines is not None:
+        symbols.update(defines)
 
-    for fileName in imports:
-        try:
-            py = open(fileName).read()
-            exec(py, symbols)
-        except:
-            print(f"failed to import: {fileName}")
-
-    lastMemory = {}
-    
-    defaultOrigin = 0x1000
+    lastMemory = MemoryImage()
+    lastContext = None
+    changedSymbols = set()
+    passStats = []
+    lexedGenerators = _expandGenerator.cache_info().misses
+    segments = [] # recorded segments of top level lines, see checkpoint.Segment
+    wideOperands = set() # operands that need absolute addressing, see _isWideOperand
 
     n = 1
     while n<10:
+        passStart = time.perf_counter()
+        # import the modules that define names used by the files loaded so far
+        if multiPass.lazyImports:
+            used = _referencedNames(buildFiles, scanned)
+            for fileName, code, names in imports:
+                if not fileName in imported and (names is None or not names.isdisjoint(used)):
+                    print(f'Importing: {os.path.basename(fileName)}')
+                    imported.add(fileName)
+                    if fileName in importSnapshot.failed:
+                        print(f"failed to import: {fileName}")
+                    newNames = (names if names is not None else snapshot.keys() - symbols.keys()) & snapshot.keys()
+                    cloneSymbols(newNames, symbols)
+                    changedSymbols |= newNames
+
         symbols['_'] = defaultOrigin
         context = Context(symbols)
         context.path = path
-        context.pushReadPointer( (inFile, 0) )
+        context.changedSymbols = changedSymbols
+        context.wideOperands = wideOperands
+        startSymbols = dict(symbols)
+        startEncoding = text.encoding
+
+        # resume from the first segment that reads symbols that changed since it was recorded
+        index, reason = checkpoint.resumeIndex(segments, startSymbols, text.encoding)
+        if index > 0:
+            skipped = checkpoint.resume(segments, index, context, lastContext)
+            if verbose:
+                fileName, lineIndex = context.readPointer()
+                change = f', {reason} changed' if reason is not None else ''
+                print(f'Pass {n}: resuming at {fileName}:{lineIndex+1}, skipping {index} of {len(segments)} segments ({skipped} lines){change}')
+            segments = segments[:index]
+        else:
+            context.pushReadPointer( (inFile, 0) )
+            segments = []
+            if verbose and n > 1:
+                print(f'Pass {n}: running all lines, {reason} changed')
+
+        segment = checkpoint.begin(context, startSymbols, text.encoding)
+        segments.append(segment)
+        passLines = 0
 
         while True:
             readPointer = context.readPointer()
@@ -432,40 +904,51 @@ def multiPass(inFile, outFile) -> bool:
 
             fileName, lineIndex = readPointer
             
-            if not fileName in multiPass.chunks:
-                print(f'Loading: {fileName}')
-                multiPass.chunks[fileName] = list(lexer.chunkSplit(lexer.tokenizeFile(fileName)))
+            _loadFile(fileName, profiler)
+            lines = multiPass.lines[fileName]
 
-            allChunks = multiPass.chunks[fileName]
+            if lineIndex < len(lines):
 
-            if lineIndex < len(allChunks):
-                
-                chunk = allChunks[lineIndex]
                 advance = True
+                nodes = lines[lineIndex]
 
-                # label
-                if len(chunk) >= 2 and chunk[1].string == ':':
-                    label = chunk[0].string
-                    if label in context.labels:
-                        context.reportError(f'Label was already defined: "{label}"')
-                    context.symbols[label] = context.symbols['_']
-                    context.labels.add(label)
-                    chunk = chunk[2:]
+                # start a new segment at top level checkpoints
+                if segment.lineCount >= multiPass.checkpointInterval and len(context.readPointerStack) == 1 \
+                        and len(context.repeatStack) == 0 and _isCheckpoint(nodes):
+                    checkpoint.end(segment, context)
+                    segment = checkpoint.begin(context, startSymbols, text.encoding)
+                    segments.append(segment)
+                segment.lineCount += 1
 
-                if len(chunk) >= 1 and cpu.isMnemonic(chunk[0].string):
-                    _asmInstruction(chunk, context)
+                if profiler is not None:
+                    passLines += 1
+                    if profiler.detailed:
+                        start = time.perf_counter()
+                        if _runProfiled(nodes, context, fileName, lineIndex, profiler):
+                            context.advanceReadPointer()
+                        profiler.add('file', fileName, time.perf_counter() - start)
+                        continue
 
-                elif len(chunk) >= 3 and chunk[1].string == '=':
-                    _asmAssignment(chunk, context)
+                for node in nodes:
+                    nodeType = type(node)
 
-                elif len(chunk) >= 2 and chunk[0].string == '.':
-                    advance = _asmDirective(chunk, context)
-            
-                elif len(chunk) >= 2 and chunk[0].string == '@':
-                    advance = _asmGenerator(chunk, context)
+                    if nodeType is program.Label:
+                        _asmLabel(node, context)
+
+                    elif nodeType is program.Instruction:
+                        _asmInstruction(node, context)
+
+                    elif nodeType is program.Assignment:
+                        _asmAssignment(node, context)
+
+                    elif nodeType is program.Directive:
+                        advance = _asmDirective(node, context)
+
+                    elif nodeType is program.Generator:
+                        advance = _asmGenerator(node, context)
 
-                elif len(chunk) > 0:
-                    context.reportError(f'Invalid syntax')
+                    else:
+                        _asmInvalidSyntax(node, context)
 
                 if advance:
                     context.advanceReadPointer()
@@ -473,16 +956,61 @@ def multiPass(inFile, outFile) -> bool:
             else:
                 context.popReadPointer()
                 
+        checkpoint.end(segment, context)
+        buildFiles |= context.files
+        if profiler is not None:
+            profiler.add('pass', f'Pass {n}', time.perf_counter() - passStart, passLines)
+        passStats.append((context.evaluations, context.skippedEvaluations, len(changedSymbols), len(wideOperands),
+            context.generatorCalls, context.generatorExpansions, context.generatorSeconds))
+
         if len(context.errors) == 0 and context.memory == lastMemory:
             break
 
         # prepare for next pass
-        lastMemory = dict(context.memory)
+        lastMemory = context.memory
+        lastContext = context
+        changedSymbols = _changedSymbols(startSymbols, symbols)
+        changedSymbols.discard('_') # reset at the start of each pass
+
+        # nothing that the next pass starts with has changed, so it would give the same result
+        if len(context.errors) == 0 and len(changedSymbols) == 0 and not context.wideOperandsChanged \
+                and text.encoding == startEncoding:
+            break
         n += 1
 
+    else:
+        # the last pass still changed symbols, its result may be inconsistent
+        if len(context.errors) == 0:
+            names = ', '.join(sorted(changedSymbols)[:10]) or 'operand sizes'
+            context.reportError(f'No stable result after {n-1} passes, still changing: {names}')
+
     # print warning and errors
+    context.reportOverlaps()
     context.printAsmReport()    
 
+    if verbose:
+        _printStats(passStats, lexedGenerators)
+
+    if profiler is not None:
+        profiler.stop()
+        profiler.printTable()
+        if profiler.dumpFile is not None:
+            profiler.save(profiler.dumpFile)
+            print(f'Saving profile: {profiler.dumpFile}')
+
+    return context
+
+
+def assembleMemory(inFile, defines: dict=None) -> MemoryImage:
+    """ the memory of a source file, without saving or profiling it, None if it has errors """
+    context = _build(inFile, False, defines, None)
+    return context.memory if len(context.errors) == 0 else None
+
+
+def multiPass(inFile, outFile, verbose: bool=False, defines: dict=None) -> bool:
+    """ assemble a source file and save it to outFile if it has no errors, True if it has errors """
+    context = _build(inFile, verbose, defines, multiPass.profiler)
+
     # only save if no errors
     anyErrors = len(context.errors) > 0
     if not anyErrors:
@@ -491,24 +1019,19 @@ def multiPass(inFile, outFile) -> bool:
         context.printMemoryUse()
 
         if outFile is not None:
-            print(f'Saving program: {outFile}')
-            start = defaultOrigin
-            if len(context.memory) > 0:
-                start = min(context.memory.keys())
-            _saveMemoryToPrg(start, context.memory, outFile)
+            try:
+                for fileName in output.save(context.memory, outFile, multiPass.outputMode, multiPass.gap, defaultOrigin):
+                    print(f'Saving program: {fileName}')
+            except ValueError as exception:
+                print(f'error: {exception}')
+                anyErrors = True
 
     return anyErrors
-multiPass.chunks = {} # function static variable
-        
-
-################################################################################
-
-class TestAssemble(unittest.TestCase):
-
-    def testTest(self):
-        pass
-
-if __name__ == '__main__':
-    unittest.main()
-
-# TODO: only load imports once!
+multiPass.chunks = lexer.TokenStore() # function static variable
+multiPass.lines = {} # parsed lines per file, see program.parseChunks
+multiPass.repeats = {} # file name -> (lines, .endr index of each .repeat, compiled bodies), see _repeatBody
+multiPass.checkpointInterval = 32 # minimum number of lines between checkpoints
+multiPass.lazyImports = False # only import the modules in imports/ that define names used by the source
+multiPass.outputMode = 'prg' # see output.save
+multiPass.gap = output.defaultGap # segments less than this many bytes apart are saved as one
+multiPass.profiler = None # a profiler.Profiler to record where the time goes
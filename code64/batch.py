@@ -0,0 +1,147 @@
+#! /usr/bin/env python3
+
+import contextlib
+import io
+import os
+import time
+
+import assemble
+import lexer
+
+
+class Target:
+    def __init__(self, inFile: str, outFile: str=None, defines: dict=None, variant: str=None):
+        self.inFile = inFile
+        self.outFile = outFile
+        self.defines = defines # symbols added before assembling
+        self.variant = variant
+
+
+class Result:
+    def __init__(self, target: Target, anyErrors: bool, seconds: float, output: str, records: dict=None):
+        self.target = target
+        self.anyErrors = anyErrors
+        self.seconds = seconds
+        self.output = output
+        self.records = records # profiler records of the build, merged by assembleTargets
+
+
+def readManifest(fileName: str) -> list:
+    """ targets of a build manifest, one '<asmFile> [<outFile>]' per line, paths relative to the manifest """
+    targets = []
+    directory = os.path.dirname(fileName)
+    with open(fileName, 'r') as f:
+        for line in f:
+            fields = line.split('#', 1)[0].split()
+            if len(fields) == 0:
+                continue
+            if len(fields) > 2:
+                raise ValueError(f'Invalid manifest line: "{line.strip()}"')
+            paths = [os.path.join(directory, field) for field in fields]
+            targets.append(Target(*paths))
+    return targets
+
+
+def parseVariant(variant: str) -> tuple:
+    """ name and defines of a 'name:NAME=value,NAME=value' variant """
+    name, _, defines = variant.partition(':')
+    if name == '':
+        raise ValueError(f'Invalid variant: "{variant}"')
+    return name, dict(assemble.parseDefine(define) for define in defines.split(',') if define != '')
+
+
+def variantFileName(fileName: str, variant: str) -> str:
+    """ file name with the variant name added before the extension """
+    base, extension = os.path.splitext(fileName)
+    return f'{base}-{variant}{extension}'
+
+
+_optionNames = ['outputMode', 'gap', 'lazyImports'] # multiPass settings that workers need
+
+
+def _warmUp(preloadFiles: list, options: dict, cacheDirectory: str):
+    """ process pool initializer, sets the options of this process, which spawned workers don't inherit,
+        runs the imports, and loads the source files shared by all targets """
+    for name, value in options.items():
+        setattr(assemble.multiPass, name, value)
+    lexer.cacheDirectory = cacheDirectory
+    with contextlib.redirect_stdout(io.StringIO()):
+        assemble.importSnapshot()
+        for fileName in preloadFiles:
+            assemble.preload(fileName)
+
+
+def _assembleTarget(target: Target, verbose: bool) -> Result:
+    output = io.StringIO()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(output):
+        try:
+            anyErrors = assemble.multiPass(target.inFile, target.outFile, verbose, target.defines)
+        except Exception as exception:
+            print(f'{target.inFile} error: {exception}')
+            anyErrors = True
+    records = assemble.multiPass.profiler.records if assemble.multiPass.profiler is not None else None
+    return Result(target, anyErrors, time.perf_counter() - start, output.getvalue(), records)
+
+
+def assembleTargets(targets: list, workers: int=None, verbose: bool=False, preloadFiles: list=[]) -> bool:
+    """ assemble all targets in a process pool, print their output and timings, True if any target has errors """
+    import concurrent.futures, multiprocessing # only needed for more than one target
+    start = time.perf_counter()
+
+    # with fork, workers share the preloaded state of this process copy-on-write
+    context = None
+    if len(preloadFiles) > 0 and 'fork' in multiprocessing.get_all_start_methods():
+        _warmUp(preloadFiles, {}, lexer.cacheDirectory)
+        context = multiprocessing.get_context('fork')
+
+    # each worker records into its own profiler, without saving it, the records are merged here
+    options = {name: getattr(assemble.multiPass, name) for name in _optionNames}
+    profiler = assemble.multiPass.profiler
+    if profiler is not None:
+        options['profiler'] = type(profiler)(None, profiler.detailed)
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers, mp_context=context,
+            initializer=_warmUp, initargs=(preloadFiles, options, lexer.cacheDirectory)) as executor:
+        futures = [executor.submit(_assembleTarget, target, verbose) for target in targets]
+        results = []
+        for target, future in zip(targets, futures):
+            try:
+                result = future.result()
+            except Exception as exception: # the worker died
+                result = Result(target, True, 0.0, f'{target.inFile} error: {exception}\n')
+            print(result.output, end='')
+            results.append(result)
+
+    print(f'Assembled {len(results)} targets in {time.perf_counter() - start:.2f}s:')
+    for result in results:
+        status = 'failed' if result.anyErrors else 'ok'
+        variant = f' [{result.target.variant}]' if result.target.variant is not None else ''
+        outFile = f' -> {result.target.outFile}' if result.target.outFile is not None else ''
+        print(f'  {status:6} {result.seconds:6.2f}s  {result.target.inFile}{variant}{outFile}')
+
+    if profiler is not None:
+        profiler.clear(f'{len(results)} targets')
+        for result in results:
+            for (category, name), (count, seconds) in (result.records or {}).items():
+                profiler.add(category, name, seconds, count)
+        profiler.seconds = time.perf_counter() - start
+        profiler.printTable()
+        if profiler.dumpFile is not None:
+            profiler.save(profiler.dumpFile)
+            print(f'Saving profile: {profiler.dumpFile}')
+
+    return any(result.anyErrors for result in results)
+
+
+def variantTargets(inFile: str, outFile: str, variants: list, defines: dict={}) -> list:
+    """ a target for each (name, defines) variant of a source, with one PRG per variant """
+    targets = []
+    for name, variantDefines in variants:
+        variantOutFile = variantFileName(outFile, name) if outFile is not None else None
+        targets.append(Target(inFile, variantOutFile, {**defines, **variantDefines}, name))
+    return targets
+
+
+def assembleVariants(inFile: str, outFile: str, variants: list, defines: dict={}, workers: int=None, verbose: bool=False) -> bool:
+    """ assemble one source for each (name, defines) variant, with one PRG per variant """
+    return assembleTargets(variantTargets(inFile, outFile, variants, defines), workers, verbose, [inFile])
@@ -0,0 +1,386 @@
+#! /usr/bin/env python3
+
+import contextlib
+import glob
+import io
+import json
+import os
+import platform
+import random
+import shlex
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import assemble
+import cruncher
+import eval
+import lexer
+import profiler
+
+
+startupBudget = 0.15 # seconds from starting python to the first pass of a small source
+resultsFile = os.path.join(os.path.abspath(os.path.dirname(__file__)), 'benchmark-results.json')
+savedRuns = 20 # runs kept in the results file
+slowdownLimit = 1.2 # a workload is flagged when its fastest build takes longer than this times the saved runs
+baselineRuns = 5 # saved runs whose median is compared with, so that one noisy run doesn't flag or hide a slowdown
+memoryLimit = 1.1
+lazyModules = ['unittest', 'tempfile', 'multiprocessing', 'concurrent.futures', 'socket', 'daemon', 'image', 'music']
+
+
+def _shlexTokenize(text: str, fileName=''):
+    """ the original per-line shlex tokenizer, kept as a reference for lexer.tokenize """
+    tokens = []
+
+    if type(text) is str:
+        for line in text.splitlines():
+            lex = shlex.shlex(line, punctuation_chars="|&<>.=")
+            lex.commenters = ';'
+            lex.wordchars += '$%'
+
+            for token in lex:
+                tokens.append(lexer.Token(lexer._fixPrefix(token), fileName, lex.lineno))
+            tokens.append(lexer.Token('\n'))
+
+    return tokens
+
+
+def _testcaseSource() -> str:
+    """ all the regression test sources, concatenated """
+    root = os.path.abspath(os.path.dirname(__file__))
+    text = ''
+    for fileName in sorted(glob.glob(os.path.join(root, 'testcases/*.asm'))):
+        with open(fileName, 'r') as f:
+            text += f.read() + '\n'
+    return text
+
+
+def _largeSource(lines: int) -> str:
+    """ the regression test sources, repeated to the given number of lines """
+    sourceLines = _testcaseSource().splitlines()
+    return '\n'.join((sourceLines * (lines // max(1, len(sourceLines)) + 1))[:lines])
+
+
+def _timed(function, *args) -> float:
+    start = time.perf_counter()
+    function(*args)
+    return time.perf_counter() - start
+
+
+def benchmarkLexer(lines: int=40000):
+    """ compare the single pass tokenizer with the per-line shlex tokenizer """
+    text = _largeSource(lines)
+
+    shlexStrings = [t.string for t in _shlexTokenize(text)]
+    regexStrings = [t.string for t in lexer.tokenize(text)]
+    if shlexStrings != regexStrings:
+        print('Lexer: token mismatch between shlex and regex tokenizer')
+
+    shlexTime = min(_timed(_shlexTokenize, text) for _ in range(3))
+    regexTime = min(_timed(lexer.tokenize, text) for _ in range(3))
+
+    print(f'Lexer: {lines} lines, {len(regexStrings)} tokens')
+    print(f'  shlex: {shlexTime*1000:8.1f} ms')
+    print(f'  regex: {regexTime*1000:8.1f} ms ({shlexTime/regexTime:.1f}x)')
+
+
+def _traced(function, *args):
+    """ memory size and number of allocated blocks retained by the result of function """
+    tracemalloc.start()
+    result = function(*args)
+    snapshot = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    statistics = snapshot.statistics('filename')
+    return sum(s.size for s in statistics), sum(s.count for s in statistics), result
+
+
+def benchmarkTokenStore(lines: int=40000):
+    """ compare retained memory of chunks as token lists with the compact token store """
+    text = _largeSource(lines)
+
+    def tokenLists():
+        return list(lexer.chunkSplit(lexer._translateLocalLabels(lexer.tokenize(text, 'large.asm'))))
+
+    def tokenStore():
+        store = lexer.TokenStore()
+        store.addTokens('large.asm', lexer._translateLocalLabels(lexer.tokenize(text, 'large.asm')))
+        return store
+
+    listSize, listCount, _ = _traced(tokenLists)
+    storeSize, storeCount, _ = _traced(tokenStore)
+
+    print(f'Chunks: {lines} lines')
+    print(f'  token lists: {listSize/1024:8.0f} KB in {listCount} blocks')
+    print(f'  token store: {storeSize/1024:8.0f} KB in {storeCount} blocks')
+
+
+def _testcaseImages() -> list:
+    """ (name, program) of the expected output of the regression tests, without the load address """
+    root = os.path.abspath(os.path.dirname(__file__))
+    images = []
+    for fileName in sorted(glob.glob(os.path.join(root, 'testcases/*.hex'))):
+        with open(fileName, 'r') as f:
+            data = bytes(int(value, 16) for line in f for value in line.split()[1:])
+        images.append((os.path.basename(fileName)[:-4], data[2:]))
+    return images
+
+
+def benchmarkCruncher(size: int=0x10000):
+    """ compression ratio and packing time of the regression test programs, of an image of them filling memory,
+        and of random bytes, the slowest case for the match finder """
+    images = _testcaseImages()
+    programs = b''.join(data for _, data in images)
+    large = (programs * (size // max(1, len(programs)) + 1))[:size]
+    generator = random.Random(64)
+    noise = bytes(generator.getrandbits(8) for _ in range(size))
+
+    print(f'Cruncher: {len(images)} test programs, {len(programs)} bytes')
+    for name, data in [('test programs', programs), (f'{size//1024} KB image', large), (f'{size//1024} KB random', noise)]:
+        times = []
+        for _ in range(3):
+            start = time.perf_counter()
+            packed, margin = cruncher.crunch(data)
+            times.append(time.perf_counter() - start)
+        if cruncher.decrunch(packed) != data:
+            print(f'  {name}: unpacked data differs')
+        print(f'  {name:>16}: {len(data):6} -> {len(packed):6} bytes ({len(packed)/max(1, len(data)):6.1%}), '
+            f'{min(times)*1000:7.1f} ms')
+
+
+def _bitmap(width: int, height: int, pixels: bytes) -> bytes:
+    """ 8 bits per pixel BMP file """
+    dataOffset = 14 + 40 + 256 * 4
+    header = struct.pack('<2sIHHI', b'BM', dataOffset + len(pixels), 0, 0, dataOffset)
+    dib = struct.pack('<IiiHHIIiiII', 40, width, height, 1, 8, 0, len(pixels), 2835, 2835, 256, 0)
+    return header + dib + bytes(256 * 4) + pixels
+
+
+def _flatSource(scale: float) -> str:
+    """ straight code, starting again at $1000 every 12000 lines """
+    lines = []
+    for i in range(int(100000 * scale) // 4):
+        if i % 3000 == 0:
+            lines.append('.org $1000')
+        lines += [f'l{i}: lda #{i & 0xff}', f' sta $0400+{i % 1000},x', ' dex', f' bne l{i}']
+    return '\n'.join(lines)
+
+
+def _repeatSource(scale: float) -> str:
+    """ .repeat nested 5 deep """
+    depth = 5
+    lines = ['.org $1000', f'.repeat "a", {max(1, round(6 * scale))}']
+    lines += [f'{" " * level}.repeat "{name}", 6' for level, name in enumerate('bcde', 1)]
+    lines += [f'{" " * depth}s = a + b + c + d + e', f'{" " * depth}.byte s & $ff']
+    lines += [f'{" " * level}.endr' for level in reversed(range(depth))]
+    return '\n'.join(lines)
+
+
+def _generatorSource(scale: float) -> str:
+    """ generators that expand to different text on each line, and to the same text """
+    lines = ['.org $1000']
+    for i in range(int(4000 * scale)):
+        lines += [f' @ldax(${i:04x})', ' @stax($2000)']
+    return '\n'.join(lines)
+
+
+def _bytefillSource(scale: float) -> str:
+    """ sine tables """
+    lines = ['.org $1000']
+    for i in range(int(160 * scale)):
+        lines.append(f't{i}: .bytefill 256, "x: lo(int(sin((x + {i}) / 40.74) * 127 + 128))"')
+    return '\n'.join(lines)
+
+
+def _forwardSource(scale: float) -> str:
+    """ references to labels and symbols that are defined later, the operands of lda are zero page """
+    count = int(8000 * scale)
+    lines = ['.org $1000']
+    for i in range(count):
+        lines += [f' lda v{i}', f' jmp f{i}', f'f{i}: sta v{i}+1']
+    lines += [f'v{i} = {i & 0x7f}' for i in range(count)]
+    return '\n'.join(lines)
+
+
+def _assetSource(scale: float, directory: str) -> str:
+    """ a .binary file and its slices, and a .sprite image """
+    binaryFile = os.path.join(directory, 'data.bin')
+    spriteFile = os.path.join(directory, 'sprites.bmp')
+    size = max(1, int(0xb000 * scale))
+    generator = random.Random(64)
+    with open(binaryFile, 'wb') as f:
+        f.write(bytes(generator.getrandbits(8) for _ in range(size)))
+    width, height = 24 * 10, 21 * max(1, int(10 * scale))
+    with open(spriteFile, 'wb') as f:
+        f.write(_bitmap(width, height, bytes(generator.choice([0, 1]) for _ in range(width * height))))
+    lines = ['.org $1000', f'.binary "{binaryFile}"', '.org $c000']
+    lines += [f'.binary "{binaryFile}", {i * size // 16}, {size // 256}' for i in range(16)]
+    lines += ['.org $d000', f'.sprite "{spriteFile}", 1']
+    return '\n'.join(lines)
+
+
+workloads = {
+    'flat': _flatSource,
+    'repeat': _repeatSource,
+    'generators': _generatorSource,
+    'bytefill': _bytefillSource,
+    'forward': _forwardSource,
+    'assets': _assetSource}
+
+
+def _build(inFile: str, outFile: str, directory: str, traced: bool=False) -> tuple:
+    """ seconds, passes and phases of a build without cached sources and expressions, and the peak memory if traced """
+    assemble.invalidate({fileName for fileName in assemble.loadedFiles() if fileName.startswith(directory)})
+    assemble._expandGenerator.cache_clear()
+    eval._compile.cache_clear()
+    eval._memo.clear()
+
+    assemble.multiPass.profiler = profiler.Profiler(detailed=False)
+    cacheDirectory = lexer.cacheDirectory
+    lexer.cacheDirectory = None
+    if traced:
+        tracemalloc.start()
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            anyErrors = assemble.multiPass(inFile, outFile)
+            seconds = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1] if traced else 0
+    finally:
+        tracemalloc.stop()
+        lexer.cacheDirectory = cacheDirectory
+        records = assemble.multiPass.profiler.records
+        assemble.multiPass.profiler = None
+
+    passes = [(count, seconds) for (category, name), (count, seconds) in records.items() if category == 'pass']
+    lex = sum(seconds for (category, _), (_, seconds) in records.items() if category == 'lex')
+    phases = {'lex': lex, 'pass 1': passes[0][1] - lex, 'later passes': sum(s for _, s in passes[1:]),
+        'report and save': seconds - sum(s for _, s in passes)}
+    return anyErrors, seconds, len(passes), phases, peak
+
+
+def runWorkloads(scale: float=1.0, runs: int=5) -> dict:
+    """ build each workload runs times, name -> fastest seconds, seconds of all builds, source lines, source lines
+        per second, passes, peak memory and seconds of each phase of the fastest build """
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for name, source in workloads.items():
+            inFile = os.path.join(directory, f'{name}.asm')
+            outFile = os.path.join(directory, f'{name}.prg')
+            with open(inFile, 'w') as f:
+                f.write(source(scale, directory) if name == 'assets' else source(scale))
+            with open(inFile) as f:
+                lines = len(f.read().splitlines())
+
+            builds = sorted((_build(inFile, outFile, directory) for _ in range(runs)), key=lambda build: build[1])
+            anyErrors, seconds, passes, phases, _ = builds[0]
+            peak = _build(inFile, outFile, directory, True)[-1]
+            results[name] = {'errors': anyErrors, 'seconds': seconds, 'times': [build[1] for build in builds], 'lines': lines, 'linesPerSecond': lines / seconds,
+                'passes': passes, 'peakMemory': peak, 'phases': phases}
+    return results
+
+
+def regressions(previousRuns: list, current: dict) -> list:
+    """ messages for the workloads that got slower than the median of the previous results, or use more memory or
+        more passes than the last of them """
+    messages = []
+    for name, result in current.items():
+        times = sorted(run[name]['seconds'] for run in previousRuns[-baselineRuns:] if name in run)
+        if len(times) == 0:
+            continue
+        old = next(run[name] for run in reversed(previousRuns) if name in run)
+        baseline = times[len(times)//2]
+        if result['seconds'] > baseline * slowdownLimit:
+            messages.append(f"{name}: {result['seconds']*1000:.0f} ms, was {baseline*1000:.0f} ms")
+        if result['peakMemory'] > old['peakMemory'] * memoryLimit:
+            messages.append(f"{name}: {result['peakMemory']/1024:.0f} KB peak memory, was {old['peakMemory']/1024:.0f} KB")
+        if result['passes'] > old['passes']:
+            messages.append(f"{name}: {result['passes']} passes, was {old['passes']}")
+        if result['errors'] and not old['errors']:
+            messages.append(f'{name}: errors')
+    return messages
+
+
+def benchmarkAssembler(scale: float=1.0, runs: int=5, fileName: str=resultsFile) -> bool:
+    """ build the synthetic workloads, print the results, compare the fastest builds with the runs saved in fileName
+        on the same machine and python version, and add them to it, True if there are no regressions """
+    results = runWorkloads(scale, runs)
+    print(f'Assembler: {runs} builds of each workload, scale {scale}')
+    print(f"  {'workload':<12} {'lines':>7} {'ms':>8} {'lines/s':>8} {'passes':>6} {'peak KB':>8}  phases ms")
+    for name, result in results.items():
+        phases = ', '.join(f'{phase} {seconds*1000:.0f}' for phase, seconds in result['phases'].items())
+        print(f"  {name:<12} {result['lines']:7} {result['seconds']*1000:8.1f} {result['linesPerSecond']:8.0f} "
+            f"{result['passes']:6} {result['peakMemory']/1024:8.0f}  {phases}{' (errors)' if result['errors'] else ''}")
+
+    try:
+        with open(fileName) as f:
+            saved = json.load(f)
+    except (OSError, ValueError):
+        saved = []
+    machine = {'python': platform.python_version(), 'machine': platform.node(), 'scale': scale}
+    comparable = [run for run in saved if run.get('machine') == machine]
+    messages = regressions([run['results'] for run in comparable], results)
+    for message in messages:
+        print(f'  regression: {message}')
+
+    saved = (saved + [{'time': time.strftime('%Y-%m-%d %H:%M:%S'), 'machine': machine, 'results': results}])[-savedRuns:]
+    with open(fileName, 'w') as f:
+        json.dump(saved, f, indent=1)
+    return len(messages) == 0
+
+
+def _importTimes() -> list:
+    """ (cumulative microseconds, module) of the modules that importing main loads, from python -X importtime """
+    root = os.path.abspath(os.path.dirname(__file__))
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import main'], cwd=root, capture_output=True, text=True)
+    times = []
+    for line in result.stderr.splitlines():
+        fields = line.split('|')
+        if len(fields) == 3 and fields[1].strip().isdigit():
+            times.append((int(fields[1]), fields[2].strip()))
+    return times
+
+
+def _timeToFirstPass(fileName: str) -> float:
+    """ seconds from starting a new python process until it is ready to run the first pass on fileName """
+    root = os.path.abspath(os.path.dirname(__file__))
+    code = f'import time, main, assemble; assemble.importSnapshot(); assemble.preload({fileName!r}); print(time.time())'
+    start = time.time()
+    result = subprocess.run([sys.executable, '-c', code], cwd=root, capture_output=True, text=True)
+    return float(result.stdout.split()[-1]) - start
+
+
+def benchmarkStartup(runs: int=10) -> bool:
+    """ time to the first pass of a small source, and the slowest imports, True if within startupBudget """
+    with tempfile.TemporaryDirectory() as directory:
+        fileName = os.path.join(directory, 'startup.asm')
+        with open(fileName, 'w') as f:
+            f.write('.org $0801\nstart: lda #0\n sta VIC_BORDER_COLOR\n rts\n')
+        times = sorted(_timeToFirstPass(fileName) for _ in range(runs))
+    median = times[len(times)//2]
+
+    importTimes = _importTimes()
+    eager = [name for name in lazyModules if name in {module for _, module in importTimes}]
+
+    print(f'Startup: {median*1000:.0f} ms to the first pass, budget {startupBudget*1000:.0f} ms')
+    for microseconds, module in sorted(importTimes, reverse=True)[1:9]:
+        print(f'  {microseconds/1000:6.1f} ms  import {module}')
+    if len(eager) > 0:
+        print(f"  imported before they are used: {', '.join(eager)}")
+
+    return median <= startupBudget and len(eager) == 0
+
+
+if __name__ == '__main__':
+    benchmarkLexer()
+    benchmarkTokenStore()
+    benchmarkCruncher()
+    fast = benchmarkAssembler()
+    if not benchmarkStartup():
+        print('Startup is over budget')
+        sys.exit(1)
+    if not fast:
+        print('Assembler is slower than the last run')
+        sys.exit(1)
@@ -0,0 +1,97 @@
+#! /usr/bin/env python3
+
+from context import Context
+
+
+class Segment:
+    """ top level lines between two checkpoints: the state at the checkpoint, and what the lines read and changed """
+    __slots__ = ('readPointerStack', 'zpAddress', 'warningCount', 'errorCount', 'passSymbols', 'passEncoding',
+        'lineCount', 'reads', 'writes', 'labels', 'memory', 'opaque', 'intervals', 'lastLabel')
+
+    def __init__(self, context: Context, passSymbols: dict, passEncoding: int):
+        self.readPointerStack = list(context.readPointerStack)
+        self.zpAddress = context.zpAddress
+        self.warningCount = len(context.warnings)
+        self.errorCount = len(context.errors)
+        self.passSymbols = passSymbols # symbols at the start of the pass that recorded the segment
+        self.passEncoding = passEncoding
+        self.lineCount = 0
+        self.reads = frozenset()
+        self.writes = {} # symbol -> value at the end of the segment
+        self.labels = ()
+        self.memory = None # changed memory range, see MemoryImage.takeChanges
+        self.opaque = False
+        self.intervals = context.intervals.mark() # written intervals at the checkpoint, see IntervalIndex.restore
+        self.lastLabel = context.lastLabel
+
+
+def begin(context: Context, passSymbols: dict, passEncoding: int) -> Segment:
+    """ start recording a segment at the current line """
+    context.reads = set()
+    context.writes = set()
+    context.opaque = False
+    context.memory.takeChanges()
+    return Segment(context, passSymbols, passEncoding)
+
+
+def end(segment: Segment, context: Context):
+    """ finish recording a segment """
+    symbols = context.symbols
+    segment.reads = frozenset(context.reads)
+    segment.writes = {name: symbols[name] for name in context.writes if name in symbols}
+    segment.writes['_'] = symbols['_'] # the current memory location is written by most lines
+    segment.labels = tuple(name for name in context.writes if name in context.labels)
+    segment.memory = context.memory.takeChanges()
+    segment.opaque = context.opaque
+
+
+def _same(a, b) -> bool:
+    try:
+        return a is b or (type(a) is type(b) and a == b)
+    except Exception:
+        return False
+
+
+_missing = object()
+
+
+def changedRead(segment: Segment, passSymbols: dict, passEncoding: int) -> str:
+    """ why replaying segment could give a different result in a pass starting with passSymbols, None if it can't """
+    if segment.opaque:
+        return 'python code with unknown effects'
+    if passEncoding != segment.passEncoding:
+        return 'text encoding'
+    if segment.passSymbols is not passSymbols:
+        for name in segment.reads:
+            if not _same(segment.passSymbols.get(name, _missing), passSymbols.get(name, _missing)):
+                return f'"{name}"'
+    return None
+
+
+def resumeIndex(segments: list, passSymbols: dict, passEncoding: int) -> tuple:
+    """ index of the first segment that has to run again, and the reason """
+    for index, segment in enumerate(segments):
+        reason = changedRead(segment, passSymbols, passEncoding)
+        if reason is not None:
+            return index, reason
+    return max(0, len(segments) - 1), None # nothing changed, run the last segment again
+
+
+def resume(segments: list, index: int, context: Context, lastContext: Context) -> int:
+    """ set context to the state at the start of segments[index] by replaying the effects of the segments before it,
+        which must be unchanged, returns the number of lines skipped """
+    symbols = context.symbols
+    for segment in segments[:index]:
+        symbols.update(segment.writes)
+        context.labels.update(segment.labels)
+        context.memory.applyChanges(segment.memory)
+    context.memory.takeChanges()
+
+    start = segments[index]
+    context.readPointerStack = list(start.readPointerStack)
+    context.zpAddress = start.zpAddress
+    context.intervals.restore(lastContext.intervals, start.intervals)
+    context.lastLabel = start.lastLabel
+    context.warnings = lastContext.warnings[:start.warningCount]
+    context.errors = lastContext.errors[:start.errorCount]
+    return sum(segment.lineCount for segment in segments[:index])
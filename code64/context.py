@@ -1,24 +1,40 @@
 #! /usr/bin/env python3
 
-import math
 import os
-import unittest
+
+from memory import IntervalIndex, MemoryImage
+
+
+def _byteCount(count: int) -> str:
+    return f'{count} byte' if count == 1 else f'{count} bytes'
 
 
 class Context:
     def __init__(self, symbols: dict):
         self.readPointerStack = []
-        
-        symbols.update(math.__dict__)
         self.symbols = symbols
         self.labels = set()
-        self.memory = {}
+        self.memory = MemoryImage()
+        self.intervals = IntervalIndex() # where each run of bytes in memory was written
+        self.lastLabel = None # the last label since the last .org, names new intervals
         self.warnings = []
         self.errors = []
         self.repeatStack = []
         self.macroDict = {}
         self.zpAddress = 2 # $0 and $1 are reserved
         self.path = ''
+        self.evaluations = 0
+        self.skippedEvaluations = 0
+        self.changedSymbols = set() # symbols that changed value in the previous pass
+        self.reads = set() # symbols read since the last checkpoint
+        self.writes = set() # symbols written since the last checkpoint
+        self.opaque = False # True when code with unknown effects ran since the last checkpoint
+        self.wideOperands = set() # instructions that use absolute instead of zero page addressing, kept across passes
+        self.wideOperandsChanged = False
+        self.files = set() # files the read pointer entered, and python files executed
+        self.generatorCalls = 0
+        self.generatorExpansions = 0 # generator calls that returned different text than the last time
+        self.generatorSeconds = 0.0
 
 
     def readPointer(self):
@@ -36,6 +52,7 @@ class Context:
         
     def pushReadPointer(self, readPointer: tuple):
         self.readPointerStack.append(readPointer)
+        self.files.add(readPointer[0])
         
         
     def popReadPointer(self):
@@ -47,16 +64,16 @@ class Context:
         
     def advanceReadPointer(self):
         if len(self.readPointerStack) > 0:
-            fileName, lineIndex = self.popReadPointer()
-            readPointer = (fileName, lineIndex + 1)        
-            self.pushReadPointer(readPointer)
+            fileName, lineIndex = self.readPointerStack[-1]
+            readPointer = (fileName, lineIndex + 1)
+            self.readPointerStack[-1] = readPointer
             return readPointer
         else:
             return None
         
     
-    def __formattedReadPointer(self):
-        rp = self.readPointer()
+    def __formattedReadPointer(self, readPointer: tuple=None):
+        rp = self.readPointer() if readPointer is None else readPointer
         if rp is None:
             s = ''
         else:
@@ -65,9 +82,9 @@ class Context:
         return s
 
 
-    def reportWarning(self, text: str):
-        ''' report a warnings '''
-        rp = self.__formattedReadPointer()
+    def reportWarning(self, text: str, readPointer: tuple=None):
+        ''' report a warnings, at readPointer or the current line '''
+        rp = self.__formattedReadPointer(readPointer)
         self.warnings.append(f'{rp}warning: {text}')
 
 
@@ -81,14 +98,20 @@ class Context:
         ''' print memory use '''
 
         if len(self.memory) > 0:
-            first = min(self.memory.keys())
-            last = max(self.memory.keys())
+            first = self.memory.first
+            last = self.memory.last
             total = last-first+1
             use = f"${first:04x}-${last:04x} ({total} bytes)"
         else:
             use = 'None'
 
         print(f'Memory used: {use}')
+
+        # the written runs of bytes, with where they start in the source
+        if len(self.intervals) > 1:
+            print('Segments:')
+            for interval in sorted(self.intervals, key=lambda interval: interval.start):
+                print(f'  {interval}, {_byteCount(len(interval))}')
         
         lst = sorted(map(lambda label: (self.symbols[label], label), self.labels))
         for value, label in lst:
@@ -100,9 +123,7 @@ class Context:
             elif used > 0 and used < 256: return '▒'
             elif used >= 256: return '▓'
 
-        pages = [0]*256
-        for address in self.memory:
-            pages[int(address>>8)] += 1
+        pages = self.memory.pageUse()
         pageString = "".join(map(_pageSymbol, pages))
 
         fullPagesUsed = len(list(filter(lambda x: x>=256, pages)))
@@ -113,20 +134,15 @@ class Context:
             print(f"${i*16*256:04x}: {pageString[i*16:(i+1)*16]}")
 
 
+    def reportOverlaps(self):
+        ''' report a warning for each pair of intervals that wrote the same addresses '''
+        for earlier, later, first, last in self.intervals.overlaps():
+            self.reportWarning(f'{_byteCount(last-first+1)} at ${first:04x}-${last:04x} of ${later.start:04x}-${later.end-1:04x}'
+                f' overwrite {earlier}', later.origin)
+
+
     def printAsmReport(self):
         ''' print warnings and errors from assemble pass '''
         
         for i in self.warnings + self.errors:
             print(i)
-
-
-################################################################################
-
-class TestAssemble(unittest.TestCase):
-
-    def testTest(self):
-        pass
-
-
-if __name__ == '__main__':
-    unittest.main()
@@ -3,8 +3,8 @@
 # https://en.wikipedia.org/wiki/MOS_Technology_6502
 # https://www.masswerk.at/6502/6502_instruction_set.html
 
+from array import array
 from enum import Enum
-import unittest
 
 class AddressMode(Enum):
     absolute    = 'absolute'
@@ -117,41 +117,121 @@ _mnemonicMap = {instruction.mnemonic: instruction for instruction in instruction
 
 
 def instructionWithMnemonic(mnemonic: str) -> Instruction:
-    return _mnemonicMap[mnemonic] if mnemonic in _mnemonicMap else None
+    return _mnemonicMap.get(mnemonic)
 
 
 def isMnemonic(mnemonic: str) -> bool:
     """ check if string is an instruction mnemonic """
-    return instructionWithMnemonic(mnemonic) != None
-
-
-################################################################################
-
-
-class TestCpu(unittest.TestCase):
-
-    def testInstructionSet(self):
-        self.assertEqual(len(instructionSet), 56)
-        
-        i = instructionWithMnemonic('lda')
-        self.assertEqual(i.mnemonic, 'lda')
-
-        i = instructionWithMnemonic('xxx')
-        self.assertEqual(i, None)
-
-
-    def testIsMnemonic(self):
-        self.assertEqual(isMnemonic(''), False)
-        self.assertEqual(isMnemonic('a'), False)
-        self.assertEqual(isMnemonic('yyy'), False)
-        self.assertEqual(isMnemonic('lda'), True)
-        self.assertEqual(isMnemonic('sta'), True)
-        self.assertEqual(isMnemonic('nop'), True)
-        
-
-if __name__ == '__main__':
-    unittest.main()
-
-
-# IDEA: support for illegal instructions
-# IDEA: cycle counting for instructions
+    return mnemonic in _mnemonicMap
+
+
+# flat encoding tables, generated from the instruction set
+
+mnemonics = sorted(_mnemonicMap)
+addressModes = list(AddressMode)
+
+_mnemonicIds = {mnemonic: i for i, mnemonic in enumerate(mnemonics)}
+_modeIds = {mode: i for i, mode in enumerate(addressModes)}
+
+_modeLengths = {
+    AddressMode.absolute:    3,
+    AddressMode.absoluteX:   3,
+    AddressMode.absoluteY:   3,
+    AddressMode.accumulator: 1,
+    AddressMode.immediate:   2,
+    AddressMode.implied:     1,
+    AddressMode.indirect:    3,
+    AddressMode.indirectX:   2,
+    AddressMode.indirectY:   2,
+    AddressMode.relative:    2,
+    AddressMode.zeroPage:    2,
+    AddressMode.zeroPageX:   2,
+    AddressMode.zeroPageY:   2}
+
+_modeCycles = { # base cycles, without page crossing or branch taken penalties
+    AddressMode.absolute:    4,
+    AddressMode.absoluteX:   4,
+    AddressMode.absoluteY:   4,
+    AddressMode.accumulator: 2,
+    AddressMode.immediate:   2,
+    AddressMode.implied:     2,
+    AddressMode.indirect:    5,
+    AddressMode.indirectX:   6,
+    AddressMode.indirectY:   5,
+    AddressMode.relative:    2,
+    AddressMode.zeroPage:    3,
+    AddressMode.zeroPageX:   4,
+    AddressMode.zeroPageY:   4}
+
+_readModifyWrite = {'asl', 'dec', 'inc', 'lsr', 'rol', 'ror'}
+
+_cycleExceptions = {
+    ('brk', AddressMode.implied): 7,
+    ('jmp', AddressMode.absolute): 3,
+    ('jsr', AddressMode.absolute): 6,
+    ('pha', AddressMode.implied): 3,
+    ('php', AddressMode.implied): 3,
+    ('pla', AddressMode.implied): 4,
+    ('plp', AddressMode.implied): 4,
+    ('rti', AddressMode.implied): 6,
+    ('rts', AddressMode.implied): 6,
+    ('sta', AddressMode.absoluteX): 5,
+    ('sta', AddressMode.absoluteY): 5,
+    ('sta', AddressMode.indirectY): 6}
+
+
+def _baseCycles(mnemonic: str, mode: AddressMode) -> int:
+    if (mnemonic, mode) in _cycleExceptions:
+        return _cycleExceptions[(mnemonic, mode)]
+    if mnemonic in _readModifyWrite and mode != AddressMode.accumulator:
+        return {AddressMode.zeroPage: 5, AddressMode.zeroPageX: 6, AddressMode.absolute: 6, AddressMode.absoluteX: 7}[mode]
+    return _modeCycles[mode]
+
+
+# mnemonic id * mode count + mode id -> opcode, or -1 if the mode is not supported
+encodingTable = array('h', [-1] * (len(mnemonics) * len(addressModes)))
+
+# opcode -> mnemonic, address mode, byte length and base cycle count, 0/None for unused opcodes
+opcodeMnemonics = [None] * 256
+opcodeModes = [None] * 256
+opcodeLengths = bytearray(256)
+opcodeCycles = bytearray(256)
+
+for _instruction in instructionSet:
+    for _mode, _opcode in _instruction.opcodes.items():
+        encodingTable[_mnemonicIds[_instruction.mnemonic] * len(addressModes) + _modeIds[_mode]] = _opcode
+        opcodeMnemonics[_opcode] = _instruction.mnemonic
+        opcodeModes[_opcode] = _mode
+        opcodeLengths[_opcode] = _modeLengths[_mode]
+        opcodeCycles[_opcode] = _baseCycles(_instruction.mnemonic, _mode)
+
+
+def opcode(mnemonic: str, mode: AddressMode) -> int:
+    """ opcode of an instruction in an address mode, None if not supported """
+    mnemonicId = _mnemonicIds.get(mnemonic)
+    if mnemonicId is None:
+        return None
+    opcode = encodingTable[mnemonicId * len(addressModes) + _modeIds[mode]]
+    return opcode if opcode >= 0 else None
+
+
+def encode(mnemonic: str, mode: AddressMode, value: int=0) -> bytes:
+    """ machine code of an instruction in an address mode with an operand value, None if not supported """
+    o = opcode(mnemonic, mode)
+    if o is None:
+        return None
+    length = opcodeLengths[o]
+    if length == 1:
+        return bytes((o,))
+    elif length == 2:
+        return bytes((o, value & 0xff))
+    else:
+        return bytes((o, value & 0xff, (value >> 8) & 0xff))
+
+
+def decode(opcode: int) -> tuple:
+    """ mnemonic, address mode and byte length of an opcode, None if not an instruction """
+    mnemonic = opcodeMnemonics[opcode]
+    if mnemonic is None:
+        return None
+    return mnemonic, opcodeModes[opcode], opcodeLengths[opcode]
@@ -0,0 +1,145 @@
+#! /usr/bin/env python3
+
+from array import array
+
+
+# the stream is a list of
+#   $00-$7f             n+1 literal bytes follow
+#   $80-$bf offset-1    copy (n & $3f) + 3 bytes from offset bytes back, offset 1..256
+#   $c0-$fe offset      copy (n & $3f) + 4 bytes from offset bytes back, 16 bit offset
+#   $ff                 end
+maxLiteral = 128
+minShort, maxShort = 3, 66
+minLong, maxLong = 4, 66
+maxOffset = 0xffff
+endMarker = 0xff
+
+chainDepth = 64 # candidates looked at for each position, more packs better and slower
+
+
+def _matchLength(data: bytes, i: int, j: int, limit: int) -> int:
+    """ length of the common prefix of data[i:] and data[j:], at most limit """
+    length = 0
+    while length + 8 <= limit and data[i+length:i+length+8] == data[j+length:j+length+8]:
+        length += 8
+    while length < limit and data[i+length] == data[j+length]:
+        length += 1
+    return length
+
+
+def _cost(length: int, offset: int) -> int:
+    """ bytes saved by a match, 0 if it can't be encoded or doesn't save anything """
+    if offset <= 256 and length >= minShort:
+        return length - 2
+    if length >= minLong:
+        return length - 3
+    return 0
+
+
+class _Matcher:
+    """ hash chains of the positions of the 3 byte strings in data """
+
+    def __init__(self, data: bytes, depth: int):
+        self.data = data
+        self.depth = depth
+        self.head = {} # 3 bytes -> last position
+        self.chain = array('l', [-1]) * len(data) # position -> previous position with the same 3 bytes
+        self.inserted = 0 # positions before this are in the chains
+
+    def insertUntil(self, end: int):
+        data, head, chain = self.data, self.head, self.chain
+        for position in range(self.inserted, min(end, len(data) - 2)):
+            key = data[position:position+3]
+            chain[position] = head.get(key, -1)
+            head[key] = position
+        self.inserted = max(self.inserted, end)
+
+    def find(self, position: int) -> tuple:
+        """ (saving, length, offset) of the best match at position, earlier positions must be inserted """
+        data = self.data
+        limit = min(maxShort, len(data) - position)
+        best = (0, 0, 0)
+        if limit < minShort:
+            return best
+        candidate = self.head.get(data[position:position+3], -1)
+        depth = self.depth
+        while candidate >= 0 and depth > 0 and position - candidate <= maxOffset:
+            # only look at candidates that can be longer than the best
+            bestLength = best[1]
+            if bestLength == 0 or (bestLength < limit and data[candidate+bestLength] == data[position+bestLength]):
+                length = _matchLength(data, position, candidate, limit)
+                saving = _cost(length, position - candidate)
+                if saving > best[0]:
+                    best = (saving, length, position - candidate)
+                    if length == limit:
+                        break
+            candidate = self.chain[candidate]
+            depth -= 1
+        return best
+
+
+def crunch(data: bytes, depth: int=chainDepth) -> tuple:
+    """ packed stream of data, and the number of bytes the unpacked data can get ahead of the packed data
+        while unpacking, which is how far below the packed data it can start when unpacking in place """
+    data = bytes(data)
+    matcher = _Matcher(data, depth)
+    packed = bytearray()
+    literals = bytearray()
+    margin = 0
+
+    def flush():
+        for start in range(0, len(literals), maxLiteral):
+            run = literals[start:start+maxLiteral]
+            packed.append(len(run) - 1)
+            packed.extend(run)
+        literals.clear()
+
+    position = 0
+    while position < len(data):
+        matcher.insertUntil(position)
+        saving, length, offset = matcher.find(position)
+
+        # lazy matching, a literal is better when the next position has a better match
+        if saving > 0 and length < maxShort and position + 1 < len(data):
+            matcher.insertUntil(position + 1)
+            if matcher.find(position + 1)[0] > saving:
+                saving = 0
+
+        if saving == 0:
+            literals.append(data[position])
+            position += 1
+            continue
+
+        flush()
+        if offset <= 256 and length <= maxShort:
+            packed.extend((0x80 | (length - minShort), offset - 1))
+        else:
+            packed.extend((0xc0 | (length - minLong), offset & 0xff, offset >> 8))
+        position += length
+        margin = max(margin, position - len(packed))
+
+    flush()
+    packed.append(endMarker)
+    margin = max(margin, len(data) - len(packed))
+    return bytes(packed), margin
+
+
+def decrunch(packed: bytes) -> bytes:
+    """ unpack a stream, like the 6502 decruncher """
+    data = bytearray()
+    index = 0
+    while packed[index] != endMarker:
+        control = packed[index]
+        if control < 0x80:
+            data += packed[index+1:index+control+2]
+            index += control + 2
+            continue
+        if control < 0xc0:
+            length, offset = (control & 0x3f) + minShort, packed[index+1] + 1
+            index += 2
+        else:
+            length, offset = (control & 0x3f) + minLong, packed[index+1] | packed[index+2] << 8
+            index += 3
+        for _ in range(length): # the copy can overlap itself
+            data.append(data[-offset])
+    return bytes(data)
@@ -0,0 +1,261 @@
+#! /usr/bin/env python3
+
+import ast
+import contextlib
+import hmac
+import io
+import json
+import os
+import secrets
+import socket
+import socketserver
+import threading
+import time
+
+import assemble
+import batch
+import output
+import profiler
+
+
+defaultPort = 6464
+tokenDirectory = os.path.expanduser('~') # where the daemon writes the token that clients must send
+
+
+def tokenFile(port: int) -> str:
+    return os.path.join(tokenDirectory, f'.code64-daemon-{port}')
+
+
+def _readToken(port: int) -> str:
+    """ the token of the daemon on port, None if there is none """
+    try:
+        with open(tokenFile(port)) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def _invalidMessage(message) -> str:
+    """ what is wrong with a request, None if it can be handled """
+    if not isinstance(message, dict):
+        return 'not an object'
+    command = message.get('command')
+    if command == 'stop':
+        return None
+    elif command != 'assemble':
+        return f'unknown command: {command!r}'
+    elif not isinstance(message.get('cwd'), str) or not isinstance(message.get('targets'), list):
+        return 'missing cwd or targets'
+    elif not os.path.isdir(message['cwd']):
+        return f"no directory {message['cwd']}"
+    for target in message['targets']:
+        if not isinstance(target, dict) or not isinstance(target.get('inFile'), str) \
+                or not isinstance(target.get('outFile'), (str, type(None))) or not isinstance(target.get('defines'), dict):
+            return 'invalid target'
+    return None
+
+
+class Watcher:
+    """ modification stamps of the files with cached contents, to find the ones that changed """
+
+    def __init__(self):
+        self.stamps = {} # cached file name -> (absolute path, stamp)
+
+    def _stamp(self, path: str) -> tuple:
+        try:
+            status = os.stat(path)
+            return status.st_mtime_ns, status.st_size
+        except OSError:
+            return None
+
+    def update(self, fileNames: list=[], since: int=None):
+        """ watch the files loaded since the last update, and fileNames, the ones modified after since,
+            a time.time_ns() taken before they were read, count as changed, their contents may be older """
+        for fileName in assemble.loadedFiles().union(fileNames):
+            if not fileName in self.stamps:
+                path = os.path.abspath(fileName)
+                stamp = self._stamp(path)
+                if stamp is not None and since is not None and stamp[0] >= since:
+                    stamp = (None, None)
+                self.stamps[fileName] = (path, stamp)
+
+    def forget(self, fileNames: set):
+        for fileName in fileNames:
+            self.stamps.pop(fileName, None)
+
+    def changed(self) -> set:
+        """ the files that changed since they were loaded, they are watched again after the next update """
+        changed = {fileName for fileName, (path, stamp) in self.stamps.items() if self._stamp(path) != stamp}
+        self.forget(changed)
+        return changed
+
+
+def refresh(watcher: Watcher) -> set:
+    """ drop the cached contents of the files that changed """
+    changed = watcher.changed()
+    if len(changed) > 0:
+        assemble.invalidate(changed)
+    return changed
+
+
+def build(targets: list, watcher: Watcher, verbose: bool=False) -> bool:
+    """ assemble targets with the caches of earlier builds, True if any target has errors """
+    anyErrors = False
+    started = time.time_ns()
+    for target in targets:
+        start = time.perf_counter()
+        try:
+            anyErrors |= assemble.multiPass(target.inFile, target.outFile, verbose, target.defines)
+        except Exception as exception:
+            print(f'{target.inFile} error: {exception}')
+            anyErrors = True
+        print(f'Assembled {target.inFile} in {time.perf_counter() - start:.2f}s')
+    watcher.update([target.inFile for target in targets], started)
+    return anyErrors
+
+
+def watch(targets: list, verbose: bool=False, interval: float=0.2):
+    """ assemble targets again whenever a file they use changes, until interrupted """
+    watcher = Watcher()
+    build(targets, watcher, verbose)
+    print('Watching for changes, press Ctrl-C to stop')
+    try:
+        while True:
+            time.sleep(interval)
+            changed = refresh(watcher)
+            if len(changed) > 0:
+                print(f"Changed: {', '.join(sorted(changed))}")
+                build(targets, watcher, verbose)
+    except KeyboardInterrupt:
+        pass
+
+
+class _Server(socketserver.TCPServer):
+    """ handles one request at a time, the caches are not thread safe
+        only clients that can read the token file, which only its owner can, are served """
+    allow_reuse_address = True
+
+    def __init__(self, address: tuple):
+        super().__init__(address, _Handler)
+        self.watcher = Watcher()
+        self.cwd = os.getcwd()
+        self.token = secrets.token_hex(16)
+        self.tokenFile = tokenFile(self.server_address[1])
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(self.tokenFile)
+        with os.fdopen(os.open(self.tokenFile, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600), 'w') as f:
+            f.write(self.token)
+
+    def server_close(self):
+        super().server_close()
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(self.tokenFile)
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    timeout = 5.0 # seconds a client has to send its request, so that an idle one doesn't block the others
+
+    def handle(self):
+        server = self.server
+        try:
+            message = json.loads(self.rfile.readline())
+        except OSError:
+            return # timed out or disconnected
+        except ValueError:
+            message = None
+        if not isinstance(message, dict) or not hmac.compare_digest(str(message.get('token')).encode(), server.token.encode()):
+            self._reply('Daemon error: invalid token\n', True)
+            return
+        error = _invalidMessage(message)
+        if error is not None:
+            self._reply(f'Daemon error: invalid request, {error}\n', True)
+            return
+
+        if message['command'] == 'stop':
+            self._reply('Daemon stopped\n', False)
+            threading.Thread(target=server.shutdown).start()
+            return
+
+        printed = io.StringIO()
+        with contextlib.redirect_stdout(printed):
+            # music and image file names are relative to the working directory of the client
+            if message['cwd'] != server.cwd:
+                os.chdir(message['cwd'])
+                server.cwd = message['cwd']
+                relative = {fileName for fileName in assemble.loadedFiles() if not os.path.isabs(fileName)}
+                assemble.invalidate(relative)
+                server.watcher.forget(relative)
+
+            changed = refresh(server.watcher)
+            if len(changed) > 0 and message.get('verbose', False):
+                print(f"Changed: {', '.join(sorted(changed))}")
+
+            assemble.multiPass.outputMode = message.get('outputMode', 'prg')
+            assemble.multiPass.gap = message.get('gap', output.defaultGap)
+            assemble.multiPass.lazyImports = message.get('lazyImports', False)
+            assemble.multiPass.profiler = profiler.Profiler(message.get('profileFile')) if message.get('profile', False) else None
+            try:
+                targets = [batch.Target(target['inFile'], target['outFile'],
+                    {name: ast.literal_eval(value) for name, value in target['defines'].items()}, target.get('variant'))
+                    for target in message['targets']]
+            except (ValueError, TypeError, SyntaxError) as exception:
+                print(f'Daemon error: invalid define, {exception}')
+                targets = None
+            anyErrors = build(targets, server.watcher, message.get('verbose', False)) if targets is not None else True
+        self._reply(printed.getvalue(), anyErrors)
+
+    def _reply(self, output: str, anyErrors: bool):
+        self.wfile.write(json.dumps({'output': output, 'anyErrors': anyErrors}).encode() + b'\n')
+
+
+def serve(port: int=defaultPort):
+    """ assemble the requests of clients on localhost, keeping sources, imports and assets loaded between them """
+    with _Server(('127.0.0.1', port)) as server:
+        assemble.loadImports()
+        print(f'Daemon listening on port {server.server_address[1]}')
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+
+def request(message: dict, port: int=defaultPort) -> dict:
+    """ send a request to the daemon with its token, None if no daemon is running """
+    token = _readToken(port)
+    if token is None:
+        return None
+    message = dict(message, token=token)
+    try:
+        connection = socket.create_connection(('127.0.0.1', port), timeout=1.0)
+    except OSError:
+        return None
+    with connection:
+        connection.settimeout(None) # assembling can take long
+        connection.sendall(json.dumps(message).encode() + b'\n')
+        with connection.makefile('rb') as f:
+            return json.loads(f.readline())
+
+
+def assembleRemote(targets: list, verbose: bool=False, port: int=defaultPort) -> bool:
+    """ assemble targets in the daemon and print its output, True if any target has errors, None if no daemon is running """
+    profileFile = getattr(assemble.multiPass.profiler, 'dumpFile', None)
+    message = {'command': 'assemble', 'cwd': os.getcwd(), 'verbose': verbose,
+        'outputMode': assemble.multiPass.outputMode, 'gap': assemble.multiPass.gap,
+        'lazyImports': assemble.multiPass.lazyImports,
+        'profile': assemble.multiPass.profiler is not None,
+        'profileFile': os.path.abspath(profileFile) if profileFile is not None else None,
+        'targets': [{
+        'inFile': os.path.abspath(target.inFile),
+        'outFile': os.path.abspath(target.outFile) if target.outFile is not None else None,
+        'defines': {name: repr(value) for name, value in (target.defines or {}).items()},
+        'variant': target.variant} for target in targets]}
+    reply = request(message, port)
+    if reply is None:
+        return None
+    print(reply['output'], end='')
+    return reply['anyErrors']
+
+
+def stop(port: int=defaultPort) -> bool:
+    """ stop the daemon, False if none is running """
+    return request({'command': 'stop'}, port) is not None
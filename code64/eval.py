@@ -1,28 +1,263 @@
 #! /usr/bin/env python3
 
+import ast
 import builtins
-import unittest
+import functools
+import operator
 import types
 
-#--
-import pathlib, sys
-sys.path.append(str(pathlib.Path(__file__).parent.absolute()))
-#--
-
 from context import Context
 
 
+_binaryOperators = {
+    ast.Add: operator.add, ast.Sub: operator.sub, ast.Mult: operator.mul,
+    ast.FloorDiv: operator.floordiv, ast.Mod: operator.mod,
+    ast.LShift: operator.lshift, ast.RShift: operator.rshift,
+    ast.BitAnd: operator.and_, ast.BitOr: operator.or_, ast.BitXor: operator.xor}
+
+_unaryOperators = {ast.USub: operator.neg, ast.UAdd: operator.pos, ast.Invert: operator.invert}
+
+
+def _builtin(symbols: dict, name: str):
+    """ look up a name that is not in symbols, the same way eval falls back to builtins """
+    b = symbols.get('__builtins__', builtins)
+    if type(b) is not dict:
+        b = b.__dict__
+    try:
+        return b[name]
+    except KeyError:
+        raise NameError(f"name '{name}' is not defined") from None
+
+
+class _Constant:
+    """ marks a folded constant in the fast path tree """
+    def __init__(self, value):
+        self.value = value
+
+
+def _fastNode(node, reads: set, calls: set):
+    """ a function of symbols that evaluates node, or None when node is outside the simple integer subset """
+
+    if isinstance(node, ast.Constant) and type(node.value) is int:
+        return _Constant(node.value)
+
+    elif isinstance(node, ast.Name):
+        name = node.id
+        reads.add(name)
+        def lookup(symbols):
+            try:
+                return symbols[name]
+            except KeyError:
+                return _builtin(symbols, name)
+        return lookup
+
+    elif isinstance(node, ast.UnaryOp) and type(node.op) in _unaryOperators:
+        op = _unaryOperators[type(node.op)]
+        operand = _fastNode(node.operand, reads, calls)
+        if operand is None:
+            return None
+        if type(operand) is _Constant:
+            return _Constant(op(operand.value))
+        return lambda symbols: op(operand(symbols))
+
+    elif isinstance(node, ast.BinOp) and type(node.op) in _binaryOperators:
+        op = _binaryOperators[type(node.op)]
+        left = _fastNode(node.left, reads, calls)
+        right = _fastNode(node.right, reads, calls)
+        if left is None or right is None:
+            return None
+        if type(left) is _Constant and type(right) is _Constant:
+            try:
+                return _Constant(op(left.value, right.value))
+            except Exception:
+                left, right = _function(left), _function(right) # raise when evaluated, like eval does
+        if type(right) is _Constant:
+            rightValue = right.value
+            return lambda symbols: op(left(symbols), rightValue)
+        if type(left) is _Constant:
+            leftValue = left.value
+            return lambda symbols: op(leftValue, right(symbols))
+        return lambda symbols: op(left(symbols), right(symbols))
+
+    elif isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and len(node.keywords) == 0:
+        function = _fastNode(node.func, reads, calls)
+        calls.add(node.func.id)
+        arguments = [_fastNode(a, reads, calls) for a in node.args]
+        if any(a is None for a in arguments):
+            return None
+        arguments = [_function(a) for a in arguments]
+        if len(arguments) == 1:
+            argument = arguments[0]
+            return lambda symbols: function(symbols)(argument(symbols))
+        return lambda symbols: function(symbols)(*[a(symbols) for a in arguments])
+
+    elif isinstance(node, ast.Tuple) and isinstance(node.ctx, ast.Load):
+        elements = [_fastNode(e, reads, calls) for e in node.elts]
+        if any(e is None for e in elements):
+            return None
+        elements = [_function(e) for e in elements]
+        return lambda symbols: tuple([e(symbols) for e in elements])
+
+    return None
+
+
+def _function(node):
+    """ a function of symbols, also for a folded constant """
+    if type(node) is _Constant:
+        value = node.value
+        return lambda symbols: value
+    return node
+
+
+def _fastEvaluator(e: str, reads: set=None, calls: set=None):
+    """ evaluator for simple integer expressions, None if e needs the full python eval """
+    try:
+        tree = ast.parse(e, mode='eval')
+    except SyntaxError:
+        return None
+    node = _fastNode(tree.body, set() if reads is None else reads, set() if calls is None else calls)
+    if node is None:
+        return None
+    return _function(node)
+
+
+def codeNames(code) -> set:
+    """ all global names a code object and its nested code objects may read """
+    names = set(code.co_names)
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            names |= codeNames(const)
+    return names
+
+
+class _Compiled:
+    """ an expression compiled to an evaluator, a function of symbols, with the symbols it reads """
+    __slots__ = ('evaluate', 'dependencies', 'calls', 'assigns', 'memoize')
+
+    def __init__(self, evaluate, dependencies: tuple, calls: tuple, assigns: tuple, memoize: bool):
+        self.evaluate = evaluate
+        self.dependencies = dependencies
+        self.calls = calls # names that may be called
+        self.assigns = assigns # names that may be assigned, like with :=
+        self.memoize = memoize
+
+
+@functools.lru_cache(maxsize=4096)
+def _compile(e: str) -> _Compiled:
+    """ compiled expression, cached by expression text """
+    e = e.lstrip(' \t') # like eval does
+    reads, calls = set(), set()
+    evaluator = _fastEvaluator(e, reads, calls)
+    if evaluator is not None:
+        # only worth memoizing when evaluating does more than a single lookup
+        memoize = len(reads) > 0 and e.strip() not in reads
+        return _Compiled(evaluator, tuple(sorted(reads)), tuple(sorted(calls)), (), memoize)
+    code = compile(e, '<string>', 'eval')
+    names = tuple(sorted(codeNames(code)))
+    return _Compiled(functools.partial(builtins.eval, code), names, names, names, False)
+
+
+def dependencies(e: str) -> tuple:
+    """ the symbols an expression reads """
+    try:
+        return _compile(e).dependencies
+    except SyntaxError:
+        return ()
+
+
+pureFunctions = set() # functions without side effects, their results may be memoized
+readOnlyFunctions = set() # functions without side effects, their results may depend on state other than symbols
+_memo = {} # expression -> (dependency values, dependency types, value)
+_memoLimit = 65536
+
+_readOnlyBuiltins = {'abs', 'all', 'any', 'bin', 'bool', 'bytes', 'chr', 'dict', 'divmod', 'enumerate',
+    'filter', 'float', 'format', 'frozenset', 'hex', 'int', 'isinstance', 'len', 'list', 'map', 'max',
+    'min', 'oct', 'ord', 'pow', 'range', 'repr', 'reversed', 'round', 'set', 'slice', 'sorted', 'str',
+    'sum', 'tuple', 'type', 'zip'}
+
+_mutatingMethods = {'add', 'append', 'clear', 'discard', 'extend', 'insert', 'pop', 'popitem', 'remove',
+    'reverse', 'setdefault', 'sort', 'update'}
+
+
+def _readOnly(symbols: dict, name: str) -> bool:
+    """ True if calling the value of name can't change symbols or other assembler state """
+    if name in symbols:
+        value = symbols[name]
+        if not callable(value):
+            return True
+        try:
+            return value in pureFunctions or value in readOnlyFunctions
+        except TypeError:
+            return False # unhashable
+    if name in builtins.__dict__:
+        return name in _readOnlyBuiltins
+    return name not in _mutatingMethods # an attribute, or a name assigned by the expression
+
+
+def _evaluate(e: str, context: Context):
+    compiled = _compile(e)
+    symbols = context.symbols
+    context.evaluations += 1
+
+    # track what the expression reads and may change, for incremental passes
+    context.reads.update(compiled.dependencies)
+    if compiled.assigns:
+        context.writes.update(compiled.assigns)
+    if not context.opaque:
+        for name in compiled.calls:
+            if not _readOnly(symbols, name):
+                context.opaque = True
+                break
+
+    if not compiled.memoize:
+        return compiled.evaluate(symbols)
+
+    try:
+        values = tuple([symbols[name] for name in compiled.dependencies])
+    except KeyError:
+        return compiled.evaluate(symbols) # builtin or undefined name
+
+    memo = _memo.get(e)
+    if memo is not None and context.changedSymbols.isdisjoint(compiled.dependencies):
+        try:
+            if memo[0] == values and memo[1] == tuple(map(type, values)):
+                context.skippedEvaluations += 1
+                return memo[2]
+        except Exception:
+            pass # values without a plain comparison
+
+    value = compiled.evaluate(symbols)
+
+    if all(symbols[name] in pureFunctions for name in compiled.calls):
+        if len(_memo) >= _memoLimit:
+            _memo.clear()
+        _memo[e] = (values, tuple(map(type, values)), value)
+    return value
+
+
+def compileStats() -> tuple:
+    """ hits and misses of the compiled expression cache """
+    info = _compile.cache_info()
+    return info.hits, info.misses
+
+
 def expression(e: str, context: Context):
     value = None
     try:
-        value = builtins.eval(e, context.symbols)
+        value = _evaluate(e, context)
     except Exception as exception:
         context.reportError(f'{str(exception).capitalize()}: "{e}"')
     return value
 
 
-def intExpression(e: str, context: Context) -> int:
-    value = expression(e, context)
+def intExpression(e, context: Context) -> int:
+    """ evaluates e as an int, an int value is passed straight through """
+    if type(e) is int:
+        return e
+    elif type(e) is float:
+        value = e # the same value as evaluating str(e)
+    else:
+        value = expression(e if type(e) is str else str(e), context)
     if type(value) is float:
         intValue = int(value)
         if value != float(intValue):
@@ -34,122 +269,48 @@ def intExpression(e: str, context: Context) -> int:
     return value
     
     
-def byteExpression(e: str, context: Context) -> int:    
+def byteExpression(e, context: Context) -> int:    
     value = intExpression(e, context)
     if value < -128 or value > 255:
         context.reportError(f'Byte value out of range: {value}')
     return value & 0xff
 
 
-def wordExpression(e: str, context: Context) -> int:
+def wordExpression(e, context: Context) -> int:
     value = intExpression(e, context)
     if value < -32768 or value > 65535:
         context.reportError(f'Word value out of range: {value}')
     return value & 0xffff
 
 
+def fillValues(f, n: int, size: int, context: Context) -> list:
+    """ byte (size 1) or word (size 2) values of f(0)..f(n-1), range checked and truncated in bulk """
+    failures = {}
+    values = []
+    for x in range(n):
+        try:
+            values.append(f(x))
+        except Exception as exception:
+            failures[x] = f'{str(exception).capitalize()}'
+            values.append(0)
+
+    low, high, mask = (-128, 255, 0xff) if size == 1 else (-32768, 65535, 0xffff)
+    if len(failures) == 0 and (n == 0 or (set(map(type, values)) == {int} and min(values) >= low and max(values) <= high)):
+        return [v & mask for v in values]
+
+    # report the same errors and warnings, in the same order, as one value at a time
+    check = byteExpression if size == 1 else wordExpression
+    checked = []
+    for x, value in enumerate(values):
+        if x in failures:
+            context.reportError(failures[x])
+        checked.append(check(value, context))
+    return checked
+
+
 def lambdaExpression(e: str, context: Context):
     value = expression(f'lambda {e}', context)
     if not isinstance(value, types.FunctionType):
         context.reportError(f'Expected a function instead of: "{e}"')
         value = lambda x: x
     return value
-
-
-################################################################################
-
-class TestEval(unittest.TestCase):
-
-    def testEvalExpression(self):
-        context = Context({})
-        value = expression('123', context)
-        self.assertEqual(value, 123)
-        self.assertEqual(len(context.warnings), 0)
-        self.assertEqual(len(context.errors), 0)
-
-        context = Context({'abc': 234})
-        value = expression('abc', context)
-        self.assertEqual(value, 234)
-        self.assertEqual(len(context.warnings), 0)
-        self.assertEqual(len(context.errors), 0)
-
-        context = Context({})
-        value = expression('abc', context)
-        self.assertEqual(value, None)
-        self.assertEqual(len(context.warnings), 0)
-        self.assertEqual(len(context.errors), 1)
-
-
-    def testEvalIntExpression(self):
-        context = Context({})
-        value = intExpression('12', context)
-        self.assertEqual(value, 12)
-        self.assertEqual(len(context.warnings), 0)
-        self.assertEqual(len(context.errors), 0)
-
-        context = Context({})
-        value = intExpression('1.2', context)
-        self.assertEqual(value, 1)
-        self.assertEqual(len(context.warnings), 1)
-        self.assertEqual(len(context.errors), 0)
-
-
-    def testEvalByteExpression(self):
-        context = Context({})
-        value = byteExpression('-10', context)
-        self.assertEqual(value, 0xf6)
-        self.assertEqual(len(context.warnings), 0)
-        self.assertEqual(len(context.errors), 0)
-
-        context = Context({})
-        value = byteExpression('0x10', context)
-        self.assertEqual(value, 0x10)
-        self.assertEqual(len(context.warnings), 0)
-        self.assertEqual(len(context.errors), 0)
-
-        context = Context({})
-        value = byteExpression('0xfff', context)
-        self.assertEqual(value, 0xff)
-        self.assertEqual(len(context.warnings), 0)
-        self.assertEqual(len(context.errors), 1)
-        
-
-    def testEvalWordExpression(self):
-        context = Context({})
-        value = wordExpression('-10', context)
-        self.assertEqual(value, 0xfff6)
-        self.assertEqual(len(context.warnings), 0)
-        self.assertEqual(len(context.errors), 0)
-
-        context = Context({})
-        value = wordExpression('0x1000', context)
-        self.assertEqual(value, 0x1000)
-        self.assertEqual(len(context.warnings), 0)
-        self.assertEqual(len(context.errors), 0)
-
-        context = Context({})
-        value = wordExpression('0xfffff', context)
-        self.assertEqual(value, 0xffff)
-        self.assertEqual(len(context.warnings), 0)
-        self.assertEqual(len(context.errors), 1)
-
-
-    def testEvalLambdaExpression(self):
-        context = Context({'k': 1})
-        value = lambdaExpression('x: x + k + round(cos(0))', context)
-        self.assertEqual(isinstance(value, types.FunctionType), True)
-        self.assertEqual(value(1), 3)
-        self.assertEqual(len(context.warnings), 0)
-        self.assertEqual(len(context.errors), 0)
-
-
-    def testDivZeroExpression(self):
-        context = Context({})
-        value = expression('0/0', context)
-        self.assertEqual(value, None)
-        self.assertEqual(len(context.warnings), 0)
-        self.assertEqual(len(context.errors), 1)
-        
-
-if __name__ == '__main__':
-    unittest.main()
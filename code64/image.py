@@ -1,6 +1,5 @@
 #! /usr/bin/env python3
 
-import unittest
 import struct
 
 
@@ -84,13 +83,3 @@ def load(fileName: str, context):
         context.reportError(f'File not found "{fileName}"')
 
     return image
-    
-################################################################################
-
-#class TestImage(unittest.TestCase):
-
-#    def testSomething():
-#        pass
-        
-if __name__ == '__main__':
-    unittest.main()
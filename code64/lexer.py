@@ -1,8 +1,28 @@
 #! /usr/bin/env python3
 
+import hashlib
+import os
+import pickle
 import re
-import shlex
-import unittest
+import sys
+from array import array
+
+
+LEXER_VERSION = 3 # bump when the token rules change, invalidates the chunk cache
+
+def _userCacheDirectory() -> str:
+    if sys.platform == 'win32':
+        base = os.environ.get('LOCALAPPDATA') or os.path.expanduser('~')
+    elif sys.platform == 'darwin':
+        base = os.path.expanduser('~/Library/Caches')
+    else:
+        base = os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache')
+    return os.path.join(base, 'code64')
+
+
+cacheDirectory = _userCacheDirectory() # on-disk chunk cache, None disables it
+cacheLimit = 64 * 1024 * 1024 # bytes, the least recently used entries are removed above it
+cacheStats = {'hits': 0, 'misses': 0}
 
 
 class Token:
@@ -45,18 +65,44 @@ def _translateLocalLabels(tokens):
     return newTokens
 
 
+_lineBreaks = '\n\r\v\f\x1c\x1d\x1e\x85\u2028\u2029' # the same line boundaries as str.splitlines()
+_wordChars = r'a-zA-Z0-9_~\-/*?$%'
+
+# a single master pattern, matching shlex(punctuation_chars="|&<>.=") with ';' comments and '$%' as word characters
+_tokenPattern = re.compile(rf'''
+      (?P<newline>\r\n|[{_lineBreaks}])
+    | [ \t]+
+    | ;[^{_lineBreaks}]*
+    | (?P<word>[{_wordChars}][{_wordChars}'"]*)
+    | (?P<string>"[^"{_lineBreaks}]*"|'[^'{_lineBreaks}]*')
+    | (?P<punctuation>[|&<>.=]+)
+    | (?P<unclosed>["'])
+    | (?P<other>.)
+    ''', re.VERBOSE)
+
+
 def tokenize(text: str, fileName=''):
+    """ splits text into tokens in a single pass, with a newline token after each line """
     tokens = []
 
     if type(text) is str:
-        for line in text.splitlines():
-            lex = shlex.shlex(line, punctuation_chars="|&<>.=")
-            lex.commenters = ';'
-            lex.wordchars += '$%'
+        lineNumber = 1
+        for match in _tokenPattern.finditer(text):
+            group = match.lastgroup
+            if group is None: # whitespace or comment
+                continue
+            elif group == 'newline':
+                tokens.append(Token('\n', fileName, lineNumber))
+                lineNumber += 1
+            elif group == 'word' or group == 'string':
+                tokens.append(Token(_fixPrefix(match.group()), fileName, lineNumber))
+            elif group == 'unclosed':
+                raise ValueError('No closing quotation')
+            else:
+                tokens.append(Token(match.group(), fileName, lineNumber))
 
-            for token in lex:    
-                tokens.append(Token(_fixPrefix(token), fileName, lex.lineno))
-            tokens.append(Token('\n'))
+        if len(text) > 0 and text[-1] not in _lineBreaks: # last line without a line break
+            tokens.append(Token('\n', fileName, lineNumber))
 
     return tokens
 
@@ -79,41 +125,223 @@ def tokenizeFile(fileName):
     return tokens
 
 
-def chunkSplit(tokens):
-    """ a generator that splits a list of tokens by newlines """
-    indices = [i for i, token in enumerate(tokens) if token.string=='\n']
-    for start, end in zip([-1, *indices], [*indices, len(tokens)]):
-        yield tokens[start+1:end]
+def _compactChunks(tokens):
+    """ compact form of a token list: token strings, chunk offsets and chunk line numbers """
+    strings = []
+    offsets = array('I', [0])
+    lineNumbers = array('I')
+    lineNumber = 1
+    for chunk in chunkSplit(tokens):
+        if len(chunk) > 0 and chunk[0].lineNumber > 0:
+            lineNumber = chunk[0].lineNumber
+        strings.extend(token.string for token in chunk)
+        offsets.append(len(strings))
+        lineNumbers.append(lineNumber)
+        lineNumber += 1
+    return strings, offsets, lineNumbers
 
 
-################################################################################
+def compactText(text: str, fileName=''):
+    """ compact chunks of a text, like compactFile without local labels """
+    return _compactChunks(tokenize(text, fileName))
 
-class TestLexer(unittest.TestCase):
 
+def _cacheFileName(fileName):
+    key = hashlib.sha1(os.path.abspath(fileName).encode()).hexdigest()
+    return os.path.join(cacheDirectory, f'{key}.pickle')
 
-    def testFixPrefix(self):
-        self.assertEqual(_fixPrefix(''), '')
-        self.assertEqual(_fixPrefix('abc'), 'abc')
-        self.assertEqual(_fixPrefix('$1234'), '0x1234')
-        self.assertEqual(_fixPrefix('%010101'), '0b010101')
 
+def pruneCache(limit: int=None):
+    """ remove the least recently used entries of the chunk cache until it is at most limit bytes """
+    limit = cacheLimit if limit is None else limit
+    entries = []
+    try:
+        with os.scandir(cacheDirectory) as scan:
+            for entry in scan:
+                if entry.name.endswith('.pickle'):
+                    status = entry.stat()
+                    entries.append((status.st_mtime, status.st_size, entry.path))
+    except OSError:
+        return
+    size = sum(entry[1] for entry in entries)
+    for _, entrySize, path in sorted(entries):
+        if size <= limit:
+            break
+        try:
+            os.remove(path)
+            size -= entrySize
+        except OSError:
+            pass
 
-    def testChunkSplit(self):
-        tokens = [Token('a'), Token('\n'), Token('b'), Token('c'), Token('\n'), Token('\n'), Token('d')]
-        for index, chunk in enumerate(chunkSplit(tokens)):
-            if index==0:
-                self.assertEqual(len(chunk), 1)
-                self.assertEqual(chunk[0].string, 'a')
-            if index==1:
-                self.assertEqual(len(chunk), 2)
-                self.assertEqual(chunk[0].string, 'b')
-                self.assertEqual(chunk[1].string, 'c')
-            if index==2:
-                self.assertEqual(len(chunk), 0)
-            if index==3:
-                self.assertEqual(len(chunk), 1)
-                self.assertEqual(chunk[0].string, 'd')
 
-        
-if __name__ == '__main__':
-    unittest.main()
+def compactFile(fileName):
+    """ compact chunks of a source file, loaded from the on-disk cache when the content is unchanged """
+    if cacheDirectory is None:
+        return _compactChunks(tokenizeFile(fileName))
+
+    try:
+        with open(fileName, 'rb') as f:
+            contentHash = hashlib.sha256(f.read()).hexdigest()
+    except OSError:
+        return _compactChunks(tokenizeFile(fileName))
+
+    cacheFileName = _cacheFileName(fileName)
+    try:
+        with open(cacheFileName, 'rb') as f:
+            version, cachedHash, compact = pickle.load(f)
+        if version == LEXER_VERSION and cachedHash == contentHash:
+            cacheStats['hits'] += 1
+            try:
+                os.utime(cacheFileName) # recently used, see pruneCache
+            except OSError:
+                pass
+            return compact
+    except (OSError, pickle.UnpicklingError, EOFError, ValueError, TypeError, AttributeError):
+        pass
+
+    cacheStats['misses'] += 1
+    compact = _compactChunks(tokenizeFile(fileName))
+
+    try:
+        os.makedirs(cacheDirectory, exist_ok=True)
+        temporaryFileName = f'{cacheFileName}.{os.getpid()}'
+        with open(temporaryFileName, 'wb') as f:
+            pickle.dump((LEXER_VERSION, contentHash, compact), f, pickle.HIGHEST_PROTOCOL)
+        os.replace(temporaryFileName, cacheFileName)
+        pruneCache()
+    except OSError:
+        pass # the cache is only an optimization
+
+    return compact
+
+
+class Chunk:
+    """ view of the token strings of one chunk in a TokenStore """
+    __slots__ = ('strings', 'start', 'end', 'lineNumber', 'fileName')
+
+    def __init__(self, strings: list, start: int, end: int, lineNumber: int=0, fileName: str=''):
+        self.strings = strings
+        self.start = start
+        self.end = end
+        self.lineNumber = lineNumber
+        self.fileName = fileName
+
+    def __len__(self):
+        return self.end - self.start
+
+    def __getitem__(self, index):
+        if type(index) is slice:
+            start, end, _ = index.indices(self.end - self.start)
+            return Chunk(self.strings, self.start + start, self.start + max(start, end), self.lineNumber, self.fileName)
+        if index < 0:
+            index += self.end - self.start
+        if index < 0 or index >= self.end - self.start:
+            raise IndexError('chunk index out of range')
+        return self.strings[self.start + index]
+
+    def __iter__(self):
+        return iter(self.strings[self.start:self.end])
+
+    def join(self, start: int=0) -> str:
+        """ the token strings from start to the end of the chunk, joined """
+        return ''.join(self.strings[self.start+start:self.end])
+
+    def __repr__(self):
+        return f'{self.join(0)!r} ({self.fileName}:{self.lineNumber})'
+
+
+class ChunkList:
+    """ view of the chunks of one file in a TokenStore """
+    __slots__ = ('store', 'first', 'count')
+
+    def __init__(self, store, first: int, count: int):
+        self.store = store
+        self.first = first
+        self.count = count
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index: int) -> Chunk:
+        if index < 0 or index >= self.count:
+            raise IndexError('chunk index out of range')
+        store = self.store
+        i = self.first + index
+        return Chunk(store.strings, store.offsets[i], store.offsets[i+1], store.lineNumbers[i], store.fileNames[store.fileIds[i]])
+
+
+class TokenStore:
+    """ all chunks of a run in flat storage: interned strings, chunk offset ranges, line numbers and file ids """
+
+    def __init__(self):
+        self.strings = []               # interned token strings of all chunks
+        self.offsets = array('I', [0])  # chunk i is strings[offsets[i]:offsets[i+1]]
+        self.lineNumbers = array('I')   # line number of each chunk
+        self.fileIds = array('I')       # file id of each chunk
+        self.fileNames = []             # file name of each file id
+        self.files = {}                 # name -> (first chunk, chunk count)
+        self.garbage = 0                # number of strings of replaced and removed files
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.files
+
+    def __getitem__(self, name: str) -> ChunkList:
+        first, count = self.files[name]
+        return ChunkList(self, first, count)
+
+    def add(self, name: str, strings: list, offsets: array, lineNumbers: array) -> bool:
+        """ add the chunks of a file in compact form, replacing earlier chunks with the same name; False if unchanged """
+        if name in self.files and self._equal(name, strings, offsets):
+            return False
+        self.remove(name)
+
+        fileId = len(self.fileNames)
+        self.fileNames.append(name)
+
+        first = len(self.lineNumbers)
+        base = len(self.strings)
+        self.strings.extend(map(sys.intern, strings))
+        self.offsets.extend(base + offset for offset in offsets[1:])
+        self.lineNumbers.extend(lineNumbers)
+        self.fileIds.extend([fileId] * len(lineNumbers))
+        self.files[name] = (first, len(lineNumbers))
+        return True
+
+    def addTokens(self, name: str, tokens: list) -> bool:
+        """ add a list of tokens, split into chunks by newlines """
+        return self.add(name, *_compactChunks(tokens))
+
+    def addFile(self, fileName: str):
+        """ add the chunks of a source file """
+        self.add(fileName, *compactFile(fileName))
+
+    def remove(self, name: str):
+        """ forget the chunks of a file, their storage is reused by compact """
+        if name in self.files:
+            first, count = self.files.pop(name)
+            self.garbage += self.offsets[first+count] - self.offsets[first]
+
+    def compact(self):
+        """ rebuild the storage with only the chunks of current files """
+        strings, offsets, lineNumbers, files = self.strings, self.offsets, self.lineNumbers, self.files
+        self.__init__()
+        for name, (first, count) in files.items():
+            base = offsets[first]
+            self.add(name, strings[base:offsets[first+count]],
+                array('I', (offsets[first+i] - base for i in range(count+1))), lineNumbers[first:first+count])
+
+    def _equal(self, name: str, strings: list, offsets: array) -> bool:
+        first, count = self.files[name]
+        base = self.offsets[first]
+        if count != len(offsets)-1 or self.offsets[first+count] - base != len(strings):
+            return False
+        if any(self.offsets[first+i] - base != offsets[i] for i in range(count)):
+            return False
+        return self.strings[base:base+len(strings)] == strings
+
+
+def chunkSplit(tokens):
+    """ a generator that splits a list of tokens by newlines """
+    indices = [i for i, token in enumerate(tokens) if token.string=='\n']
+    for start, end in zip([-1, *indices], [*indices, len(tokens)]):
+        yield tokens[start+1:end]
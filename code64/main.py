@@ -3,45 +3,155 @@
 import getopt
 import sys
 
-#--
-import pathlib, sys
-sys.path.append(str(pathlib.Path(__file__).parent.absolute()))
-#--
-
 import assemble
+import batch
+import output
 
 
 __version__ = '0.1'
 
 
 def printUsage():
-    print('Usage: Code64.py -a <asmFile> -d <disFile> -o <outFile>')
+    print('Usage: Code64.py -a <asmFile> -d <disFile> -o <outFile> [-v]')
+    print('       Code64.py -a <asmFile> -o <outFile> -a <asmFile> -o <outFile> ... [-j <workers>] [-v]')
+    print('       Code64.py -m <manifestFile> [-j <workers>] [-v]')
+    print('       Code64.py -a <asmFile> -o <outFile> --variant <name>:<NAME>=<value>,... ... [-j <workers>] [-v]')
+    print('       -D <NAME>=<value> defines a symbol, for all files and variants')
+    print('       --watch assembles again when a used file changes')
+    print('       --lazy-imports only imports the modules in imports/ that define names used by the source')
+    print('       --daemon [--port <port>] keeps the assembler loaded, --client assembles in it, --stop stops it')
+    print('       --output <mode> saves one prg (default), a prg for each segment (segments), one prg with all segments')
+    print('         and a loader (linked), the bytes of each segment (raw), or one packed prg that unpacks itself (crunched);')
+    print('         --gap <bytes> merges segments closer than that')
+    print('       --profile prints where the time goes, --profile-out <file> also saves it as .json or a cProfile dump')
+
+
+def pairFiles(opts: list) -> tuple:
+    """ the -a files and their -o files, None for none, an -o belongs to the -a before it, or to the only -a """
+    asmFiles = [arg for opt, arg in opts if opt == '-a']
+    outFiles = [arg for opt, arg in opts if opt == '-o']
+    if len(asmFiles) <= 1:
+        if len(outFiles) > 1:
+            raise ValueError(f'{len(outFiles)} output files for one assembler file')
+        return asmFiles, (outFiles + [None])[:len(asmFiles)]
+
+    outFiles = []
+    for opt, arg in opts:
+        if opt == '-a':
+            outFiles.append(None)
+        elif opt == '-o':
+            if len(outFiles) == 0 or outFiles[-1] is not None:
+                raise ValueError(f'-o {arg} does not follow an -a')
+            outFiles[-1] = arg
+    return asmFiles, outFiles
 
 
 def main():
     argv = sys.argv[1:]
     
-    asmFile = None
-    outFile = None
+    asmFiles = []
+    outFiles = []
+    manifestFile = None
+    workers = None
+    verbose = False
+    anyErrors = False
+    defines = {}
+    variants = []
+    mode = None
+    port = None
+    profileFile = None
+    profile = False
 
     print(f'Code64 v{__version__}  (c) Morten Perriard 2021')
     
     try:
-        opts, args = getopt.getopt(argv, 'ha:d:o:')
-    except getopt.GetoptError:
+        opts, args = getopt.getopt(argv, 'ha:d:o:vm:j:D:', ['variant=', 'watch', 'daemon', 'client', 'stop', 'port=', 'lazy-imports', 'output=', 'gap=', 'profile', 'profile-out='])
+        for opt, arg in opts:
+            if opt == '-D':
+                name, value = assemble.parseDefine(arg)
+                defines[name] = value
+            elif opt == '--variant':
+                variants.append(batch.parseVariant(arg))
+            elif opt == '--output' and not arg in output.modes:
+                raise ValueError(f'Invalid output mode: {arg}')
+            elif opt == '--gap':
+                assemble.multiPass.gap = int(arg)
+            elif opt == '-j':
+                workers = int(arg)
+            elif opt == '--port':
+                port = int(arg)
+        asmFiles, outFiles = pairFiles(opts)
+    except (getopt.GetoptError, ValueError):
         printUsage()
         sys.exit(2)
     for opt, arg in opts:
         if opt == '-h':
             printUsage()
             sys.exit()
-        elif opt == '-a':
-            asmFile = arg
-        elif opt == '-o':
-            outFile = arg
-    
-    if asmFile is not None:
-        anyErrors = assemble.multiPass(asmFile, outFile)
+        elif opt == '-v':
+            verbose = True
+        elif opt == '-m':
+            manifestFile = arg
+        elif opt in ['--watch', '--daemon', '--client', '--stop']:
+            mode = opt[2:]
+        elif opt == '--lazy-imports':
+            assemble.multiPass.lazyImports = True
+        elif opt == '--output':
+            assemble.multiPass.outputMode = arg
+        elif opt == '--profile':
+            profile = True
+        elif opt == '--profile-out':
+            profile = True
+            profileFile = arg
+
+    if profile:
+        import profiler # only needed for profiling
+        assemble.multiPass.profiler = profiler.Profiler(profileFile)
+
+    if mode is not None:
+        import daemon # only needed for these modes
+        if port is None:
+            port = daemon.defaultPort
+
+    if mode == 'daemon':
+        daemon.serve(port)
+        sys.exit(0)
+    elif mode == 'stop':
+        if not daemon.stop(port):
+            print(f'No daemon running on port {port}')
+        sys.exit(0)
+
+    targets = [batch.Target(asmFile, outFile, defines) for asmFile, outFile in zip(asmFiles, outFiles)]
+    if manifestFile is not None:
+        try:
+            targets += [batch.Target(t.inFile, t.outFile, defines) for t in batch.readManifest(manifestFile)]
+        except (OSError, ValueError) as exception:
+            print(f'Invalid manifest: {exception}')
+            printUsage()
+            sys.exit(2)
+
+    if len(variants) > 0 and len(targets) != 1:
+        printUsage()
+        sys.exit(2)
+
+    if mode in ['watch', 'client'] and len(variants) > 0:
+        targets = batch.variantTargets(targets[0].inFile, targets[0].outFile, variants, defines)
+
+    if mode == 'watch':
+        daemon.watch(targets, verbose)
+        sys.exit(0)
+    elif mode == 'client':
+        anyErrors = daemon.assembleRemote(targets, verbose, port)
+        if anyErrors is not None:
+            sys.exit(1 if anyErrors else 0)
+        print(f'No daemon running on port {port}, assembling locally')
+
+    if len(variants) > 0:
+        anyErrors = batch.assembleVariants(targets[0].inFile, targets[0].outFile, variants, defines, workers, verbose)
+    elif len(targets) == 1 and manifestFile is None:
+        anyErrors = assemble.multiPass(targets[0].inFile, targets[0].outFile, verbose, defines)
+    elif len(targets) > 0:
+        anyErrors = batch.assembleTargets(targets, workers, verbose)
     
     if anyErrors:
         sys.exit(1)
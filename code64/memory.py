@@ -0,0 +1,180 @@
+#! /usr/bin/env python3
+
+
+class MemoryImage:
+    """ 64K memory image with a map of written bytes """
+
+    def __init__(self):
+        self.data = bytearray(0x10000)
+        self.written = bytearray(0x10000) # 1 for each written address
+        self.count = 0 # number of written addresses
+        self.first = 0x10000 # lowest written address
+        self.last = -1 # highest written address
+        self.changedFirst = 0x10000 # range written since the last takeChanges
+        self.changedLast = -1
+
+
+    def __len__(self) -> int:
+        return self.count
+
+
+    def __contains__(self, address: int) -> bool:
+        return self.written[address] != 0
+
+
+    def __getitem__(self, address: int) -> int:
+        return self.data[address]
+
+
+    def __setitem__(self, address: int, value: int):
+        if address < self.changedFirst: self.changedFirst = address
+        if address > self.changedLast: self.changedLast = address
+        if not self.written[address]:
+            self.written[address] = 1
+            self.count += 1
+            if address < self.first: self.first = address
+            if address > self.last: self.last = address
+        self.data[address] = value
+
+
+    def __eq__(self, other) -> bool:
+        if type(other) is not MemoryImage:
+            return NotImplemented
+        return self.count == other.count and self.written == other.written and self.data == other.data
+
+
+    def write(self, address: int, buffer):
+        """ write a block of bytes from address """
+        end = address + len(buffer)
+        if end <= address:
+            return
+        if address < self.changedFirst: self.changedFirst = address
+        if end - 1 > self.changedLast: self.changedLast = end - 1
+        self.count += len(buffer) - self.written.count(1, address, end)
+        self.written[address:end] = b'\x01' * len(buffer)
+        self.data[address:end] = buffer
+        if address < self.first: self.first = address
+        if end - 1 > self.last: self.last = end - 1
+
+
+    def takeChanges(self) -> tuple:
+        """ the range written since the last call as (address, data, written map), None if nothing was written """
+        first, last = self.changedFirst, self.changedLast
+        self.changedFirst, self.changedLast = 0x10000, -1
+        if last < first:
+            return None
+        return first, bytes(self.data[first:last+1]), bytes(self.written[first:last+1])
+
+
+    def applyChanges(self, changes: tuple):
+        """ replay a range returned by takeChanges """
+        if changes is None:
+            return
+        address, data, written = changes
+        end = address + len(data)
+        self.count += written.count(1) - self.written.count(1, address, end)
+        self.data[address:end] = data
+        self.written[address:end] = written
+        if written.find(1) >= 0:
+            self.first = min(self.first, address + written.find(1))
+            self.last = max(self.last, address + written.rfind(1))
+
+
+    def bytes(self) -> bytes:
+        """ memory from the first to the last written address, unwritten gaps are zero """
+        return bytes(self.data[self.first:self.last+1]) if self.count > 0 else b''
+
+
+    def ranges(self, gap: int=0) -> list:
+        """ (first, last) of the runs of written addresses, runs less than gap bytes apart are merged """
+        ranges = []
+        written = self.written
+        start = written.find(1)
+        while start >= 0:
+            end = written.find(0, start)
+            if end < 0:
+                end = 0x10000
+            if len(ranges) > 0 and start - ranges[-1][1] - 1 < gap:
+                ranges[-1] = (ranges[-1][0], end - 1)
+            else:
+                ranges.append((start, end - 1))
+            start = written.find(1, end)
+        return ranges
+
+
+    def pageUse(self) -> list:
+        """ number of written bytes for each of the 256 pages """
+        written = self.written
+        return [written.count(1, page<<8, (page+1)<<8) for page in range(256)]
+
+
+class Interval:
+    """ addresses start..end-1, written in one run from the line at origin, (file name, line index) """
+    __slots__ = ('start', 'end', 'origin', 'label')
+
+    def __init__(self, start: int, end: int, origin: tuple, label: str=None):
+        self.start = start
+        self.end = end
+        self.origin = origin
+        self.label = label # the last label before the first byte, since the last .org
+
+    def __len__(self) -> int:
+        return self.end - self.start
+
+    def __repr__(self):
+        fileName, lineIndex = self.origin if self.origin is not None else ('?', -1)
+        label = f' {self.label}' if self.label is not None else ''
+        return f'${self.start:04x}-${self.end-1:04x}{label} at {fileName}:{lineIndex+1}'
+
+
+class IntervalIndex:
+    """ written address intervals in the order they were written, a write that continues the last interval extends it """
+
+    def __init__(self):
+        self.intervals = []
+        self.current = None # the last interval, the only one that still grows
+
+    def __len__(self) -> int:
+        return len(self.intervals)
+
+    def __iter__(self):
+        return iter(self.intervals)
+
+    def add(self, start: int, length: int, origin: tuple, label: str=None):
+        """ record a write of length bytes from start """
+        if length <= 0:
+            return
+        current = self.current
+        if current is not None and current.end == start:
+            current.end += length
+        else:
+            self.current = Interval(start, start + length, origin, label)
+            self.intervals.append(self.current)
+
+    def mark(self) -> tuple:
+        """ the state to go back to with restore """
+        return len(self.intervals), self.current.end if self.current is not None else None
+
+    def restore(self, other, mark: tuple):
+        """ set this index to other as it was at mark """
+        count, end = mark
+        self.intervals = other.intervals[:count]
+        self.current = None
+        if count > 0: # the last interval may have grown since
+            last = self.intervals[-1]
+            self.current = Interval(last.start, end, last.origin, last.label)
+            self.intervals[-1] = self.current
+
+    def overlaps(self) -> list:
+        """ (earlier, later, first, last) for each pair of intervals that wrote the addresses first..last """
+        overlaps = []
+        active = [] # indices of the intervals that may reach the next start
+        for index in sorted(range(len(self.intervals)), key=lambda i: (self.intervals[i].start, i)):
+            interval = self.intervals[index]
+            active = [i for i in active if self.intervals[i].end > interval.start]
+            for i in active:
+                other = self.intervals[i]
+                earlier, later = (other, interval) if i < index else (interval, other)
+                overlaps.append((earlier, later, interval.start, min(interval.end, other.end) - 1))
+            active.append(index)
+        return overlaps
@@ -1,6 +1,5 @@
 #! /usr/bin/env python3
 
-import unittest
 import struct
 
 
@@ -42,14 +41,3 @@ def load(fileName: str, context):
         context.reportError(f'File not found "{fileName}"')
 
     return music
-
-
-################################################################################
-
-#class TestMusic(unittest.TestCase):
-
-#    def testSomething():
-#        pass
-        
-if __name__ == '__main__':
-    unittest.main()
@@ -0,0 +1,235 @@
+#! /usr/bin/env python3
+
+import contextlib
+import io
+import os
+
+import cruncher
+from cpu import AddressMode, encode
+from memory import MemoryImage
+
+
+modes = ['prg', 'segments', 'linked', 'raw', 'crunched']
+defaultGap = 256 # segments less than this many bytes apart are saved as one, with zeros in between
+
+basicStartAddress = 0x0801
+moverAddress = 0x0334 # the linked loader copies the segments with code in the cassette buffer
+moverEnd = 0x0400
+loadEnd = 0xd000 # a linked image is loaded to RAM below the I/O area
+vectorStart = 0xfffa # the CPU vectors at the end of memory, a crunched image stays below them
+decruncherFile = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'stubs', 'decrunch.asm')
+
+# zero page used by the mover, from _source in the order of a segment table entry
+_index, _source, _destination, _lengthLo, _lengthHi, _backward = 0xf7, 0xf8, 0xfa, 0xfc, 0xfd, 0xfe
+
+
+def segmentFileName(fileName: str, start: int) -> str:
+    """ file name with the start address of a segment added before the extension """
+    base, extension = os.path.splitext(fileName)
+    return f'{base}-{start:04x}{extension}'
+
+
+def segments(memory: MemoryImage, gap: int=defaultGap) -> list:
+    """ (start, data) of the written ranges of memory, see MemoryImage.ranges """
+    return [(first, bytes(memory.data[first:last+1])) for first, last in memory.ranges(gap)]
+
+
+def basicEntry(memory: MemoryImage) -> int:
+    """ the address of a 'SYS address' BASIC line at the start of BASIC, None if there is none """
+    address = basicStartAddress + 4 # after the next line pointer and line number
+    if not address in memory or memory[address] != 0x9e: # SYS token
+        return None
+    digits = bytes(memory.data[address+1:address+8]).split(b'\0')[0].strip()
+    return int(digits) if digits.isdigit() else None
+
+
+def _word(value: int) -> bytes:
+    return bytes([value & 0xff, (value >> 8) & 0xff])
+
+
+def _encode(origin: int, lines: list) -> bytes:
+    """ machine code of a list of labels, (mnemonic, mode, operand) and bytes, an operand is an address,
+        a label or (label, offset) """
+    labels = {}
+    for final in [False, True]:
+        code = bytearray()
+        for line in lines:
+            address = origin + len(code)
+            if type(line) is str:
+                labels[line] = address
+            elif type(line) is bytes:
+                code += line
+            else:
+                mnemonic, mode, operand = line
+                if type(operand) is tuple:
+                    operand = labels.get(operand[0], address) + operand[1]
+                elif type(operand) is str:
+                    operand = labels.get(operand, address)
+                if mode == AddressMode.relative:
+                    operand -= address + 2
+                    if final and not -128 <= operand <= 127:
+                        raise ValueError(f'Loader branch out of range: {mnemonic} {line[2]}')
+                code += encode(mnemonic, mode, operand)
+    return bytes(code)
+
+
+def _mover(entry: int, table: bytes, roms: bool=True) -> list:
+    """ copies the segments in table and starts the program at entry, with the ROMs banked in again if roms """
+    A, ZP, ABSX, ABSY, IMM, IMP, INDY, REL = AddressMode.absolute, AddressMode.zeroPage, AddressMode.absoluteX, \
+        AddressMode.absoluteY, AddressMode.immediate, AddressMode.implied, AddressMode.indirectY, AddressMode.relative
+    return [
+        ('sei', IMP, 0), ('lda', IMM, 0x34), ('sta', ZP, 0x01), # RAM everywhere, also at $d000-$dfff
+        ('lda', IMM, 0), ('sta', ZP, _index),
+      'next',
+        ('ldx', ZP, _index), ('lda', ABSX, ('table', 6)), ('bmi', REL, 'finish'),
+        ('ldy', IMM, 0),
+      'entry',
+        ('lda', ABSX, 'table'), ('sta', ABSY, _source), ('inx', IMP, 0), ('iny', IMP, 0), ('cpy', IMM, 7), ('bne', REL, 'entry'),
+        ('stx', ZP, _index), ('lda', ZP, _backward), ('bne', REL, 'backward'),
+
+        # forward, whole pages then the rest, for a destination below the source
+        ('ldy', IMM, 0), ('ldx', ZP, _lengthHi), ('beq', REL, 'forwardRest'),
+      'forwardPage',
+        ('lda', INDY, _source), ('sta', INDY, _destination), ('iny', IMP, 0), ('bne', REL, 'forwardPage'),
+        ('inc', ZP, _source+1), ('inc', ZP, _destination+1), ('dex', IMP, 0), ('bne', REL, 'forwardPage'),
+      'forwardRest',
+        ('ldx', ZP, _lengthLo), ('beq', REL, 'next'),
+      'forwardByte',
+        ('lda', INDY, _source), ('sta', INDY, _destination), ('iny', IMP, 0), ('dex', IMP, 0), ('bne', REL, 'forwardByte'),
+        ('jmp', A, 'next'),
+
+        # backward, the rest then whole pages, the pointers start after the whole pages
+      'backward',
+        ('ldy', ZP, _lengthLo), ('beq', REL, 'backwardPages'),
+      'backwardByte',
+        ('dey', IMP, 0), ('lda', INDY, _source), ('sta', INDY, _destination), ('tya', IMP, 0), ('bne', REL, 'backwardByte'),
+      'backwardPages',
+        ('ldx', ZP, _lengthHi), ('beq', REL, 'next'),
+      'backwardPage',
+        ('dec', ZP, _source+1), ('dec', ZP, _destination+1), ('ldy', IMM, 0),
+      'backwardPageByte',
+        ('dey', IMP, 0), ('lda', INDY, _source), ('sta', INDY, _destination), ('tya', IMP, 0), ('bne', REL, 'backwardPageByte'),
+        ('dex', IMP, 0), ('bne', REL, 'backwardPage'),
+        ('jmp', A, 'next'),
+
+      'finish',
+        *([('lda', IMM, 0x37), ('sta', ZP, 0x01), ('cli', IMP, 0)] if roms else []), ('jmp', A, entry),
+      'table',
+        table]
+
+
+def linkedImage(memory: MemoryImage, gap: int=defaultGap, entry: int=None, roms: bool=True) -> bytes:
+    """ PRG that loads at the start of BASIC, copies each segment to its address, and jumps to entry,
+        by default the address of a SYS line at the start of BASIC, or the start of the first segment,
+        the ROMs are banked out while copying, and stay out if not roms, for an entry under them """
+    parts = segments(memory, gap)
+    if len(parts) == 0:
+        raise ValueError('Nothing to save')
+    for start, data in parts:
+        if start < moverEnd:
+            raise ValueError(f'Segment ${start:04x}-${start+len(data)-1:04x} is below ${moverEnd:04x}, used by the loader')
+    if entry is None:
+        entry = basicEntry(memory)
+    if entry is None:
+        entry = parts[0][0]
+
+    # 10 SYS 2061, and code that moves the mover to the cassette buffer
+    stub = bytes([0x0b, 0x08, 0x0a, 0x00, 0x9e]) + b'2061' + bytes(3)
+    moverSize = len(_encode(moverAddress, _mover(entry, bytes(7 * (len(parts) + 1)), roms)))
+    if moverAddress + moverSize > moverEnd:
+        raise ValueError(f'Too many segments for a linked image: {len(parts)}')
+    bootstrap = lambda moverSource: _encode(basicStartAddress + len(stub), [
+        ('ldx', AddressMode.immediate, 0),
+      'copy',
+        ('lda', AddressMode.absoluteX, moverSource), ('sta', AddressMode.absoluteX, moverAddress),
+        ('inx', AddressMode.implied, 0), ('cpx', AddressMode.immediate, moverSize), ('bne', AddressMode.relative, 'copy'),
+        ('jmp', AddressMode.absolute, moverAddress)])
+    moverSource = basicStartAddress + len(stub) + len(bootstrap(0))
+
+    # segments that move up are copied first from the top down, then the ones that move down from the bottom up,
+    # so no segment overwrites the data of one that isn't copied yet
+    source = moverSource + moverSize
+    forward, backward = [], []
+    for start, data in parts:
+        length = len(data)
+        if start > source:
+            pages = length & 0xff00
+            backward.insert(0, _word(source + pages) + _word(start + pages) + _word(length) + b'\x01')
+        else:
+            forward.append(_word(source) + _word(start) + _word(length) + b'\x00')
+        source += length
+    if source > loadEnd:
+        raise ValueError(f'Linked image too large: ${basicStartAddress:04x}-${source-1:04x}')
+    table = b''.join(backward + forward) + b'\xff' * 7
+
+    image = stub + bootstrap(moverSource) + _encode(moverAddress, _mover(entry, table, roms))
+    return _word(basicStartAddress) + image + b''.join(data for _, data in parts)
+
+
+def _decruncher(origin: int, stream: int, destination: int, entry: int) -> bytes:
+    """ the decruncher in stubs/decrunch.asm, assembled for the addresses """
+    import assemble # the assembler that is saving
+    defines = {'DECRUNCH_ORIGIN': origin, 'STREAM': stream, 'DESTINATION': destination, 'ENTRY': entry}
+    with contextlib.redirect_stdout(io.StringIO()) as printed:
+        memory = assemble.assembleMemory(decruncherFile, defines)
+    if memory is None:
+        raise ValueError(f'Decruncher not assembled: {printed.getvalue()}')
+    return memory.bytes()
+
+
+def crunchedImage(memory: MemoryImage, entry: int=None) -> bytes:
+    """ linked image of memory packed with cruncher.crunch, at the top of memory below the CPU vectors with
+        a decruncher after it, which runs under the ROMs, the program starts at entry, by default like linkedImage """
+    if len(memory) == 0:
+        raise ValueError('Nothing to save')
+    destination = memory.first
+    if destination < 0x0200:
+        raise ValueError(f'Crunched programs can\'t start below $0200: ${destination:04x}')
+    if entry is None:
+        entry = basicEntry(memory)
+    if entry is None:
+        entry = destination
+
+    data = memory.bytes()
+    packed, margin = cruncher.crunch(data)
+    size = len(_decruncher(0x1000, 0x1000, destination, entry)) # the same for all addresses
+    stream = vectorStart - size - len(packed)
+    if stream < destination + margin: # unpacking must stay behind reading
+        raise ValueError(f'Crunched program doesn\'t fit below its packed data: ${destination:04x}-${destination+len(data)-1:04x}, '
+            f'{len(packed)} bytes packed')
+
+    image = MemoryImage()
+    image.write(stream, packed + _decruncher(stream + len(packed), stream, destination, entry))
+    return linkedImage(image, 0, stream + len(packed), False)
+
+
+def _write(fileName: str, data: bytes):
+    with open(fileName, 'wb') as f:
+        f.write(data)
+
+
+def save(memory: MemoryImage, fileName: str, mode: str='prg', gap: int=defaultGap, start: int=None) -> list:
+    """ save memory in an output mode, returns the saved file names
+        prg: one PRG from the first to the last written address, with zeros in the gaps
+        segments: a PRG for each segment, named with its start address
+        linked: one PRG with all segments, and a loader that copies them in place
+        raw: the bytes of each segment, without a load address
+        crunched: one PRG that unpacks the program, see crunchedImage """
+    if mode == 'prg':
+        start = memory.first if len(memory) > 0 else start
+        _write(fileName, _word(start) + memory.bytes())
+        return [fileName]
+    elif mode == 'linked':
+        _write(fileName, linkedImage(memory, gap))
+        return [fileName]
+    elif mode == 'crunched':
+        _write(fileName, crunchedImage(memory))
+        return [fileName]
+    elif mode in ['segments', 'raw']:
+        fileNames = []
+        for segmentStart, data in segments(memory, gap):
+            fileNames.append(segmentFileName(fileName, segmentStart))
+            loadAddress = _word(segmentStart) if mode == 'segments' else b''
+            _write(fileNames[-1], loadAddress + data)
+        return fileNames
+    raise ValueError(f'Invalid output mode: {mode}')
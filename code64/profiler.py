@@ -0,0 +1,74 @@
+#! /usr/bin/env python3
+
+import json
+import marshal
+import re
+import time
+
+
+categories = ['pass', 'file', 'lex', 'node', 'call'] # the order of the rows with the same time
+
+_callSite = re.compile(r'(.*):(\d+) (.*)') # file:line code
+
+
+class Profiler:
+    """ wall time and counts of the parts of a build, recorded by multiPass when multiPass.profiler is set
+        pass: each pass, counting lines run
+        file: the lines run from each source file or generated text, without the lines of the files they import
+        lex: loading, lexing and parsing each source file
+        node: each directive, and instructions, labels and assignments, a .repeat includes its body
+        call: each @generator, .py and .import of a python file, named 'file:line code'
+        only passes and lexing are recorded when not detailed, which takes almost no time """
+
+    def __init__(self, dumpFile: str=None, detailed: bool=True):
+        self.dumpFile = dumpFile # .json, or anything else for a cProfile dump, see save
+        self.detailed = detailed # record files, nodes and calls
+        self.clear()
+
+    def clear(self, inFile: str=''):
+        self.inFile = inFile
+        self.records = {} # (category, name) -> [count, seconds]
+        self.start = time.perf_counter()
+        self.seconds = 0.0
+
+    def add(self, category: str, name: str, seconds: float, count: int=1):
+        record = self.records.get((category, name))
+        if record is None:
+            self.records[(category, name)] = [count, seconds]
+        else:
+            record[0] += count
+            record[1] += seconds
+
+    def stop(self):
+        self.seconds = time.perf_counter() - self.start
+
+    def hotSpots(self) -> list:
+        """ (seconds, count, category, name) of all records, the slowest first """
+        order = {category: index for index, category in enumerate(categories)}
+        return sorted(((seconds, count, category, name) for (category, name), (count, seconds) in self.records.items()),
+            key=lambda row: (-row[0], order.get(row[2], len(order)), row[3]))
+
+    def printTable(self, limit: int=25):
+        """ the slowest records, times include the records they contain, passes and files count lines """
+        total = max(self.seconds, 1e-9)
+        print(f'Profile: {self.inFile} in {self.seconds*1000:.1f} ms')
+        print(f"  {'ms':>9} {'%':>6} {'count':>8}  {'category':<6} name")
+        for seconds, count, category, name in self.hotSpots()[:limit]:
+            print(f'  {seconds*1000:9.2f} {seconds/total:6.1%} {count:8}  {category:<6} {name}')
+
+    def save(self, fileName: str):
+        """ write the records as JSON if the file name ends with .json, otherwise in the format of cProfile dumps,
+            which pstats and its viewers read, with a function for each record """
+        if fileName.endswith('.json'):
+            rows = [{'category': category, 'name': name, 'count': count, 'seconds': seconds}
+                for seconds, count, category, name in self.hotSpots()]
+            with open(fileName, 'w') as f:
+                json.dump({'file': self.inFile, 'seconds': self.seconds, 'records': rows}, f, indent=1)
+        else:
+            stats = {}
+            for seconds, count, category, name in self.hotSpots():
+                site = _callSite.fullmatch(name) if category == 'call' else None
+                key = (site[1], int(site[2]), site[3]) if site is not None else (category, 0, name)
+                stats[key] = (count, count, seconds, seconds, {})
+            with open(fileName, 'wb') as f:
+                marshal.dump(stats, f)
@@ -0,0 +1,141 @@
+#! /usr/bin/env python3
+
+import cpu
+import lexer
+from cpu import AddressMode
+
+
+class Label:
+    def __init__(self, name: str):
+        self.name = name
+
+
+class Instruction:
+    def __init__(self, mnemonic: str, operand: str, size: str=None):
+        self.mnemonic = mnemonic
+        self.operand = operand # operand text, as written
+        self.size = size # None, or 'zp'/'abs' to force zero page or absolute address modes
+        self.mode, self.zeroPageMode, self.expression = _addressMode(cpu.instructionWithMnemonic(mnemonic), operand)
+        if size == 'zp' and self.zeroPageMode is not None:
+            self.mode = None
+        elif size == 'abs' and self.mode is not None:
+            self.zeroPageMode = None
+
+    def isValid(self) -> bool:
+        return self.mode is not None or self.zeroPageMode is not None
+
+
+class Assignment:
+    def __init__(self, symbol: str, expression: str):
+        self.symbol = symbol
+        self.expression = expression
+
+
+class Directive:
+    def __init__(self, name: str, expression: str):
+        self.name = name
+        self.expression = expression
+
+
+class Generator:
+    def __init__(self, expression: str):
+        self.expression = expression
+
+
+class InvalidSyntax:
+    pass
+
+
+def _addressMode(instruction: cpu.Instruction, operand: str) -> tuple:
+    """ address mode, optional zero page mode, and expression of an operand, chosen from the operand syntax """
+    opcodes = instruction.opcodes
+
+    if AddressMode.accumulator in opcodes and not operand:
+        return AddressMode.accumulator, None, None
+
+    elif AddressMode.implied in opcodes and not operand:
+        return AddressMode.implied, None, None
+
+    elif AddressMode.immediate in opcodes and operand.startswith('#'):
+        return AddressMode.immediate, None, operand[1:]
+
+    elif AddressMode.indirectX in opcodes and operand.startswith('(') and operand.endswith(',x)'):
+        return AddressMode.indirectX, None, operand[1:-3]
+
+    elif AddressMode.indirectY in opcodes and operand.startswith('(') and operand.endswith('),y'):
+        return AddressMode.indirectY, None, operand[1:-3]
+
+    elif AddressMode.indirect in opcodes and operand.startswith('(') and operand.endswith(')'):
+        return AddressMode.indirect, None, operand[1:-1]
+
+    elif AddressMode.relative in opcodes:
+        return AddressMode.relative, None, operand
+
+    # absolute address modes, with zero page variants when the value fits
+    for zeroPage, absolute, suffix in [
+            (AddressMode.zeroPageX, AddressMode.absoluteX, ',x'),
+            (AddressMode.zeroPageY, AddressMode.absoluteY, ',y')]:
+        if (zeroPage in opcodes or absolute in opcodes) and operand.endswith(suffix):
+            return (absolute if absolute in opcodes else None), (zeroPage if zeroPage in opcodes else None), operand[:-2]
+
+    if (AddressMode.zeroPage in opcodes or AddressMode.absolute in opcodes) and operand:
+        return ((AddressMode.absolute if AddressMode.absolute in opcodes else None),
+            (AddressMode.zeroPage if AddressMode.zeroPage in opcodes else None), operand)
+
+    return None, None, None
+
+
+def _sizeApplies(instruction: Instruction) -> bool:
+    """ a .zp hint needs a zero page address mode, an .abs hint an absolute one """
+    if instruction.size == 'zp':
+        return instruction.zeroPageMode is not None
+    return instruction.mode in [AddressMode.absolute, AddressMode.absoluteX, AddressMode.absoluteY]
+
+
+def parseChunk(chunk: lexer.Chunk) -> tuple:
+    """ the nodes of one source line: an optional label, followed by an optional statement """
+    nodes = []
+
+    if len(chunk) >= 2 and chunk[1] == ':':
+        nodes.append(Label(chunk[0]))
+        chunk = chunk[2:]
+
+    if len(chunk) >= 3 and cpu.isMnemonic(chunk[0]) and chunk[1] == '.' and chunk[2] in ['zp', 'abs']:
+        instruction = Instruction(chunk[0], chunk.join(3), chunk[2])
+        nodes.append(instruction if _sizeApplies(instruction) else InvalidSyntax())
+
+    elif len(chunk) >= 1 and cpu.isMnemonic(chunk[0]):
+        nodes.append(Instruction(chunk[0], chunk.join(1)))
+
+    elif len(chunk) >= 3 and chunk[1] == '=':
+        nodes.append(Assignment(chunk[0], chunk.join(2)))
+
+    elif len(chunk) >= 2 and chunk[0] == '.':
+        nodes.append(Directive(chunk[1], chunk.join(2)))
+
+    elif len(chunk) >= 2 and chunk[0] == '@':
+        nodes.append(Generator(chunk.join(1)))
+
+    elif len(chunk) > 0:
+        nodes.append(InvalidSyntax())
+
+    return tuple(nodes)
+
+
+def parseChunks(chunks) -> list:
+    """ the nodes of all lines of a file """
+    return [parseChunk(chunks[i]) for i in range(len(chunks))]
+
+
+def repeatEnds(lines: list) -> dict:
+    """ line index of the matching .endr for the line index of each .repeat in the same file """
+    ends = {}
+    starts = []
+    for index, nodes in enumerate(lines):
+        for node in nodes:
+            if type(node) is Directive:
+                if node.name == 'repeat':
+                    starts.append(index)
+                elif node.name == 'endr' and len(starts) > 0:
+                    ends[starts.pop()] = index
+    return ends
@@ -0,0 +1,128 @@
+; decruncher for the streams of cruncher.crunch, assembled by output.crunchedImage
+;
+; runs at DECRUNCH_ORIGIN with RAM everywhere, so it can be under the ROMs, unpacks the stream at STREAM
+; to DESTINATION, and jumps to ENTRY from zero page after banking the ROMs in again,
+; the stream is a list of
+;   $00-$7f             n+1 literal bytes follow
+;   $80-$bf offset-1    copy (n & $3f) + 3 bytes from offset bytes back, offset 1..256
+;   $c0-$fe offset      copy (n & $3f) + 4 bytes from offset bytes back, 16 bit offset
+;   $ff                 end
+
+source      = $f8
+dest        = $fa
+match       = $fc
+length      = $fe
+exit        = $f8                   ; where the code that banks the ROMs in runs, after unpacking
+
+            .org DECRUNCH_ORIGIN
+decrunch:
+            sei
+            lda #$34                ; RAM everywhere
+            sta $01
+            lda #lo(STREAM)
+            sta source
+            lda #hi(STREAM)
+            sta source+1
+            lda #lo(DESTINATION)
+            sta dest
+            lda #hi(DESTINATION)
+            sta dest+1
+
+next:
+            ldy #0
+            lda (source),y
+            cmp #$ff
+            beq done
+            cmp #$80
+            bcs copyMatch
+
+            adc #1                  ; literal bytes, the carry is clear
+            sta length
+            lda #1
+            jsr addSource
+            ldy #0
+_copy:
+            lda (source),y
+            sta (dest),y
+            iny
+            cpy length
+            bne _copy
+            lda length
+            jsr addSource
+            jsr addDest
+            jmp next
+
+copyMatch:
+            tax
+            and #$3f
+            clc
+            adc #3
+            sta length
+            iny
+            cpx #$c0
+            bcs _long
+            lda dest                ; match = dest - (offset-1) - 1, the carry is clear
+            sbc (source),y
+            sta match
+            lda dest+1
+            sbc #0
+            sta match+1
+            lda #2
+            bne _copy
+_long:
+            inc length
+            lda dest                ; match = dest - offset
+            sec
+            sbc (source),y
+            sta match
+            iny
+            lda dest+1
+            sbc (source),y
+            sta match+1
+            lda #3
+_copy:
+            jsr addSource
+            ldy #0
+_loop:
+            lda (match),y
+            sta (dest),y
+            iny
+            cpy length
+            bne _loop
+            jsr addDest
+            jmp next
+
+done:
+            ldx #exitEnd-exitCode-1
+_copy:
+            lda exitCode,x
+            sta exit,x
+            dex
+            bpl _copy
+            jmp exit
+
+exitCode:
+            .byte $a9, $37          ; lda #$37
+            .byte $85, $01          ; sta $01
+            .byte $58               ; cli
+            .byte $4c, lo(ENTRY), hi(ENTRY) ; jmp ENTRY
+exitEnd:
+
+addSource:                          ; source += a
+            clc
+            adc source
+            sta source
+            bcc _done
+            inc source+1
+_done:
+            rts
+
+addDest:                            ; dest += length
+            lda dest
+            clc
+            adc length
+            sta dest
+            bcc _done
+            inc dest+1
+_done:
+            rts
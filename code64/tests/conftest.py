@@ -0,0 +1,7 @@
+#! /usr/bin/env python3
+
+import os
+import sys
+
+# the modules import each other by name, so the tests also run from outside code64/, e.g. pytest code64/tests
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
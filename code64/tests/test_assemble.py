@@ -0,0 +1,237 @@
+#! /usr/bin/env python3
+
+import ast
+import contextlib
+import io
+import os
+import re
+import tempfile
+import unittest
+
+import lexer
+from assemble import cloneSymbols, _definedNames, importSnapshot, multiPass, parseDefine
+
+
+class TestAssemble(unittest.TestCase):
+
+    def setUp(self):
+        self.savedCacheDirectory = lexer.cacheDirectory
+        lexer.cacheDirectory = None # keep the tests out of the user's chunk cache
+
+    def tearDown(self):
+        lexer.cacheDirectory = self.savedCacheDirectory
+
+    def _assemble(self, source: str, checkpointInterval: int, defines: dict=None, files: dict={}) -> tuple:
+        savedInterval = multiPass.checkpointInterval
+        multiPass.checkpointInterval = checkpointInterval
+        with tempfile.TemporaryDirectory() as directory:
+            inFile = os.path.join(directory, 'test.asm')
+            outFile = os.path.join(directory, 'test.prg')
+            with open(inFile, 'w') as f:
+                f.write(source)
+            for fileName, data in files.items():
+                with open(os.path.join(directory, fileName), 'wb') as f:
+                    f.write(data)
+            output = io.StringIO()
+            with contextlib.redirect_stdout(output):
+                anyErrors = multiPass(inFile, outFile, True, defines)
+            prg = None
+            if os.path.exists(outFile):
+                with open(outFile, 'rb') as f:
+                    prg = f.read()
+        multiPass.checkpointInterval = savedInterval
+        return anyErrors, prg, output.getvalue()
+
+
+    def testIncrementalPasses(self):
+        source = '\n'.join([
+            'start: lda (c-start)&0xff', # forward reference to zero page
+            '.repeat "i", 3',
+            ' .byte i',
+            '.endr',
+            'a: sta a,x',
+            'b = a + 1',
+            'c: .word b, c',
+            '.org $2000',
+            'f: nop',
+            '_g: .align 16', # a checkpoint that keeps naming intervals after f
+            ' lda last', # forward reference that grows to absolute in pass 2
+            'd: jmp last',
+            'e: .bytefill 4, "x: lo(x + e)"',
+            'last: rts'])
+
+        anyErrors, prg, output = self._assemble(source, 1)
+        self.assertFalse(anyErrors)
+        self.assertIn('resuming at', output)
+        self.assertRegex(output, r'\$2010-\$201a f at ') # named by the label before the resumed segment
+        self.assertEqual(self._assemble(source, 1000)[1], prg)
+
+
+    def testDefines(self):
+        self.assertEqual(parseDefine('PAL'), ('PAL', 1))
+        self.assertEqual(parseDefine('PAL=0'), ('PAL', 0))
+        self.assertEqual(parseDefine('BORDER=$0e'), ('BORDER', 14))
+        self.assertEqual(parseDefine('NAME=demo'), ('NAME', 'demo'))
+        self.assertEqual(parseDefine('NAME="a b"'), ('NAME', 'a b'))
+        self.assertRaises(ValueError, parseDefine, '1=2')
+
+        source = '.byte BORDER, len(NAME)'
+        anyErrors, prg, output = self._assemble(source, 32, {'BORDER': 14, 'NAME': 'demo'})
+        self.assertEqual(prg, bytes([0x00, 0x10, 14, 4]))
+
+
+    def testImportSnapshot(self):
+        symbols = {}
+        cloneSymbols(importSnapshot(), symbols)
+        self.assertIs(symbols['basicSys'].__globals__, symbols) # reads len
+        self.assertIs(symbols['ldax'], importSnapshot()['ldax']) # only reads its arguments
+        self.assertEqual(symbols['VIC_BORDER_COLOR'], 0xd020)
+
+        tree = ast.parse('A = 1\nB, C = 2, 3\ndef f(x):\n    y = x\nif A:\n    import os.path as p')
+        self.assertEqual(_definedNames(tree), {'A', 'B', 'C', 'f', 'p'})
+        self.assertIsNone(_definedNames(ast.parse('from math import *')))
+
+        source = '.py "x = 5"\n@basicSys(10, 4096)\nlda #lo(VIC_BORDER_COLOR)\n.byte x'
+        _, eagerPrg, eagerOutput = self._assemble(source, 32)
+        multiPass.lazyImports = True
+        try:
+            anyErrors, prg, output = self._assemble(source, 32)
+        finally:
+            multiPass.lazyImports = False
+        self.assertFalse(anyErrors)
+        self.assertEqual(prg, eagerPrg)
+        self.assertIn('Importing: basic.py, cia.py', eagerOutput)
+        self.assertEqual(re.findall('Importing: (.*)', output), ['basic.py', 'vic.py'])
+
+
+    def testOperandSizes(self):
+        source = '\n'.join([
+            '.org $1000',
+            ' lda zp', # forward reference to zero page
+            ' lda table,x', # forward reference to absolute
+            ' lda.abs 2',
+            ' lda.zp zp,x',
+            '.zpbyte "zp"',
+            'table: rts'])
+
+        anyErrors, prg, output = self._assemble(source, 32)
+        self.assertFalse(anyErrors)
+        self.assertEqual(prg, bytes([0x00, 0x10, 0xa5, 0x02, 0xbd, 0x0a, 0x10, 0xad, 0x02, 0x00, 0xb5, 0x02, 0x60]))
+        self.assertNotIn('Pass 4', output)
+
+        anyErrors, prg, output = self._assemble(' lda.zp $1234', 32)
+        self.assertTrue(anyErrors)
+        self.assertIn('Zero page address out of range: $1234', output)
+
+
+    def testConvergence(self):
+        source = '\n'.join([
+            '.org $10f0',
+            ' lda z1', # forward reference that ends up absolute
+            ' ldx #0',
+            ' nop',
+            'l2:',
+            ' sta z0,x', # forward reference to zero page
+            ' .bytefill (l2 - l1) & 15, "x: 238"', # the fill depends on its own address
+            'l1:',
+            'z0 = $80',
+            'z1 = l1'])
+
+        anyErrors, prg, output = self._assemble(source, 32)
+        self.assertFalse(anyErrors)
+        self.assertEqual(prg, bytes([0xf0, 0x10, 0xad, 0x07, 0x11, 0xa2, 0x00, 0xea, 0x95, 0x80] + [0xee] * 15))
+        self.assertNotIn('Pass 4', output)
+
+        source = '\n'.join([
+            '.org $1000',
+            'l2: ldx #0',
+            ' sta z0,x',
+            ' .bytefill (l2 - l1) & 7, "x: x"', # no fill length gives its own address
+            'l1: rts',
+            '.zpbyte "z0"'])
+
+        anyErrors, prg, output = self._assemble(source, 32)
+        self.assertTrue(anyErrors)
+        self.assertIsNone(prg)
+        self.assertIn('No stable result after 9 passes, still changing: l1', output)
+
+
+    def testRepeat(self):
+        source = '\n'.join([
+            '.org $1000',
+            '.repeat "i", 2',
+            ' .repeat "j", 3',
+            '  .byte i*16 + j',
+            ' .endr',
+            'a: .byte a & 0xff', # label in the body of the outer repeat
+            '.endr',
+            '.repeat "k", 0', # runs once
+            ' .byte 0xee',
+            '.endr'])
+
+        anyErrors, prg, output = self._assemble(source, 32)
+        self.assertTrue(anyErrors)
+        self.assertIn('Label was already defined: "a"', output)
+
+        anyErrors, prg, output = self._assemble(source.replace('a: .byte a & 0xff', ' .byte 0xff'), 32)
+        self.assertFalse(anyErrors)
+        self.assertEqual(prg, bytes([0x00, 0x10, 0x00, 0x01, 0x02, 0xff, 0x10, 0x11, 0x12, 0xff, 0xee]))
+
+        # a body with a generator is not compiled, and assembles the same
+        generated = self._assemble(source.replace('a: .byte a & 0xff', ' @basicEnd()'), 32)[1]
+        self.assertEqual(generated, self._assemble(source.replace('a: .byte a & 0xff', ' .word 0'), 32)[1])
+        self.assertEqual(len(generated), 2 + 2*5 + 1)
+
+
+    def testGenerators(self):
+        source = '\n'.join([
+            '.org $1000',
+            '.repeat "i", 4',
+            ' @ldax(0x1234)', # the same text every time
+            ' @stax(0x2000 + i)',
+            '.endr'])
+
+        anyErrors, prg, output = self._assemble(source, 32)
+        self.assertFalse(anyErrors)
+        self.assertEqual(prg[2:7], bytes([0xa9, 0x34, 0xa2, 0x12, 0x8d]))
+        self.assertEqual(prg[-6:], bytes([0x8d, 0x03, 0x20, 0x8e, 0x04, 0x20]))
+        self.assertRegex(output, r'Generators: 16 calls, 9 expanded, [0-5] lexed')
+
+
+    def testBinary(self):
+        files = {'data.bin': bytes(range(16)), 'empty.bin': b''}
+        source = '\n'.join([
+            '.org $1000',
+            '.binary "data.bin"',
+            '.binary "data.bin", 14',
+            '.binary "data.bin", 4, 2',
+            '.binary "empty.bin"'])
+
+        anyErrors, prg, output = self._assemble(source, 32, files=files)
+        self.assertFalse(anyErrors)
+        self.assertEqual(prg, bytes([0x00, 0x10]) + bytes(range(16)) + bytes([14, 15, 4, 5]))
+
+        anyErrors, prg, output = self._assemble('.binary "data.bin", 10, 7', 32, files=files)
+        self.assertTrue(anyErrors)
+        self.assertIn('Binary range out of file: "data.bin", 10, 7 (16 bytes)', output)
+
+
+    def testOverlaps(self):
+        source = '\n'.join([
+            '.org $1000',
+            'a: .bytefill 256',
+            '.org $1080',
+            'b: lda #1',
+            ' .byte 2, 3',
+            '.org $2000',
+            ' rts'])
+
+        anyErrors, prg, output = self._assemble(source, 32)
+        self.assertFalse(anyErrors)
+        self.assertEqual(output.count('warning:'), 1) # one for all overwritten bytes
+        self.assertRegex(output, r'test.asm:4 warning: 4 bytes at \$1080-\$1083 of \$1080-\$1083 overwrite \$1000-\$10ff a at .*test.asm:2')
+        self.assertRegex(output, r'\$2000-\$2000 at .*test.asm:7, 1 byte\n')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+#! /usr/bin/env python3
+
+import contextlib
+import io
+import json
+import os
+import tempfile
+import unittest
+
+import assemble
+import lexer
+from batch import assembleTargets, assembleVariants, parseVariant, readManifest, Target, variantFileName, _warmUp
+from profiler import Profiler
+
+
+class TestBatch(unittest.TestCase):
+
+    def setUp(self):
+        self.savedCacheDirectory = lexer.cacheDirectory
+        lexer.cacheDirectory = None # keep the tests out of the user's chunk cache
+
+    def tearDown(self):
+        lexer.cacheDirectory = self.savedCacheDirectory
+
+    def testManifest(self):
+        with tempfile.TemporaryDirectory() as directory:
+            fileName = os.path.join(directory, 'build.txt')
+            with open(fileName, 'w') as f:
+                f.write('# demo parts\nintro.asm intro.prg\n\n  part1.asm # no output\n')
+            targets = readManifest(fileName)
+            self.assertEqual([(t.inFile, t.outFile) for t in targets], [
+                (os.path.join(directory, 'intro.asm'), os.path.join(directory, 'intro.prg')),
+                (os.path.join(directory, 'part1.asm'), None)])
+
+            with open(fileName, 'w') as f:
+                f.write('a.asm b.prg c\n')
+            self.assertRaises(ValueError, readManifest, fileName)
+
+
+    def testVariants(self):
+        self.assertEqual(parseVariant('pal:PAL=1,MUSIC'), ('pal', {'PAL': 1, 'MUSIC': 1}))
+        self.assertEqual(parseVariant('plain'), ('plain', {}))
+        self.assertRaises(ValueError, parseVariant, ':PAL=1')
+        self.assertEqual(variantFileName('out/demo.prg', 'ntsc'), 'out/demo-ntsc.prg')
+
+        with tempfile.TemporaryDirectory() as directory:
+            inFile = os.path.join(directory, 'demo.asm')
+            with open(inFile, 'w') as f:
+                f.write('.byte PAL, BORDER\n')
+            outFile = os.path.join(directory, 'demo.prg')
+
+            with contextlib.redirect_stdout(io.StringIO()):
+                anyErrors = assembleVariants(inFile, outFile, [('pal', {'PAL': 1}), ('ntsc', {'PAL': 0})], {'BORDER': 6}, 2)
+            self.assertFalse(anyErrors)
+            for name, pal in [('pal', 1), ('ntsc', 0)]:
+                with open(variantFileName(outFile, name), 'rb') as f:
+                    self.assertEqual(f.read(), bytes([0x00, 0x10, pal, 6]))
+
+
+    def testAssembleTargets(self):
+        with tempfile.TemporaryDirectory() as directory:
+            targets = []
+            for name, source in [('good', 'lda #1\n'), ('bad', 'lda #x\n')]:
+                inFile = os.path.join(directory, name + '.asm')
+                with open(inFile, 'w') as f:
+                    f.write(source)
+                targets.append(Target(inFile, os.path.join(directory, name + '.prg')))
+
+            output = io.StringIO()
+            with contextlib.redirect_stdout(output):
+                anyErrors = assembleTargets(targets, 2)
+            self.assertTrue(anyErrors)
+            self.assertTrue(os.path.exists(targets[0].outFile))
+            self.assertFalse(os.path.exists(targets[1].outFile))
+            self.assertIn('Assembled 2 targets', output.getvalue())
+
+
+    def testWorkerOptions(self):
+        import concurrent.futures, multiprocessing
+        # spawned workers start with the default options, the initializer sets them
+        with concurrent.futures.ProcessPoolExecutor(1, mp_context=multiprocessing.get_context('spawn'),
+                initializer=_warmUp, initargs=([], {'outputMode': 'raw', 'gap': 7}, 'cache')) as executor:
+            options = [executor.submit(getattr, assemble.multiPass, name).result() for name in ['outputMode', 'gap']]
+            options.append(executor.submit(eval, '__import__("lexer").cacheDirectory').result())
+        self.assertEqual(options, ['raw', 7, 'cache'])
+
+
+    def testProfile(self):
+        with tempfile.TemporaryDirectory() as directory:
+            targets = []
+            for name in ['a', 'b']:
+                targets.append(Target(os.path.join(directory, name + '.asm'), os.path.join(directory, name + '.prg')))
+                with open(targets[-1].inFile, 'w') as f:
+                    f.write('lda #1\n')
+            profileFile = os.path.join(directory, 'profile.json')
+
+            assemble.multiPass.profiler = Profiler(profileFile)
+            try:
+                with contextlib.redirect_stdout(io.StringIO()):
+                    self.assertFalse(assembleTargets(targets, 2))
+            finally:
+                assemble.multiPass.profiler = None
+            with open(profileFile) as f:
+                profile = json.load(f)
+        self.assertEqual(profile['file'], '2 targets')
+        lexed = {record['name'] for record in profile['records'] if record['category'] == 'lex'}
+        self.assertEqual(lexed, {target.inFile for target in targets})
+
+
+if __name__ == '__main__':
+    unittest.main()
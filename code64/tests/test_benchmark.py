@@ -0,0 +1,64 @@
+#! /usr/bin/env python3
+
+import contextlib
+import io
+import json
+import os
+import tempfile
+import unittest
+
+import lexer
+from benchmark import _shlexTokenize, _testcaseSource, benchmarkAssembler, regressions
+
+
+class TestBenchmark(unittest.TestCase):
+
+    def setUp(self):
+        self.savedCacheDirectory = lexer.cacheDirectory
+        lexer.cacheDirectory = None # keep the tests out of the user's chunk cache
+
+    def tearDown(self):
+        lexer.cacheDirectory = self.savedCacheDirectory
+
+    def testTokenizeMatchesShlex(self):
+        text = _testcaseSource() + '\n'.join([
+            'lda #$12 ; comment',
+            'x"a b"c',
+            'a<<=b|c&&d',
+            '£x',
+            '<>;x',
+            '$ff%01',
+            "'abc' \"{a}\"",
+            '\tjmp (a),y\r\n\r\nnop'])
+        expected = [t.string for t in _shlexTokenize(text)]
+        actual = [t.string for t in lexer.tokenize(text)]
+        self.assertEqual(actual, expected)
+
+
+    def testAssemblerWorkloads(self):
+        with tempfile.TemporaryDirectory() as directory:
+            fileName = os.path.join(directory, 'results.json')
+            with contextlib.redirect_stdout(io.StringIO()) as output:
+                benchmarkAssembler(0.01, 1, fileName)
+                benchmarkAssembler(0.01, 1, fileName)
+            with open(fileName) as f:
+                saved = json.load(f)
+
+        self.assertEqual(len(saved), 2)
+        results = saved[-1]['results']
+        self.assertEqual(set(results), {'flat', 'repeat', 'generators', 'bytefill', 'forward', 'assets'})
+        self.assertFalse(any(result['errors'] for result in results.values()), output.getvalue())
+        self.assertGreater(results['forward']['passes'], 1)
+
+        slower = {name: dict(result, seconds=result['seconds'] * 2, passes=result['passes'] + 1) for name, result in results.items()}
+        self.assertEqual(regressions([], results), [])
+        self.assertEqual(regressions([results], results), [])
+        self.assertEqual(len(regressions([results], slower)), 2 * len(results))
+
+        # one slow saved run doesn't hide a slowdown from the median
+        self.assertEqual(len(regressions([results, results, slower], slower)), len(results))
+        self.assertEqual(regressions([slower, results, slower], results), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
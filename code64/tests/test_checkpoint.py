@@ -0,0 +1,52 @@
+#! /usr/bin/env python3
+
+import unittest
+
+from context import Context
+from checkpoint import begin, end, resume, resumeIndex
+
+
+class TestCheckpoint(unittest.TestCase):
+
+    def _record(self, passSymbols: dict) -> tuple:
+        context = Context(passSymbols)
+        context.pushReadPointer(('test.asm', 0))
+        passSymbols = dict(passSymbols)
+        first = begin(context, passSymbols, 0)
+        context.reads.add('a')
+        context.symbols['b'] = 2
+        context.writes.add('b')
+        context.labels.add('b')
+        context.memory[0x1000] = 1
+        context.reportWarning('first')
+        end(first, context)
+
+        context.advanceReadPointer()
+        second = begin(context, passSymbols, 0)
+        context.reads.add('c')
+        context.memory[0x1001] = 2
+        end(second, context)
+        return context, [first, second]
+
+
+    def testResume(self):
+        lastContext, segments = self._record({'_': 0x1000, 'a': 1, 'b': 0, 'c': 3})
+        self.assertEqual(resumeIndex(segments, segments[0].passSymbols, 0), (1, None))
+        self.assertEqual(resumeIndex(segments, {'a': 1, 'b': 0, 'c': 4}, 0), (1, '"c"'))
+        self.assertEqual(resumeIndex(segments, {'a': 1.0, 'b': 0, 'c': 3}, 0), (0, '"a"'))
+        self.assertEqual(resumeIndex(segments, segments[0].passSymbols, 1), (0, 'text encoding'))
+
+        context = Context({'_': 0x1000, 'a': 1, 'b': 5, 'c': 4})
+        self.assertEqual(resume(segments, 1, context, lastContext), 0)
+        self.assertEqual(context.symbols['b'], 2)
+        self.assertEqual(context.labels, {'b'})
+        self.assertEqual(context.readPointer(), ('test.asm', 1))
+        self.assertEqual(len(context.warnings), 1)
+        self.assertEqual((0x1000 in context.memory, 0x1001 in context.memory), (True, False))
+
+        segments[0].opaque = True
+        self.assertEqual(resumeIndex(segments, segments[0].passSymbols, 0)[0], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
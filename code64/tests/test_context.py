@@ -0,0 +1,13 @@
+#! /usr/bin/env python3
+
+import unittest
+
+
+class TestAssemble(unittest.TestCase):
+
+    def testTest(self):
+        pass
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+#! /usr/bin/env python3
+
+import unittest
+
+from cpu import AddressMode, decode, encode, instructionSet, instructionWithMnemonic, isMnemonic, opcode, opcodeCycles
+
+
+class TestCpu(unittest.TestCase):
+
+    def testInstructionSet(self):
+        self.assertEqual(len(instructionSet), 56)
+        
+        i = instructionWithMnemonic('lda')
+        self.assertEqual(i.mnemonic, 'lda')
+
+        i = instructionWithMnemonic('xxx')
+        self.assertEqual(i, None)
+
+
+    def testIsMnemonic(self):
+        self.assertEqual(isMnemonic(''), False)
+        self.assertEqual(isMnemonic('a'), False)
+        self.assertEqual(isMnemonic('yyy'), False)
+        self.assertEqual(isMnemonic('lda'), True)
+        self.assertEqual(isMnemonic('sta'), True)
+        self.assertEqual(isMnemonic('nop'), True)
+
+
+    def testEncode(self):
+        self.assertEqual(encode('nop', AddressMode.implied), b'\xea')
+        self.assertEqual(encode('lda', AddressMode.immediate, 0x12), b'\xa9\x12')
+        self.assertEqual(encode('sta', AddressMode.absoluteX, 0xd020), b'\x9d\x20\xd0')
+        self.assertEqual(encode('sta', AddressMode.immediate, 1), None)
+        self.assertEqual(encode('xxx', AddressMode.implied), None)
+        self.assertEqual(opcode('ldx', AddressMode.zeroPageY), 0xb6)
+
+        for instruction in instructionSet:
+            for mode, o in instruction.opcodes.items():
+                self.assertEqual(opcode(instruction.mnemonic, mode), o)
+
+
+    def testDecode(self):
+        self.assertEqual(decode(0xea), ('nop', AddressMode.implied, 1))
+        self.assertEqual(decode(0x6c), ('jmp', AddressMode.indirect, 3))
+        self.assertEqual(decode(0x02), None)
+        self.assertEqual(sum(1 for o in range(256) if decode(o) is not None), 151)
+
+
+    def testCycles(self):
+        self.assertEqual(opcodeCycles[0xa9], 2) # lda #
+        self.assertEqual(opcodeCycles[0xbd], 4) # lda abs,x
+        self.assertEqual(opcodeCycles[0x9d], 5) # sta abs,x
+        self.assertEqual(opcodeCycles[0xfe], 7) # inc abs,x
+        self.assertEqual(opcodeCycles[0x20], 6) # jsr
+        self.assertEqual(opcodeCycles[0x00], 7) # brk
+        
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,42 @@
+#! /usr/bin/env python3
+
+import random
+import unittest
+
+from cruncher import crunch, decrunch, endMarker
+
+
+class TestCruncher(unittest.TestCase):
+
+    def _staysBehind(self, data: bytes, packed: bytes, margin: int) -> bool:
+        """ True if the unpacked data never gets more than margin bytes ahead of the packed data read """
+        unpacked, index = 0, 0
+        while packed[index] != endMarker:
+            control = packed[index]
+            index += control + 2 if control < 0x80 else 2 if control < 0xc0 else 3
+            unpacked += control + 1 if control < 0x80 else (control & 0x3f) + (3 if control < 0xc0 else 4)
+            if unpacked > margin + index:
+                return False
+        return len(data) <= margin + len(packed)
+
+
+    def testRoundTrip(self):
+        generator = random.Random(1)
+        program = bytes(generator.choice([0xa9, 0x8d, 0x20, 0xd0, 0x00, 0x60]) for _ in range(3000))
+        noise = bytes(generator.getrandbits(8) for _ in range(5000))
+        for data in [b'', b'\x01', b'ab' * 2, bytes(70000), bytes(range(256)) * 300, noise, program]:
+            packed, margin = crunch(data)
+            self.assertEqual(decrunch(packed), data)
+            self.assertEqual(packed[-1], endMarker)
+            self.assertTrue(self._staysBehind(data, packed, margin))
+
+        packed, margin = crunch(bytes(0x10000))
+        self.assertLess(len(packed), 0x10000 // 32) # 2 bytes for each 66
+        self.assertGreater(margin, 0x10000 - len(packed) - 1)
+
+        packed, _ = crunch(b'abcdefgh' + bytes(generator.getrandbits(8) for _ in range(300)) + b'abcdefgh')
+        self.assertIn(bytes([0xc0 | 4, 0x34, 0x01]), packed) # a long match 308 bytes back
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+#! /usr/bin/env python3
+
+import contextlib
+import io
+import json
+import os
+import socket
+import stat
+import tempfile
+import threading
+import unittest
+
+import assemble
+import batch
+import daemon
+import lexer
+from daemon import assembleRemote, build, refresh, request, _Server, stop, Watcher
+
+
+class TestDaemon(unittest.TestCase):
+
+    def setUp(self):
+        self.tokenDirectory = tempfile.TemporaryDirectory()
+        self.savedTokenDirectory = daemon.tokenDirectory
+        daemon.tokenDirectory = self.tokenDirectory.name
+        self.savedCacheDirectory = lexer.cacheDirectory
+        lexer.cacheDirectory = None # keep the tests out of the user's chunk cache
+
+    def tearDown(self):
+        daemon.tokenDirectory = self.savedTokenDirectory
+        lexer.cacheDirectory = self.savedCacheDirectory
+        self.tokenDirectory.cleanup()
+
+    def _send(self, port: int, data: bytes) -> dict:
+        with socket.create_connection(('127.0.0.1', port)) as connection:
+            connection.sendall(data)
+            with connection.makefile('rb') as f:
+                return json.loads(f.readline())
+
+    def testWatcher(self):
+        with tempfile.TemporaryDirectory() as directory:
+            inFile = os.path.join(directory, 'watch.asm')
+            with open(inFile, 'w') as f:
+                f.write('.byte 1\n')
+
+            watcher = Watcher()
+            with contextlib.redirect_stdout(io.StringIO()):
+                self.assertFalse(build([batch.Target(inFile)], watcher))
+            self.assertIn(inFile, assemble.multiPass.lines)
+            self.assertEqual(refresh(watcher), set())
+
+            with open(inFile, 'w') as f:
+                f.write('.byte 1, 2\n')
+            self.assertEqual(refresh(watcher), {inFile})
+            self.assertNotIn(inFile, assemble.multiPass.lines)
+
+            # saved while it was being assembled, the loaded content may be older
+            with contextlib.redirect_stdout(io.StringIO()):
+                build([batch.Target(inFile)], watcher)
+            watcher.forget({inFile})
+            watcher.update([inFile], since=os.stat(inFile).st_mtime_ns)
+            self.assertEqual(refresh(watcher), {inFile})
+
+
+    def testServe(self):
+        with tempfile.TemporaryDirectory() as directory:
+            inFile = os.path.join(directory, 'serve.asm')
+            outFile = os.path.join(directory, 'serve.prg')
+            with open(inFile, 'w') as f:
+                f.write('.byte VALUE\n')
+
+            with contextlib.redirect_stdout(io.StringIO()):
+                server = _Server(('127.0.0.1', 0))
+                port = server.server_address[1]
+                thread = threading.Thread(target=server.serve_forever)
+                thread.start()
+                savedTimeout = daemon._Handler.timeout
+                daemon._Handler.timeout = 0.1
+                try:
+                    idle = socket.create_connection(('127.0.0.1', port)) # doesn't block the requests after it
+                    if os.name == 'posix':
+                        self.assertEqual(stat.S_IMODE(os.stat(daemon.tokenFile(port)).st_mode), 0o600)
+                    reply = self._send(port, json.dumps({'command': 'stop', 'token': 'guess'}).encode() + b'\n')
+                    self.assertEqual(reply, {'output': 'Daemon error: invalid token\n', 'anyErrors': True})
+                    self.assertTrue(self._send(port, b'not json\n')['anyErrors'])
+                    self.assertEqual(request({'command': 'assemble', 'targets': []}, port)['output'],
+                        'Daemon error: invalid request, missing cwd or targets\n')
+
+                    for value in [1, 2]:
+                        anyErrors = assembleRemote([batch.Target(inFile, outFile, {'VALUE': value})], port=port)
+                        self.assertFalse(anyErrors)
+                        with open(outFile, 'rb') as f:
+                            self.assertEqual(f.read(), bytes([0x00, 0x10, value]))
+                    self.assertTrue(stop(port))
+                finally:
+                    idle.close()
+                    daemon._Handler.timeout = savedTimeout
+                    thread.join()
+                    server.server_close()
+            self.assertFalse(os.path.exists(daemon.tokenFile(port)))
+            self.assertIsNone(request({'command': 'stop'}, port))
+
+
+if __name__ == '__main__':
+    unittest.main()
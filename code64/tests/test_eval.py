@@ -0,0 +1,225 @@
+#! /usr/bin/env python3
+
+import builtins
+import math
+import types
+import unittest
+
+from context import Context
+from eval import (byteExpression, compileStats, dependencies, expression, _fastEvaluator, fillValues,
+    intExpression, lambdaExpression, wordExpression)
+
+
+class TestEval(unittest.TestCase):
+
+    def testEvalExpression(self):
+        context = Context({})
+        value = expression('123', context)
+        self.assertEqual(value, 123)
+        self.assertEqual(len(context.warnings), 0)
+        self.assertEqual(len(context.errors), 0)
+
+        context = Context({'abc': 234})
+        value = expression('abc', context)
+        self.assertEqual(value, 234)
+        self.assertEqual(len(context.warnings), 0)
+        self.assertEqual(len(context.errors), 0)
+
+        context = Context({})
+        value = expression('abc', context)
+        self.assertEqual(value, None)
+        self.assertEqual(len(context.warnings), 0)
+        self.assertEqual(len(context.errors), 1)
+
+
+    def testEvalIntExpression(self):
+        context = Context({})
+        value = intExpression('12', context)
+        self.assertEqual(value, 12)
+        self.assertEqual(len(context.warnings), 0)
+        self.assertEqual(len(context.errors), 0)
+
+        context = Context({})
+        value = intExpression('1.2', context)
+        self.assertEqual(value, 1)
+        self.assertEqual(len(context.warnings), 1)
+        self.assertEqual(len(context.errors), 0)
+
+
+    def testEvalByteExpression(self):
+        context = Context({})
+        value = byteExpression('-10', context)
+        self.assertEqual(value, 0xf6)
+        self.assertEqual(len(context.warnings), 0)
+        self.assertEqual(len(context.errors), 0)
+
+        context = Context({})
+        value = byteExpression('0x10', context)
+        self.assertEqual(value, 0x10)
+        self.assertEqual(len(context.warnings), 0)
+        self.assertEqual(len(context.errors), 0)
+
+        context = Context({})
+        value = byteExpression('0xfff', context)
+        self.assertEqual(value, 0xff)
+        self.assertEqual(len(context.warnings), 0)
+        self.assertEqual(len(context.errors), 1)
+        
+
+    def testEvalWordExpression(self):
+        context = Context({})
+        value = wordExpression('-10', context)
+        self.assertEqual(value, 0xfff6)
+        self.assertEqual(len(context.warnings), 0)
+        self.assertEqual(len(context.errors), 0)
+
+        context = Context({})
+        value = wordExpression('0x1000', context)
+        self.assertEqual(value, 0x1000)
+        self.assertEqual(len(context.warnings), 0)
+        self.assertEqual(len(context.errors), 0)
+
+        context = Context({})
+        value = wordExpression('0xfffff', context)
+        self.assertEqual(value, 0xffff)
+        self.assertEqual(len(context.warnings), 0)
+        self.assertEqual(len(context.errors), 1)
+
+
+    def testEvalLambdaExpression(self):
+        context = Context({'k': 1, 'cos': math.cos})
+        value = lambdaExpression('x: x + k + round(cos(0))', context)
+        self.assertEqual(isinstance(value, types.FunctionType), True)
+        self.assertEqual(value(1), 3)
+        self.assertEqual(len(context.warnings), 0)
+        self.assertEqual(len(context.errors), 0)
+
+
+    def testIntPassThrough(self):
+        context = Context({})
+        self.assertEqual(byteExpression(0x12, context), 0x12)
+        self.assertEqual(byteExpression(0x123, context), 0x23)
+        self.assertEqual(wordExpression(1.0, context), 1)
+        self.assertEqual(byteExpression('k', Context({'k': 7})), 7)
+        self.assertEqual(len(context.warnings), 0)
+        self.assertEqual(len(context.errors), 1)
+
+
+    def testCompileCache(self):
+        context = Context({})
+        hits, misses = compileStats()
+        expression('1 + 2 + 3 + 4 + 5', context)
+        expression('1 + 2 + 3 + 4 + 5', context)
+        self.assertEqual(compileStats(), (hits+1, misses+1))
+
+        value = expression('1 +', context)
+        self.assertEqual(value, None)
+        self.assertEqual(context.errors, ['error: Invalid syntax (<string>, line 1): "1 +"'])
+
+
+    def testFastPathMatchesEval(self):
+        symbols = {'label': 0x1234, 'zero': 0, 'big': 0x12345, 'name': 'abc',
+            'lo': lambda x: x&0xff, 'hi': lambda x: (x>>8)&0xff, 'f': lambda x, y: x*y}
+        expressions = ['123', '0x1234', '0b101', '-10', '~1', '+3', 'label', 'label+1', '1+label',
+            'label-zero*2', 'lo(label)', 'hi(label+1)', 'label<<2', 'label>>4', 'label&0xff',
+            'label|1', 'label^0xffff', 'label%7', 'label//3', '(label+1)*2', 'f(label, 2)',
+            '1, label, 3', 'abs(-5)', 'max(1, label)', 'undefined', 'undefined+1', 'label+undefined',
+            'lo(undefined)', 'label//zero', 'label%zero', '1<<-1', 'label<<-1', 'name+1', '-name',
+            'lo()', 'zero(1)', 'label ', '1//0', 'big&0xff', 'len(name)']
+        for e in expressions:
+            self.assertIsNotNone(_fastEvaluator(e), e)
+            try:
+                expected = builtins.eval(e, dict(symbols))
+            except Exception as exception:
+                expected = (type(exception), str(exception))
+            try:
+                actual = _fastEvaluator(e)(dict(symbols))
+            except Exception as exception:
+                actual = (type(exception), str(exception))
+            self.assertEqual(actual, expected, e)
+
+            context = Context(dict(symbols))
+            value = expression(e, context)
+            reference = Context(dict(symbols))
+            try:
+                referenceValue = builtins.eval(e, reference.symbols)
+            except Exception as exception:
+                referenceValue = None
+                reference.reportError(f'{str(exception).capitalize()}: "{e}"')
+            self.assertEqual(value, referenceValue, e)
+            self.assertEqual(context.errors, reference.errors, e)
+
+        self.assertEqual(expression(' 1.5', Context({})), 1.5)
+
+        for e in ['1.5', 'label/2', 'name.upper()', 'f"{label}"', 'label if zero else 1', 'True', 'f(*(1, 2))', '1 +']:
+            self.assertIsNone(_fastEvaluator(e), e)
+
+
+    def testMemoizedExpression(self):
+        context = Context({'memoA': 1})
+        self.assertEqual(expression('memoA+1', context), 2)
+        self.assertEqual(expression('memoA+1', context), 2)
+        self.assertEqual((context.evaluations, context.skippedEvaluations), (2, 1))
+
+        context.symbols['memoA'] = 2
+        self.assertEqual(expression('memoA+1', context), 3)
+        self.assertEqual(context.skippedEvaluations, 1)
+
+        context.changedSymbols = {'memoA'}
+        self.assertEqual(expression('memoA+1', context), 3)
+        self.assertEqual(context.skippedEvaluations, 1)
+
+        context.changedSymbols = set()
+        context.symbols['memoA'] = 2.0
+        self.assertEqual(type(expression('memoA+1', context)), float)
+        self.assertEqual(dependencies('memoA + max(1, memoB)'), ('max', 'memoA', 'memoB'))
+        self.assertEqual(dependencies('[x for x in memoC]'), ('memoC',))
+
+
+    def testTrackedExpression(self):
+        def f(x): return x
+        context = Context({'trackA': 1, 'f': f})
+        expression('trackA + min(2, 3)', context)
+        expression('(trackC := 3)', context)
+        self.assertEqual(context.reads, {'trackA', 'min', 'trackC'})
+        self.assertEqual(context.writes, {'trackC'})
+        self.assertFalse(context.opaque)
+
+        expression('f(trackA)', context)
+        self.assertTrue(context.opaque)
+
+        context = Context({'trackD': []})
+        expression('trackD.append(1)', context)
+        self.assertTrue(context.opaque)
+
+
+    def testFillValues(self):
+        context = Context({})
+        self.assertEqual(fillValues(lambda x: x*2, 4, 1, context), [0, 2, 4, 6])
+        self.assertEqual(fillValues(lambda x: x*100, 4, 1, context), [0, 100, 200, 0x2c])
+        self.assertEqual(len(context.errors), 1)
+        self.assertEqual(fillValues(lambda x: x/2, 3, 2, context), [0, 0, 1])
+        self.assertEqual(len(context.warnings), 1)
+        self.assertEqual(fillValues(lambda x: -x, 2, 2, context), [0, 0xffff])
+        self.assertEqual(fillValues(lambda x: 1//x, 3, 1, context), [0, 1, 0])
+        self.assertEqual(context.errors[-1], 'error: Integer division or modulo by zero')
+        self.assertEqual(fillValues(lambda x: x, 0, 1, context), [])
+
+        # exact with large intermediate values, and each value is computed once
+        calls = []
+        self.assertEqual(fillValues(lambda x: calls.append(x) or (x**7) % 256, 256, 1, context), [(x**7) % 256 for x in range(256)])
+        self.assertEqual(calls, list(range(256)))
+        self.assertEqual(fillValues(lambda x: (x*123456789123) % 65536, 4096, 2, context), [(x*123456789123) % 65536 for x in range(4096)])
+
+
+    def testDivZeroExpression(self):
+        context = Context({})
+        value = expression('0/0', context)
+        self.assertEqual(value, None)
+        self.assertEqual(len(context.warnings), 0)
+        self.assertEqual(len(context.errors), 1)
+        
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,135 @@
+#! /usr/bin/env python3
+
+import os
+import tempfile
+import unittest
+
+import lexer
+from lexer import cacheStats, chunkSplit, compactFile, _fixPrefix, pruneCache, Token, tokenize, TokenStore
+
+
+class TestLexer(unittest.TestCase):
+
+    def setUp(self):
+        self.cacheDirectory = tempfile.TemporaryDirectory()
+        self.savedCacheDirectory = lexer.cacheDirectory
+        lexer.cacheDirectory = self.cacheDirectory.name
+
+    def tearDown(self):
+        lexer.cacheDirectory = self.savedCacheDirectory
+        self.cacheDirectory.cleanup()
+
+
+    def testFixPrefix(self):
+        self.assertEqual(_fixPrefix(''), '')
+        self.assertEqual(_fixPrefix('abc'), 'abc')
+        self.assertEqual(_fixPrefix('$1234'), '0x1234')
+        self.assertEqual(_fixPrefix('%010101'), '0b010101')
+
+
+    def testTokenize(self):
+        tokens = tokenize('label: lda #$12 ; comment\n.text "abc"\n\na <<= %01|b', 'test.asm')
+        self.assertEqual([t.string for t in tokens],
+            ['label', ':', 'lda', '#', '0x12', '\n', '.', 'text', 'f"abc"', '\n', '\n', 'a', '<<=', '0b01', '|', 'b', '\n'])
+        self.assertEqual(tokens[2].lineNumber, 1)
+        self.assertEqual(tokens[8].lineNumber, 2)
+        self.assertEqual(tokens[11].lineNumber, 4)
+        self.assertEqual(tokens[11].fileName, 'test.asm')
+
+        self.assertEqual(tokenize(''), [])
+        self.assertEqual(tokenize(None), [])
+        self.assertRaises(ValueError, tokenize, '.text "abc')
+
+
+    def testChunkSplit(self):
+        tokens = [Token('a'), Token('\n'), Token('b'), Token('c'), Token('\n'), Token('\n'), Token('d')]
+        for index, chunk in enumerate(chunkSplit(tokens)):
+            if index==0:
+                self.assertEqual(len(chunk), 1)
+                self.assertEqual(chunk[0].string, 'a')
+            if index==1:
+                self.assertEqual(len(chunk), 2)
+                self.assertEqual(chunk[0].string, 'b')
+                self.assertEqual(chunk[1].string, 'c')
+            if index==2:
+                self.assertEqual(len(chunk), 0)
+            if index==3:
+                self.assertEqual(len(chunk), 1)
+                self.assertEqual(chunk[0].string, 'd')
+
+
+    def testTokenStore(self):
+        store = TokenStore()
+        store.addTokens('a', tokenize('x: lda #1\n\nrts', 'a'))
+        store.addTokens('b', tokenize('nop'))
+
+        chunks = store['a']
+        self.assertEqual(len(chunks), 4)
+        self.assertEqual(list(chunks[0]), ['x', ':', 'lda', '#', '1'])
+        self.assertEqual(chunks[0][1], ':')
+        self.assertEqual(chunks[0][-1], '1')
+        self.assertEqual(chunks[0][2:].join(), 'lda#1')
+        self.assertEqual(chunks[0].join(3), '#1')
+        self.assertEqual(len(chunks[0][5:]), 0)
+        self.assertEqual(len(chunks[1]), 0)
+        self.assertEqual(chunks[2][0], 'rts')
+        self.assertEqual(chunks[2].lineNumber, 3)
+        self.assertEqual(chunks[2].fileName, 'a')
+        self.assertEqual(list(store['b'][0]), ['nop'])
+        store.addTokens('c', tokenize(''.join(['r', 'ts'])))
+        self.assertIs(store['c'][0][0], store['a'][2][0]) # interned
+        self.assertTrue('a' in store)
+        self.assertFalse('d' in store)
+
+        # adding identical chunks again reuses the stored ones
+        size = len(store.strings)
+        store.addTokens('b', tokenize('nop'))
+        self.assertEqual(len(store.strings), size)
+        store.addTokens('b', tokenize('brk'))
+        self.assertEqual(list(store['b'][0]), ['brk'])
+
+        # removed and replaced files are dropped from the storage by compact
+        store.remove('c')
+        self.assertFalse('c' in store)
+        self.assertEqual(store.garbage, 2)
+        store.compact()
+        self.assertEqual((len(store.strings), store.garbage), (7, 0))
+        self.assertEqual(list(store['a'][0]), ['x', ':', 'lda', '#', '1'])
+        self.assertEqual(store['a'][2].lineNumber, 3)
+        self.assertEqual(list(store['b'][0]), ['brk'])
+
+
+    def testCompactFileCache(self):
+        with tempfile.TemporaryDirectory() as directory:
+            fileName = os.path.join(directory, 'test.asm')
+            with open(fileName, 'w') as f:
+                f.write('lda #1\nrts\n')
+
+            hits, misses = cacheStats['hits'], cacheStats['misses']
+            strings, offsets, lineNumbers = compactFile(fileName)
+            self.assertEqual(strings, ['lda', '#', '1', 'rts'])
+            self.assertEqual(list(offsets), [0, 3, 4, 4, 4])
+            self.assertEqual(list(lineNumbers), [1, 2, 3, 4])
+            self.assertEqual(cacheStats['misses'], misses+1)
+
+            self.assertEqual(compactFile(fileName)[0], ['lda', '#', '1', 'rts'])
+            self.assertEqual(cacheStats['hits'], hits+1)
+
+            with open(fileName, 'w') as f:
+                f.write('nop\n')
+            self.assertEqual(compactFile(fileName)[0], ['nop'])
+            self.assertEqual(cacheStats['misses'], misses+2)
+
+            otherFileName = os.path.join(directory, 'other.asm')
+            with open(otherFileName, 'w') as f:
+                f.write('rts\n')
+            compactFile(otherFileName)
+            os.utime(lexer._cacheFileName(fileName), (0, 0)) # least recently used
+            pruneCache(os.path.getsize(lexer._cacheFileName(otherFileName)))
+            self.assertEqual(os.listdir(lexer.cacheDirectory), [os.path.basename(lexer._cacheFileName(otherFileName))])
+
+        
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,42 @@
+#! /usr/bin/env python3
+
+import os
+import subprocess
+import sys
+import unittest
+
+from benchmark import lazyModules
+from main import pairFiles
+
+
+class TestMain(unittest.TestCase):
+
+    def testStartupImports(self):
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        code = 'import sys, main; print(" ".join(sorted(sys.modules)))'
+        result = subprocess.run([sys.executable, '-c', code], cwd=root, capture_output=True, text=True)
+        modules = set(result.stdout.split())
+        self.assertIn('assemble', modules)
+        for name in lazyModules:
+            self.assertNotIn(name, modules)
+
+
+    def testPairFiles(self):
+        self.assertEqual(pairFiles([('-o', 'a.prg'), ('-v', ''), ('-a', 'a.asm')]), (['a.asm'], ['a.prg']))
+        self.assertEqual(pairFiles([('-a', 'a.asm')]), (['a.asm'], [None]))
+        self.assertEqual(pairFiles([('-a', 'a.asm'), ('-a', 'b.asm'), ('-o', 'b.prg')]), (['a.asm', 'b.asm'], [None, 'b.prg']))
+        self.assertRaises(ValueError, pairFiles, [('-o', 'a.prg'), ('-a', 'a.asm'), ('-a', 'b.asm')])
+        self.assertRaises(ValueError, pairFiles, [('-a', 'a.asm'), ('-o', 'a.prg'), ('-o', 'b.prg')])
+
+
+    def testInvalidOptions(self):
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        for options in [['-a', 'a.asm', '-o', 'a.prg', '-o', 'b.prg'], ['-o', 'a.prg', '-a', 'a.asm', '-a', 'b.asm'],
+                ['-a', 'a.asm', '-j', 'two'], ['-m', 'missing.txt']]:
+            result = subprocess.run([sys.executable, 'main.py'] + options, cwd=root, capture_output=True, text=True)
+            self.assertEqual(result.returncode, 2)
+            self.assertIn('Usage:', result.stdout)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+#! /usr/bin/env python3
+
+import unittest
+
+from memory import IntervalIndex, MemoryImage
+
+
+class TestMemory(unittest.TestCase):
+
+    def testWrite(self):
+        memory = MemoryImage()
+        self.assertEqual(len(memory), 0)
+        self.assertEqual(memory.bytes(), b'')
+
+        memory[0x1001] = 0x12
+        self.assertTrue(0x1001 in memory)
+        self.assertFalse(0x1000 in memory)
+        self.assertEqual(memory[0x1001], 0x12)
+
+        memory.write(0x0ffe, b'\x01\x02\x03\x04')
+        memory.write(0x1004, b'')
+        self.assertEqual(len(memory), 4)
+        self.assertEqual((memory.first, memory.last), (0x0ffe, 0x1001))
+
+        memory[0x1003] = 0xff
+        self.assertEqual(memory.bytes(), b'\x01\x02\x03\x04\x00\xff')
+        self.assertEqual(memory.pageUse()[0x0f:0x11], [2, 3])
+        self.assertEqual(memory.ranges(), [(0x0ffe, 0x1001), (0x1003, 0x1003)])
+        self.assertEqual(memory.ranges(1), [(0x0ffe, 0x1001), (0x1003, 0x1003)])
+        self.assertEqual(memory.ranges(2), [(0x0ffe, 0x1003)])
+
+
+    def testChanges(self):
+        memory = MemoryImage()
+        self.assertEqual(memory.takeChanges(), None)
+        memory[0x1000] = 1
+        memory[0x1003] = 2
+        first = memory.takeChanges()
+        self.assertEqual(first, (0x1000, b'\x01\x00\x00\x02', b'\x01\x00\x00\x01'))
+        memory.write(0x1002, b'\x03\x04\x05')
+        second = memory.takeChanges()
+
+        replayed = MemoryImage()
+        replayed.applyChanges(first)
+        replayed.applyChanges(second)
+        self.assertEqual(replayed, memory)
+        self.assertEqual((replayed.first, replayed.last, len(replayed)), (0x1000, 0x1004, 4))
+
+
+    def testCompare(self):
+        a = MemoryImage()
+        b = MemoryImage()
+        self.assertEqual(a, b)
+
+        a[0x2000] = 0
+        self.assertNotEqual(a, b) # a written zero differs from an unwritten byte
+        b.write(0x2000, b'\x00')
+        self.assertEqual(a, b)
+        b[0x2000] = 1
+        self.assertNotEqual(a, b)
+
+
+    def testIntervals(self):
+        intervals = IntervalIndex()
+        intervals.add(0x1000, 2, ('a', 0), 'start')
+        intervals.add(0x1002, 3, ('a', 1))
+        intervals.add(0x2000, 0, ('a', 2))
+        mark = intervals.mark()
+        intervals.add(0x1005, 1, ('a', 3))
+        intervals.add(0x1001, 2, ('a', 4))
+        self.assertEqual(len(intervals), 2)
+        self.assertEqual(repr(intervals.intervals[0]), '$1000-$1005 start at a:1')
+
+        earlier, later, first, last = intervals.overlaps()[0]
+        self.assertEqual((earlier.start, later.start, first, last), (0x1000, 0x1001, 0x1001, 0x1002))
+
+        restored = IntervalIndex()
+        restored.restore(intervals, mark)
+        self.assertEqual([(interval.start, interval.end) for interval in restored], [(0x1000, 0x1005)])
+        self.assertEqual(intervals.intervals[0].end, 0x1006)
+        self.assertEqual(restored.overlaps(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
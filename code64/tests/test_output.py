@@ -0,0 +1,138 @@
+#! /usr/bin/env python3
+
+import os
+import tempfile
+import unittest
+
+import lexer
+from memory import MemoryImage
+try:
+    from py65.devices.mpu6502 import MPU
+except ImportError:
+    MPU = None
+
+import cruncher
+from output import basicEntry, crunchedImage, linkedImage, save, segments
+
+
+class _C64Memory:
+    """ RAM with the banking of the C64, using the ROMs or I/O, or writing the CPU vectors, is an error """
+
+    def __init__(self):
+        self.ram = bytearray(0x10000)
+        self.ram[1] = 0x37 # BASIC, KERNAL and I/O
+
+    def _check(self, address: int, write: bool):
+        port = self.ram[1] & 7
+        if write and address >= 0xfffa:
+            raise AssertionError(f'CPU vector written: ${address:04x}')
+        if (0xa000 <= address < 0xc000 and port & 3 == 3 and not write) or (address >= 0xe000 and port & 2 and not write) \
+                or (0xd000 <= address < 0xe000 and port & 3 != 0):
+            raise AssertionError(f'ROM or I/O used: ${address:04x} with ${self.ram[1]:02x} at $01')
+
+    def __getitem__(self, address: int) -> int:
+        self._check(address, False)
+        return self.ram[address]
+
+    def __setitem__(self, address: int, value: int):
+        self._check(address, True)
+        self.ram[address] = value
+
+
+class TestOutput(unittest.TestCase):
+
+    def setUp(self):
+        self.savedCacheDirectory = lexer.cacheDirectory
+        lexer.cacheDirectory = None # keep the tests out of the user's chunk cache
+
+    def tearDown(self):
+        lexer.cacheDirectory = self.savedCacheDirectory
+
+    def _memory(self) -> MemoryImage:
+        memory = MemoryImage()
+        memory.write(0x0801, bytes([0x0b, 0x08, 0x0a, 0x00, 0x9e]) + b'4096' + bytes(3)) # 10 SYS 4096
+        memory.write(0x1000, b'\x4c\x00\x10') # jmp $1000
+        memory.write(0x1010, b'\x01')
+        memory.write(0xc000, bytes(range(256)) * 2)
+        return memory
+
+
+    def testSegments(self):
+        memory = self._memory()
+        self.assertEqual([start for start, data in segments(memory, 0)], [0x0801, 0x1000, 0x1010, 0xc000])
+        self.assertEqual([(start, len(data)) for start, data in segments(memory, 16)], [(0x0801, 12), (0x1000, 17), (0xc000, 512)])
+        self.assertEqual(basicEntry(memory), 4096)
+        self.assertEqual(basicEntry(MemoryImage()), None)
+
+        with tempfile.TemporaryDirectory() as directory:
+            fileName = os.path.join(directory, 'test.prg')
+            self.assertEqual(save(memory, fileName), [fileName])
+            self.assertEqual(os.path.getsize(fileName), 2 + 0xc200 - 0x0801)
+
+            fileNames = save(memory, fileName, 'segments', 256)
+            self.assertEqual([os.path.basename(name) for name in fileNames], ['test-0801.prg', 'test-1000.prg', 'test-c000.prg'])
+            with open(fileNames[1], 'rb') as f:
+                self.assertEqual(f.read(), b'\x00\x10\x4c\x00\x10' + bytes(13) + b'\x01')
+
+            fileNames = save(memory, os.path.join(directory, 'test.bin'), 'raw', 256)
+            with open(fileNames[2], 'rb') as f:
+                self.assertEqual(f.read(), bytes(range(256)) * 2)
+
+
+    def testLinked(self):
+        memory = self._memory()
+        image = linkedImage(memory, 256)
+        data = b''.join(data for start, data in segments(memory, 256))
+        self.assertEqual(image[:14], b'\x01\x08\x0b\x08\x0a\x00\x9e2061\x00\x00\x00')
+        self.assertEqual(image[-len(data):], data)
+        self.assertIn(b'\x4c\x00\x10', image[:-len(data)]) # jmp to the SYS address of the program
+
+        # the segments that move up are copied first from the top, the pointers start after their whole pages
+        source = 0x0801 + len(image) - 2 - 512
+        table = image.index(bytes([source & 0xff, (source >> 8) + 2, 0x00, 0xc2, 0x00, 0x02, 0x01]))
+        self.assertEqual(image[table+7+2:table+7+7], b'\x00\x10\x11\x00\x01')
+        self.assertEqual(image[table+7*2+2:table+7*2+7], b'\x01\x08\x0c\x00\x00') # $0801 moves down
+        self.assertEqual(image[table+7*3:table+7*4], b'\xff' * 7)
+
+        memory.write(0x0200, b'\x00')
+        with self.assertRaises(ValueError):
+            linkedImage(memory)
+
+
+    def testCrunched(self):
+        memory = self._memory()
+        image = crunchedImage(memory)
+        packed, _ = cruncher.crunch(memory.bytes())
+        self.assertEqual(image[:14], b'\x01\x08\x0b\x08\x0a\x00\x9e2061\x00\x00\x00')
+        self.assertLess(len(image), 0xc200 // 16)
+        self.assertIn(packed, image)
+        self.assertIn(b'\x4c\x00\x10', image[image.index(packed)+len(packed):]) # the decruncher jumps to 4096
+
+        memory.write(0xfff0, bytes(range(16)))
+        with self.assertRaises(ValueError):
+            crunchedImage(memory) # no room for the packed data above the program
+
+
+    @unittest.skipIf(MPU is None, 'py65 is not installed')
+    def testCrunchedRuns(self):
+        memory = MemoryImage()
+        memory.write(0x0801, bytes([0x0b, 0x08, 0x0a, 0x00, 0x9e]) + b'4096' + bytes(3)) # 10 SYS 4096
+        memory.write(0x1000, b'\x4c\x00\x10') # jmp $1000
+        memory.write(0x1800, bytes(range(256)) * 4 + bytes(x * 7 & 0xff for x in range(1000)))
+        image = crunchedImage(memory)
+
+        # from the SYS line of the image until the program starts, like on a C64
+        c64 = _C64Memory()
+        c64.ram[0x0801:0x0801+len(image)-2] = image[2:]
+        cpu = MPU(c64, 2061)
+        for _ in range(2000000):
+            if cpu.pc == 0x1000:
+                break
+            cpu.step()
+        self.assertEqual(cpu.pc, 0x1000)
+        self.assertEqual(c64.ram[1], 0x37)
+        self.assertEqual(bytes(c64.ram[memory.first:memory.last+1]), memory.bytes())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+#! /usr/bin/env python3
+
+import contextlib
+import io
+import json
+import os
+import pstats
+import tempfile
+import unittest
+
+import lexer
+from assemble import multiPass
+from profiler import Profiler
+
+
+class TestProfiler(unittest.TestCase):
+
+    def setUp(self):
+        self.savedCacheDirectory = lexer.cacheDirectory
+        lexer.cacheDirectory = None # keep the tests out of the user's chunk cache
+
+    def tearDown(self):
+        lexer.cacheDirectory = self.savedCacheDirectory
+
+    def testProfile(self):
+        source = '\n'.join([
+            '.org $1000',
+            'start: lda #0',
+            ' .bytefill 16, "x: x"',
+            ' @ldax(0x1234)',
+            ' .py "y = 1"',
+            ' jmp later',
+            'later: rts'])
+
+        with tempfile.TemporaryDirectory() as directory:
+            inFile = os.path.join(directory, 'test.asm')
+            with open(inFile, 'w') as f:
+                f.write(source)
+            profiler = Profiler(os.path.join(directory, 'profile.json'))
+            multiPass.profiler = profiler
+            try:
+                with contextlib.redirect_stdout(io.StringIO()) as output:
+                    self.assertFalse(multiPass(inFile, None))
+            finally:
+                multiPass.profiler = None
+
+            self.assertRegex(output.getvalue(), r'Profile: .*test.asm in [0-9.]+ ms')
+            self.assertIn('Saving profile:', output.getvalue())
+            records = {(category, name): count for _, count, category, name in profiler.hotSpots()}
+            lines = lambda category: sum(count for (c, _), count in records.items() if c == category)
+            self.assertEqual(records[('pass', 'Pass 1')], records[('pass', 'Pass 2')]) # later is a forward reference
+            self.assertEqual(lines('pass'), lines('file')) # the lines of the file and the generated lines
+            self.assertEqual(records[('file', f'{inFile}:4 @ldax(0x1234)')], 2 * 5)
+            self.assertEqual(records[('lex', inFile)], 1)
+            self.assertEqual(records[('node', 'instruction')], 2 * (3 + 2))
+            self.assertEqual(records[('node', '.bytefill')], 2)
+            self.assertEqual(records[('call', f'{inFile}:4 @ldax(0x1234)')], 2)
+            self.assertEqual(records[('call', f'{inFile}:5 .py f"y = 1"')], 2)
+            self.assertEqual(lines('call'), 4)
+
+            with open(profiler.dumpFile) as f:
+                dump = json.load(f)
+            self.assertEqual(len(dump['records']), len(records))
+            self.assertEqual(dump['records'][0]['seconds'], max(seconds for _, seconds in profiler.records.values()))
+
+            fileName = os.path.join(directory, 'profile.prof')
+            profiler.save(fileName)
+            stats = pstats.Stats(fileName).stats
+            self.assertEqual(stats[(inFile, 5, '.py f"y = 1"')][:2], (2, 2))
+            self.assertEqual(stats[('node', 0, '.bytefill')][:2], (2, 2))
+
+
+    def testCrunchedProfile(self):
+        with tempfile.TemporaryDirectory() as directory:
+            inFile = os.path.join(directory, 'test.asm')
+            with open(inFile, 'w') as f:
+                f.write('.org $1000\nstart: lda #0\n jmp start')
+            profiler = Profiler(os.path.join(directory, 'profile.json'))
+            multiPass.profiler = profiler
+            multiPass.outputMode = 'crunched'
+            try:
+                with contextlib.redirect_stdout(io.StringIO()):
+                    self.assertFalse(multiPass(inFile, os.path.join(directory, 'test.prg')))
+            finally:
+                multiPass.profiler = None
+                multiPass.outputMode = 'prg'
+
+            # the decruncher is assembled after the profile is saved, without changing it
+            with open(profiler.dumpFile) as f:
+                self.assertEqual(json.load(f)['file'], inFile)
+            self.assertEqual(profiler.inFile, inFile)
+            self.assertNotIn('decrunch.asm', ' '.join(name for _, name in profiler.records))
+
+
+if __name__ == '__main__':
+    unittest.main()
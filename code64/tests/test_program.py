@@ -0,0 +1,73 @@
+#! /usr/bin/env python3
+
+import unittest
+
+from cpu import AddressMode
+import lexer
+from program import Assignment, Directive, Generator, InvalidSyntax, Label, parseChunk, repeatEnds
+
+
+class TestProgram(unittest.TestCase):
+
+    def _parse(self, text: str) -> tuple:
+        store = lexer.TokenStore()
+        store.addTokens('test', lexer.tokenize(text))
+        return parseChunk(store['test'][0])
+
+
+    def testStatements(self):
+        label, instruction = self._parse('start: lda #1')
+        self.assertEqual(type(label), Label)
+        self.assertEqual(label.name, 'start')
+        self.assertEqual(instruction.mnemonic, 'lda')
+        self.assertEqual(instruction.operand, '#1')
+        self.assertEqual(instruction.mode, AddressMode.immediate)
+        self.assertEqual(instruction.expression, '1')
+
+        assignment, = self._parse('a = b + 1')
+        self.assertEqual((type(assignment), assignment.symbol, assignment.expression), (Assignment, 'a', 'b+1'))
+
+        directive, = self._parse('.byte 1, 2')
+        self.assertEqual((type(directive), directive.name, directive.expression), (Directive, 'byte', '1,2'))
+
+        generator, = self._parse('@basicStart()')
+        self.assertEqual((type(generator), generator.expression), (Generator, 'basicStart()'))
+
+        self.assertEqual(type(self._parse('1 2')[0]), InvalidSyntax)
+        self.assertEqual(self._parse(''), ())
+
+
+    def testAddressModes(self):
+        def modes(text):
+            instruction = self._parse(text)[0]
+            return instruction.mode, instruction.zeroPageMode, instruction.expression
+
+        self.assertEqual(modes('asl'), (AddressMode.accumulator, None, None))
+        self.assertEqual(modes('nop'), (AddressMode.implied, None, None))
+        self.assertEqual(modes('lda ($12,x)'), (AddressMode.indirectX, None, '0x12'))
+        self.assertEqual(modes('lda ($12),y'), (AddressMode.indirectY, None, '0x12'))
+        self.assertEqual(modes('jmp ($1234)'), (AddressMode.indirect, None, '0x1234'))
+        self.assertEqual(modes('lda (a+1)*2'), (AddressMode.absolute, AddressMode.zeroPage, '(a+1)*2'))
+        self.assertEqual(modes('bne loop'), (AddressMode.relative, None, 'loop'))
+        self.assertEqual(modes('lda a,x'), (AddressMode.absoluteX, AddressMode.zeroPageX, 'a'))
+        self.assertEqual(modes('stx a,y'), (None, AddressMode.zeroPageY, 'a'))
+        self.assertEqual(modes('jsr a'), (AddressMode.absolute, None, 'a'))
+        self.assertEqual(modes('lda.zp a,x'), (None, AddressMode.zeroPageX, 'a'))
+        self.assertEqual(modes('lda.abs a'), (AddressMode.absolute, None, 'a'))
+        self.assertEqual(modes('jmp.abs a'), (AddressMode.absolute, None, 'a'))
+        for hinted in ['jmp.zp a', 'lda.zp #1', 'lda.abs #1', 'stx.abs a,y', 'lda.zp (a),y']:
+            self.assertEqual(type(self._parse(hinted)[0]), InvalidSyntax, hinted)
+        self.assertEqual(self._parse('lda.abs a')[0].size, 'abs')
+        self.assertFalse(self._parse('nop 1')[0].isValid())
+        self.assertTrue(self._parse('sta 1')[0].isValid())
+
+
+    def testRepeatEnds(self):
+        store = lexer.TokenStore()
+        store.addTokens('test', lexer.tokenize('.repeat "i", 2\n.repeat "j", 3\nnop\n.endr\n.endr\n.repeat "k", 1\n.endr\n.endr'))
+        lines = [parseChunk(chunk) for chunk in (store['test'][i] for i in range(len(store['test'])))]
+        self.assertEqual(repeatEnds(lines), {0: 4, 1: 3, 5: 6})
+
+
+if __name__ == '__main__':
+    unittest.main()
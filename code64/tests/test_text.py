@@ -0,0 +1,50 @@
+#! /usr/bin/env python3
+
+import unittest
+
+import text
+from text import (chr, ENCODING_PETSCII_MIXED, ENCODING_PETSCII_UPPER, ENCODING_SCREEN_MIXED,
+    ENCODING_SCREEN_UPPER, ord)
+
+
+class TestPetscii(unittest.TestCase):
+
+    def testChr_A(self):
+        text.encoding = ENCODING_SCREEN_UPPER
+        self.assertEqual(chr(1), 'A')
+        text.encoding = ENCODING_SCREEN_MIXED
+        self.assertEqual(chr(65), 'A')
+        text.encoding = ENCODING_PETSCII_UPPER
+        self.assertEqual(chr(65), 'A')
+        text.encoding = ENCODING_PETSCII_MIXED
+        self.assertEqual(chr(97), 'A')
+
+    def testChr_a(self):
+        text.encoding = ENCODING_SCREEN_MIXED
+        self.assertEqual(chr(1), 'a')
+        text.encoding = ENCODING_PETSCII_MIXED
+        self.assertEqual(chr(65), 'a')
+
+    def testOrd_A(self):
+        text.encoding = ENCODING_SCREEN_UPPER
+        self.assertEqual(ord('A'), 1)
+        text.encoding = ENCODING_SCREEN_MIXED
+        self.assertEqual(ord('A'), 65)
+        text.encoding = ENCODING_PETSCII_UPPER
+        self.assertEqual(ord('A'), 65)
+        text.encoding = ENCODING_PETSCII_MIXED
+        self.assertEqual(ord('A'), 97)
+
+    def testOrd_a(self):
+        text.encoding = ENCODING_SCREEN_UPPER
+        self.assertEqual(ord('a'), None)
+        text.encoding = ENCODING_SCREEN_MIXED
+        self.assertEqual(ord('a'), 1)
+        text.encoding = ENCODING_PETSCII_UPPER
+        self.assertEqual(ord('a'), None)
+        text.encoding = ENCODING_PETSCII_MIXED
+        self.assertEqual(ord('a'), 65)
+
+
+if __name__ == '__main__':
+    unittest.main()
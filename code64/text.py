@@ -2,8 +2,6 @@
 
 # https://en.wikipedia.org/wiki/PETSCII
 
-import unittest
-
 ENCODING_SCREEN_UPPER = 0
 ENCODING_SCREEN_MIXED = 1
 ENCODING_PETSCII_UPPER = 2
@@ -91,50 +89,3 @@ def ord(char: str) -> int:
     """ from int to char """
     map = _ord[encoding]
     return map[char] if char in map else None
-
-class TestPetscii(unittest.TestCase):
-
-    def testChr_A(self):
-        global encoding
-        encoding = ENCODING_SCREEN_UPPER
-        self.assertEqual(chr(1), 'A')
-        encoding = ENCODING_SCREEN_MIXED
-        self.assertEqual(chr(65), 'A')
-        encoding = ENCODING_PETSCII_UPPER
-        self.assertEqual(chr(65), 'A')
-        encoding = ENCODING_PETSCII_MIXED
-        self.assertEqual(chr(97), 'A')
-
-    def testChr_a(self):
-        global encoding
-        encoding = ENCODING_SCREEN_MIXED
-        self.assertEqual(chr(1), 'a')
-        encoding = ENCODING_PETSCII_MIXED
-        self.assertEqual(chr(65), 'a')
-
-    def testOrd_A(self):
-        global encoding
-        encoding = ENCODING_SCREEN_UPPER
-        self.assertEqual(ord('A'), 1)
-        encoding = ENCODING_SCREEN_MIXED
-        self.assertEqual(ord('A'), 65)
-        encoding = ENCODING_PETSCII_UPPER
-        self.assertEqual(ord('A'), 65)
-        encoding = ENCODING_PETSCII_MIXED
-        self.assertEqual(ord('A'), 97)
-
-    def testOrd_a(self):
-        global encoding
-        encoding = ENCODING_SCREEN_UPPER
-        self.assertEqual(ord('a'), None)
-        encoding = ENCODING_SCREEN_MIXED
-        self.assertEqual(ord('a'), 1)
-        encoding = ENCODING_PETSCII_UPPER
-        self.assertEqual(ord('a'), None)
-        encoding = ENCODING_PETSCII_MIXED
-        self.assertEqual(ord('a'), 65)
-
-if __name__ == '__main__':
-    unittest.main()
-
-# IDEA: support ASCII encoding